@@ -1,7 +1,15 @@
+import operator
+
 from rest_framework import filters
-from django.db.models import Q
+from django.core.exceptions import (
+    FieldDoesNotExist,
+    FieldError,
+    ObjectDoesNotExist,
+)
+from django.db.models import Field, Model, Q
+from django.db.models.constants import LOOKUP_SEP
 
-from typing import List
+from typing import Callable, List, NamedTuple, Set, Type
 
 
 class ParseError(Exception):
@@ -14,6 +22,111 @@ class ParseError(Exception):
         return "%s at position %s" % (self.msg % self.args, self.pos)
 
 
+# lookups of the Q objects built by AdvancedFilter, as comparisons in python
+PREDICATE_LOOKUPS = {
+    "exact": operator.eq,
+    "gt": operator.gt,
+    "gte": operator.ge,
+    "lt": operator.lt,
+    "lte": operator.le,
+}
+
+
+class _Lookup(NamedTuple):
+    attributes: List[str]  # followed from the instance (eg: user, username)
+    field: Field  # compared
+    compare: Callable
+    relations: List[str]  # followed, as select_related() paths (eg: user)
+
+
+def _resolve_lookup(lookup: str, model: Type[Model]) -> _Lookup:
+    "resolve a lookup (eg: user__username__gt) of a Q object on `model`"
+    parts = lookup.split(LOOKUP_SEP)
+    compare = PREDICATE_LOOKUPS["exact"]
+    if len(parts) > 1 and parts[-1] in PREDICATE_LOOKUPS:
+        compare = PREDICATE_LOOKUPS[parts.pop()]
+
+    attributes = []
+    relations = []
+    field = None
+    for index, part in enumerate(parts):
+        if model is None:
+            raise FieldError("Unsupported lookup '%s'" % lookup)
+        try:
+            field = model._meta.pk if part == "pk" else model._meta.get_field(part)
+        except FieldDoesNotExist:
+            raise FieldError("Cannot resolve keyword '%s' into field" % part)
+        if field.many_to_many or field.one_to_many:
+            raise FieldError("Unsupported lookup '%s'" % lookup)
+        if field.is_relation and index == len(parts) - 1:
+            # compared by its key (eg: user eq 3)
+            attributes.append(field.attname)
+            field = field.target_field
+            model = None
+        else:
+            attributes.append(field.name)
+            if field.is_relation:
+                relations.append(LOOKUP_SEP.join(attributes))
+            model = field.related_model if field.is_relation else None
+    return _Lookup(attributes, field, compare, relations)
+
+
+def _lookup_predicate(lookup: str, value, model: Type[Model]) -> Callable:
+    "a predicate for a lookup (eg: user__username__gt) of a Q object"
+    attributes, field, compare, _ = _resolve_lookup(lookup, model)
+
+    # raises ValidationError, like the query would (eg: naive datetimes are
+    # made aware)
+    expected = field.get_prep_value(field.to_python(value))
+
+    def predicate(instance) -> bool:
+        for attribute in attributes:
+            if instance is None:
+                break
+            try:
+                instance = getattr(instance, attribute)
+            except ObjectDoesNotExist:
+                # eg: no related object on a reverse one-to-one
+                instance = None
+        if instance is None:
+            # like NULL in SQL
+            return False
+        try:
+            return compare(instance, expected)
+        except TypeError:
+            return False
+
+    return predicate
+
+
+def compile_q(q: Q, model: Type[Model]) -> Callable:
+    """compile a Q object built by AdvancedFilter to a predicate on instances of
+    `model`. It follows the relations of related_paths(): without queries if
+    they were loaded with the instances (select_related)"""
+    predicates = [
+        compile_q(child, model)
+        if isinstance(child, Q)
+        else _lookup_predicate(*child, model)
+        for child in q.children
+    ]
+    combine = all if q.connector == Q.AND else any
+
+    if q.negated:
+        return lambda instance: not combine(p(instance) for p in predicates)
+    return lambda instance: combine(p(instance) for p in predicates)
+
+
+def related_paths(q: Q, model: Type[Model]) -> Set[str]:
+    "the relations followed by compile_q(q), as select_related() paths"
+    paths = set()
+    for child in q.children:
+        if isinstance(child, Q):
+            paths |= related_paths(child, model)
+        else:
+            paths.update(_resolve_lookup(child[0], model).relations)
+    return paths
+
+
 class AdvancedFilter(filters.BaseFilterBackend):
     """
     Allow advaced filtering.
@@ -166,6 +279,11 @@ class AdvancedFilter(filters.BaseFilterBackend):
             if self.q_pos >= self.q_len:
                 raise ParseError(start, "Unmatched field delimiter")
 
+            # skip the ending delimiter
+            self.q_field_stack.append(self.query_string[start : self.q_pos])
+            self.q_pos += 1
+            return
+
         else:
             # there is no string delimiter (eg: a number)
             field_end_chars = [*self.WHITESPACE_CHARS, *self.EXPR_DELIMITER.values()]
@@ -0,0 +1,96 @@
+"Ad-hoc grouped aggregations over activities (group-by + sum/avg/count/min/max)"
+
+import datetime
+from typing import Dict, List
+
+from django.db.models import Avg, Count, F, Max, Min, QuerySet, Sum
+from django.db.models.functions import (
+    ExtractMonth,
+    ExtractWeek,
+    ExtractWeekDay,
+    ExtractYear,
+)
+from rest_framework.fields import DurationField
+
+# name -> expression. weekday: 1 (sunday) to 7 (saturday)
+GROUP_BY_DIMENSIONS = {
+    "user": F("user__username"),
+    "weather": F("weather__title"),
+    "date": F("date"),
+    "year": ExtractYear("date"),
+    "month": ExtractMonth("date"),
+    "week": ExtractWeek("date"),
+    "weekday": ExtractWeekDay("date"),
+}
+
+AGGREGATE_FUNCTIONS = {
+    "sum": Sum,
+    "avg": Avg,
+    "min": Min,
+    "max": Max,
+}
+
+AGGREGATE_FIELDS = ["distance", "duration"]
+
+
+class AggregationError(ValueError):
+    pass
+
+
+def parse_list(value: str) -> List[str]:
+    return [item.strip() for item in (value or "").split(",") if item.strip()]
+
+
+def build_aggregation(
+    queryset: QuerySet, group_by: List[str], metrics: List[str]
+) -> QuerySet:
+    """Compile whitelisted dimensions and metrics ("count", "<function>:<field>")
+    into a single values().annotate() query"""
+    if not group_by:
+        raise AggregationError("group_by is required")
+    if not metrics:
+        metrics = ["count"]
+
+    dimensions = {}
+    for name in group_by:
+        if name not in GROUP_BY_DIMENSIONS:
+            raise AggregationError(
+                "Invalid group_by %s. Options: %s"
+                % (name, ", ".join(GROUP_BY_DIMENSIONS))
+            )
+        dimensions[name] = GROUP_BY_DIMENSIONS[name]
+
+    aggregates = {}
+    for metric in metrics:
+        if metric == "count":
+            aggregates["count"] = Count("id")
+            continue
+
+        function, _, field = metric.partition(":")
+        if function not in AGGREGATE_FUNCTIONS or field not in AGGREGATE_FIELDS:
+            raise AggregationError(
+                "Invalid metric %s. Use count or <function>:<field>, with function in "
+                "(%s) and field in (%s)"
+                % (metric, ", ".join(AGGREGATE_FUNCTIONS), ", ".join(AGGREGATE_FIELDS))
+            )
+        aggregates["%s_%s" % (function, field)] = AGGREGATE_FUNCTIONS[function](field)
+
+    return (
+        queryset.order_by()
+        .annotate(**{"_%s" % name: expr for name, expr in dimensions.items()})
+        .values(*["_%s" % name for name in dimensions])
+        .annotate(**aggregates)
+        .order_by(*["_%s" % name for name in dimensions])
+    )
+
+
+def to_representation(row: Dict) -> Dict:
+    "strip the dimension prefixes and render values like the API does"
+    result = {}
+    for key, value in row.items():
+        if isinstance(value, datetime.timedelta):
+            value = DurationField().to_representation(value)
+        elif isinstance(value, float):
+            value = round(value, 3)
+        result[key[1:] if key.startswith("_") else key] = value
+    return result
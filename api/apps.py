@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class ApiConfig(AppConfig):
     name = 'api'
+
+    def ready(self):
+        # connect the activities_changed receivers
+        from . import caching, rollups  # noqa: F401
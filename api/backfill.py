@@ -0,0 +1,136 @@
+"""Backfill of the weather of existing activities
+
+Activities without weather (eg: saved during an OWM outage, or before the OWM
+key was configured) are selected in chunks ordered by id (keyset pagination:
+resumable from the last id). Activities of the same place and hour share one
+lookup, and lookups run in a bounded thread pool under a requests per second
+limit.
+"""
+
+import datetime
+import threading
+import time
+from collections import defaultdict
+from typing import Iterator, List, NamedTuple, Optional
+
+from django.utils import timezone
+
+from .concurrency import parallel_map
+from .external_sources import AbstractWeatherProvider, WeatherProvider
+from .models import Activity, Weather, WeatherStatus
+from .signals import activities_changed
+from .weather_cache import cache_key
+
+
+class RateLimiter:
+    "spaces calls to acquire() at least 1/rate seconds apart, across threads"
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+class ChunkResult(NamedTuple):
+    last_id: int
+    activities: int
+    lookups: int
+    filled: int
+
+
+def missing_weather(after_id: int = 0):
+    "activities with coordinates and without weather, not queued for enrichment"
+    return (
+        Activity.objects.filter(
+            id__gt=after_id,
+            weather__isnull=True,
+            latitude__isnull=False,
+            longitude__isnull=False,
+        )
+        .exclude(weather_status=WeatherStatus.PENDING.value)
+        .order_by("id")
+    )
+
+
+def backfill_weather(
+    after_id: int = 0,
+    chunk_size: int = 500,
+    workers: int = 4,
+    rate: float = 1.0,
+    provider: Optional[AbstractWeatherProvider] = None,
+) -> Iterator[ChunkResult]:
+    "fill the missing weather of activities with id > after_id, one chunk at a time"
+    provider = provider or WeatherProvider()
+    limiter = RateLimiter(rate)
+
+    def lookup(activity: Activity):
+        limiter.acquire()
+        return provider.getWeather(
+            float(activity.latitude),
+            float(activity.longitude),
+            when=datetime.datetime.combine(activity.date, activity.time),
+        )
+
+    while True:
+        chunk = list(
+            missing_weather(after_id).only(
+                "id", "user_id", "date", "time", "latitude", "longitude"
+            )[:chunk_size]
+        )
+        if not chunk:
+            return
+        after_id = chunk[-1].id
+
+        by_key = defaultdict(list)
+        for activity in chunk:
+            by_key[
+                cache_key(
+                    float(activity.latitude),
+                    float(activity.longitude),
+                    datetime.datetime.combine(activity.date, activity.time),
+                )
+            ].append(activity)
+
+        keys = list(by_key)
+        weathers = parallel_map(
+            lookup, [by_key[key][0] for key in keys], workers=workers
+        )
+
+        now = timezone.now()
+        updated = []
+        for key, weather_dict in zip(keys, weathers):
+            weather = (
+                None if weather_dict is None else Weather.get_or_create(**weather_dict)
+            )
+            if weather is None:
+                continue
+            for activity in by_key[key]:
+                activity.weather = weather
+                activity.weather_status = WeatherStatus.DONE.value
+                activity.updated_at = now
+                activity.change_seq = None
+                updated.append(activity)
+
+        Activity.objects.bulk_update(
+            updated, ["weather", "weather_status", "updated_at", "change_seq"]
+        )
+        _notify(updated)
+
+        yield ChunkResult(after_id, len(chunk), len(keys), len(updated))
+
+
+def _notify(activities: List[Activity]):
+    "bulk_update() doesn't call Activity.save(): send activities_changed per user"
+    dates_by_user = defaultdict(set)
+    for activity in activities:
+        dates_by_user[activity.user_id].add(activity.date)
+    for user_id, dates in dates_by_user.items():
+        activities_changed.send(sender=Activity, user_id=user_id, dates=dates)
@@ -0,0 +1,249 @@
+"""Bulk creation and update of activities
+
+Watch and phone syncs upload dozens of runs at once. They are validated
+together (with their owners resolved in one query), their weather is looked up
+once per place and hour, concurrently and before the transaction, and they are
+written with bulk_create/bulk_update in a single transaction.
+
+Admins also update or delete every activity matching a filter, with a single
+UPDATE/DELETE statement.
+"""
+
+import datetime
+import logging
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, IntegerField, QuerySet
+from django.db.models.functions import Cast, Round
+from django.utils import timezone
+from rest_framework import serializers
+
+from .concurrency import parallel_map
+from .deadlines import WeatherUnavailable
+from .external_sources import WeatherDict, WeatherProvider
+from .models import (
+    Activity,
+    ActivityTombstone,
+    User,
+    Weather,
+    WeatherJob,
+    WeatherStatus,
+)
+from .serializers import ActivitySerializer
+from .signals import activities_changed
+from .weather_cache import cache_key
+
+logger = logging.getLogger(__name__)
+
+# fields set by update_matching(). The weather depends on the others
+MATCHING_UPDATE_FIELDS = ("distance", "duration")
+
+UPDATE_FIELDS = (
+    "date",
+    "time",
+    "distance",
+    "duration",
+    "latitude",
+    "longitude",
+    "user",
+    "weather",
+    "weather_status",
+    # bulk_update() doesn't set them (see sync.py)
+    "updated_at",
+    "change_seq",
+)
+
+
+def resolve_users(items: Iterable) -> Dict[str, User]:
+    "the users named by the items' `user`, by username (in a single query)"
+    usernames = {
+        item["user"]
+        for item in items
+        if isinstance(item, dict) and isinstance(item.get("user"), str)
+    }
+    if not usernames:
+        return {}
+    return {
+        user.username: user
+        for user in User.objects.filter(is_superuser=False, username__in=usernames)
+    }
+
+
+def _lookup(activity: Activity) -> Tuple[Optional[WeatherDict], WeatherStatus]:
+    "(weather dict, status) of an activity, as Activity.save() would fetch them"
+    try:
+        weather_dict = WeatherProvider().getWeather(
+            float(activity.latitude),
+            float(activity.longitude),
+            when=datetime.datetime.combine(activity.date, activity.time),
+            quiet_fail=False,
+        )
+        return weather_dict, WeatherStatus.DONE
+    except WeatherUnavailable:
+        # eg: out of quota: deferred to the process_weather_jobs worker
+        return None, WeatherStatus.PENDING
+    except Exception as e:  # pylint: disable=broad-except
+        logger.error("Could not get the weather: %s", e)
+        return None, WeatherStatus.DONE
+
+
+def look_up_weather(activities: List[Activity], workers: int) -> List[Activity]:
+    """set the weather of the activities whose weather is outdated (like
+    Activity.save() does), with one lookup per place and hour, in `workers`
+    threads. Returns the activities that were outdated"""
+    outdated = [activity for activity in activities if activity.weather_outdated()]
+
+    by_key = defaultdict(list)
+    for activity in outdated:
+        activity.weather = None
+        if activity.latitude is None or activity.longitude is None:
+            activity.weather_status = WeatherStatus.DONE.value
+        elif settings.WEATHER_ENRICHMENT_ASYNC:
+            activity.weather_status = WeatherStatus.PENDING.value
+        else:
+            by_key[
+                cache_key(
+                    float(activity.latitude),
+                    float(activity.longitude),
+                    datetime.datetime.combine(activity.date, activity.time),
+                )
+            ].append(activity)
+
+    keys = list(by_key)
+    results = parallel_map(_lookup, [by_key[key][0] for key in keys], workers)
+    for key, (weather_dict, weather_status) in zip(keys, results):
+        weather = (
+            None if weather_dict is None else Weather.get_or_create(**weather_dict)
+        )
+        for activity in by_key[key]:
+            activity.weather = weather
+            activity.weather_status = weather_status.value
+
+    return outdated
+
+
+def insert_activities(activities: List[Activity]) -> None:
+    "insert the activities as they are (no weather lookup), setting their ids"
+    if connection.features.can_return_rows_from_bulk_insert:
+        Activity.objects.bulk_create(activities)
+    else:
+        # eg: sqlite doesn't return the ids: one insert per activity, skipping
+        # Activity.save(), which would look the weather up again
+        with transaction.atomic():
+            for activity in activities:
+                activity.save_base(force_insert=True)
+
+
+def save_activities(
+    created: List[Activity], updated: List[Activity], workers: int = 1
+) -> None:
+    """look the weather up and save the activities, in a single transaction.
+    Sends activities_changed once per user"""
+    outdated = look_up_weather(created + updated, workers)
+
+    now = timezone.now()
+    for activity in updated:
+        activity.updated_at = now
+        activity.change_seq = None
+    with transaction.atomic():
+        insert_activities(created)
+        ActivityTombstone.record_moves(updated)
+        Activity.objects.bulk_update(updated, UPDATE_FIELDS)
+
+        pending = [
+            activity.id
+            for activity in outdated
+            if activity.weather_status == WeatherStatus.PENDING.value
+        ]
+        if pending:
+            WeatherJob.enqueue(pending)
+
+    notify(created + updated)
+
+
+def notify(activities: List[Activity]):
+    "send activities_changed per user, for the current and loaded owner/date"
+    dates_by_user = defaultdict(set)
+    for activity in activities:
+        loaded = getattr(activity, "_loaded_values", {})
+        dates_by_user[activity.user_id].add(activity.date)
+        dates_by_user[loaded.get("user_id", activity.user_id)].add(
+            loaded.get("date", activity.date)
+        )
+    for user_id, dates in dates_by_user.items():
+        activities_changed.send(sender=Activity, user_id=user_id, dates=dates)
+
+
+class BulkUpdateError(ValueError):
+    "invalid values for update_matching()"
+
+
+def matching_updates(data) -> dict:
+    """the values of a set-based update, from {field: value}. The distance may
+    also be multiplied: {"distance": {"multiply": 1000}} (eg: to fix units)"""
+    if not isinstance(data, dict) or not data:
+        raise BulkUpdateError(
+            "Expected the fields to set: %s" % ", ".join(MATCHING_UPDATE_FIELDS)
+        )
+    unknown = sorted(set(data) - set(MATCHING_UPDATE_FIELDS))
+    if unknown:
+        raise BulkUpdateError(
+            "Only %s can be set on matching activities, not %s"
+            % (", ".join(MATCHING_UPDATE_FIELDS), ", ".join(unknown))
+        )
+
+    fields = ActivitySerializer().fields
+    values = {}
+    for field, value in data.items():
+        if field == "distance" and isinstance(value, dict):
+            factor = value.get("multiply")
+            if (
+                set(value) != {"multiply"}
+                or isinstance(factor, bool)
+                or not isinstance(factor, (int, float))
+                or factor < 0
+            ):
+                raise BulkUpdateError(
+                    'Expected {"multiply": <positive number>} for distance'
+                )
+            values[field] = Cast(Round(F(field) * factor), IntegerField())
+            continue
+        try:
+            values[field] = fields[field].run_validation(value)
+        except serializers.ValidationError as e:
+            raise BulkUpdateError("%s: %s" % (field, " ".join(map(str, e.detail))))
+    return values
+
+
+def _dates_by_user(queryset: QuerySet) -> Dict[int, set]:
+    dates_by_user = defaultdict(set)
+    for user_id, date in (
+        queryset.order_by().values_list("user_id", "date").distinct().iterator()
+    ):
+        dates_by_user[user_id].add(date)
+    return dates_by_user
+
+
+def update_matching(queryset: QuerySet, values: Optional[dict] = None) -> int:
+    """update the activities of `queryset` with `values` (see matching_updates),
+    or delete them when None, in a single statement. Sends activities_changed
+    for the dates affected. Returns the number of activities"""
+    with transaction.atomic():
+        dates_by_user = _dates_by_user(queryset)
+        if values is None:
+            ActivityTombstone.record(queryset.order_by().values_list("id", "user_id"))
+            # no signals nor cascades on Activity: a single DELETE (orphan
+            # weather jobs are dropped by the worker)
+            _, deleted = queryset.delete()
+            count = deleted.get(Activity._meta.label, 0)
+        else:
+            count = queryset.update(
+                updated_at=timezone.now(), change_seq=None, **values
+            )
+
+    for user_id, dates in dates_by_user.items():
+        activities_changed.send(sender=Activity, user_id=user_id, dates=dates)
+    return count
@@ -0,0 +1,46 @@
+"""Caching of results derived from a user's activities
+
+Cache keys embed a per-user generation number, bumped whenever the user's
+activities change: stale entries are never read again and just expire.
+Results spanning every user (eg: admin queries) use the global generation,
+which is bumped on any change.
+"""
+
+import hashlib
+from typing import Optional
+
+from django.core.cache import cache
+from django.dispatch import receiver
+
+from .signals import activities_changed
+
+ALL_USERS = "all"
+
+
+def _generation_key(scope) -> str:
+    return "activities-generation:%s" % scope
+
+
+def generation(scope) -> int:
+    return cache.get_or_set(_generation_key(scope), 1, timeout=None)
+
+
+def bump_generation(scope):
+    try:
+        cache.incr(_generation_key(scope))
+    except ValueError:
+        # not cached yet (or evicted): any new value invalidates the old keys
+        cache.set(_generation_key(scope), 2, timeout=None)
+
+
+def cache_key(namespace: str, user_id: Optional[int], *parts) -> str:
+    "key for a result of `namespace`, over the activities of user_id (None: all)"
+    scope = ALL_USERS if user_id is None else user_id
+    digest = hashlib.sha1(repr(parts).encode()).hexdigest()
+    return "%s:%s:%s:%s" % (namespace, scope, generation(scope), digest)
+
+
+@receiver(activities_changed)
+def invalidate_user_cache(sender, user_id: int, **kwargs):
+    bump_generation(user_id)
+    bump_generation(ALL_USERS)
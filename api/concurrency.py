@@ -0,0 +1,26 @@
+"""Running database-backed work in a pool of threads"""
+
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, List
+
+from django.db import connection, connections
+
+
+def parallel_map(function: Callable, items: Iterable, workers: int) -> List:
+    """map `function` over items in a pool of threads. Sequential within a
+    transaction (eg: tests), which other threads' connections would not see"""
+    if workers <= 1 or connection.in_atomic_block:
+        return [function(item) for item in items]
+
+    def run(item):
+        try:
+            # in a copy of the caller's context: eg: the lookups get its deadline
+            return context.copy().run(function, item)
+        finally:
+            # each thread has its own connection (eg: weather cache lookups)
+            connections.close_all()
+
+    context = contextvars.copy_context()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(run, items))
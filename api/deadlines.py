@@ -0,0 +1,63 @@
+"""Deadlines for weather lookups
+
+A deadline bounds the total time spent on weather lookups (eg: within one
+request): every upstream call gets at most the time that is left.
+"""
+
+import contextlib
+import contextvars
+import time
+from typing import Optional
+
+# time.monotonic() value after which lookups are given up (None: no deadline)
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar(
+    "weather_deadline", default=None
+)
+
+
+class WeatherUnavailable(Exception):
+    "the weather was not looked up (deadline exceeded, circuit open, ...)"
+
+
+class DeadlineExceeded(WeatherUnavailable):
+    pass
+
+
+class CircuitOpen(WeatherUnavailable):
+    pass
+
+
+class QuotaExceeded(WeatherUnavailable):
+    pass
+
+
+@contextlib.contextmanager
+def deadline(seconds: float):
+    "limit the weather lookups in this context to `seconds` (nested ones included)"
+    expires = time.monotonic() + seconds
+    current = _deadline.get()
+    if current is not None:
+        expires = min(expires, current)
+    token = _deadline.set(expires)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    "seconds left until the current deadline (None: no deadline)"
+    expires = _deadline.get()
+    if expires is None:
+        return None
+    return max(expires - time.monotonic(), 0.0)
+
+
+def call_timeout(timeout: float) -> float:
+    "timeout for one upstream call: `timeout`, capped by the current deadline"
+    left = remaining()
+    if left is None:
+        return timeout
+    if left <= 0:
+        raise DeadlineExceeded("weather lookup deadline exceeded")
+    return min(timeout, left)
@@ -0,0 +1,120 @@
+"""Deletion of users and their data
+
+Deleting a user with Django's collector cascades to every activity in a single
+transaction. Here the activities (and their weather jobs) are deleted with
+set-based deletes of USER_DELETION_CHUNK_SIZE rows, each in its own short
+transaction recording their tombstones (for the sync feed), and the rollups
+are dropped (taking the user's totals out of the percentile sketches) before
+the user row itself.
+
+With USER_DELETION_ASYNC, the API only deactivates the user and queues a
+UserDeletionJob, processed by the process_user_deletions worker.
+"""
+
+import datetime
+import logging
+from typing import NamedTuple, Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from .caching import ALL_USERS, bump_generation
+from .models import (
+    Activity,
+    ActivityTombstone,
+    User,
+    UserDeletionJob,
+    WeatherJob,
+)
+from .rollups import remove_user_rollups
+
+logger = logging.getLogger(__name__)
+
+
+class DeletionResult(NamedTuple):
+    activities: int
+    chunks: int
+
+
+def delete_activities(user_id: int, chunk_size: int) -> DeletionResult:
+    "delete the activities of a user, `chunk_size` at a time"
+    activities = chunks = 0
+    while True:
+        with transaction.atomic():
+            ids = list(
+                Activity.objects.filter(user_id=user_id)
+                .order_by()
+                .values_list("id", flat=True)[:chunk_size]
+            )
+            if not ids:
+                break
+            WeatherJob.objects.filter(activity_id__in=ids).delete()
+            ActivityTombstone.record([(id, user_id) for id in ids])
+            # no signals nor cascades on Activity: a single DELETE
+            Activity.objects.filter(id__in=ids).delete()
+        activities += len(ids)
+        chunks += 1
+    return DeletionResult(activities, chunks)
+
+
+def delete_user(user_id: int, chunk_size: Optional[int] = None) -> DeletionResult:
+    """delete a user, its activities and rollups. Can be run again after a
+    failure: it resumes where it stopped"""
+    result = delete_activities(user_id, chunk_size or settings.USER_DELETION_CHUNK_SIZE)
+    remove_user_rollups(user_id)
+    with transaction.atomic():
+        # what's left is small (eg: tokens, admin log entries, permissions)
+        User.objects.filter(id=user_id).delete()
+        UserDeletionJob.objects.filter(user_id=user_id).delete()
+
+    bump_generation(user_id)
+    bump_generation(ALL_USERS)
+    return result
+
+
+def schedule_user_deletion(user: User):
+    """deactivate a user (logging it out) and queue its deletion. The user and
+    its activities remain visible until the worker deletes them"""
+    with transaction.atomic():
+        User.objects.filter(id=user.id).update(is_active=False)
+        Token.objects.filter(user_id=user.id).delete()
+        UserDeletionJob.objects.get_or_create(
+            user_id=user.id, defaults={"run_after": timezone.now()}
+        )
+
+
+def claim_deletion_jobs(batch_size: int):
+    "claim up to batch_size due jobs, leased USER_DELETION_LEASE seconds"
+    now = timezone.now()
+    lease = now + datetime.timedelta(seconds=settings.USER_DELETION_LEASE)
+    with transaction.atomic():
+        jobs = list(
+            UserDeletionJob.objects.select_for_update(skip_locked=True)
+            .filter(run_after__lte=now)
+            .order_by("run_after")[:batch_size]
+        )
+        UserDeletionJob.objects.filter(id__in=[job.id for job in jobs]).update(
+            run_after=lease
+        )
+    return jobs
+
+
+def process_user_deletions(batch_size: int = 1) -> int:
+    "Process due user deletions. Returns the number of jobs processed"
+    jobs = claim_deletion_jobs(batch_size)
+    for job in jobs:
+        try:
+            result = delete_user(job.user_id)
+        except Exception as e:  # pylint: disable=broad-except
+            logger.error("Could not delete user %s: %s", job.user_id, e)
+            job.attempts += 1
+            job.last_error = str(e)
+            job.run_after = timezone.now() + datetime.timedelta(
+                seconds=settings.USER_DELETION_BACKOFF * 2 ** (job.attempts - 1)
+            )
+            job.save(update_fields=["attempts", "last_error", "run_after"])
+            continue
+        logger.info("Deleted user %s and %d activities", job.user_id, result.activities)
+    return len(jobs)
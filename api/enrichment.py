@@ -0,0 +1,142 @@
+"""Asynchronous weather enrichment of activities
+
+Activities saved with WEATHER_ENRICHMENT_ASYNC get a WeatherJob (in the same
+transaction). The process_weather_jobs worker claims due jobs in batches, fetches
+the weather, and retries failures with exponential backoff.
+"""
+
+import datetime
+import logging
+from typing import Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .deadlines import WeatherUnavailable
+from .external_sources import AbstractWeatherProvider, WeatherProvider
+from .models import Activity, WeatherJob, WeatherStatus
+from .signals import activities_changed
+
+logger = logging.getLogger(__name__)
+
+
+def claim_jobs(batch_size: int):
+    """Claim up to batch_size due jobs. Claimed jobs are leased (pushed to the
+    future), so other workers skip them even without row locks (eg: sqlite)"""
+    now = timezone.now()
+    lease = now + datetime.timedelta(seconds=settings.WEATHER_JOB_LEASE)
+    with transaction.atomic():
+        jobs = list(
+            WeatherJob.objects.select_for_update(skip_locked=True)
+            .filter(run_after__lte=now)
+            .order_by("run_after")[:batch_size]
+        )
+        WeatherJob.objects.filter(id__in=[job.id for job in jobs]).update(
+            run_after=lease
+        )
+    for job in jobs:
+        job.run_after = lease
+    return jobs
+
+
+def _claimed(job):
+    """the job, if still as claimed: not re-enqueued (eg: the activity moved),
+    nor claimed again by another worker after its lease"""
+    return WeatherJob.objects.filter(
+        id=job.id, run_after=job.run_after, attempts=job.attempts
+    )
+
+
+def backoff(attempts: int) -> datetime.timedelta:
+    return datetime.timedelta(
+        seconds=settings.WEATHER_JOB_BACKOFF * 2 ** (attempts - 1)
+    )
+
+
+def process_weather_jobs(
+    batch_size: Optional[int] = None, provider: Optional[AbstractWeatherProvider] = None
+) -> int:
+    "Process a batch of due weather jobs. Returns the number of jobs processed"
+    jobs = claim_jobs(batch_size or settings.WEATHER_JOB_BATCH_SIZE)
+    if not jobs:
+        return 0
+
+    provider = provider or WeatherProvider()
+    activities = Activity.objects.in_bulk([job.activity_id for job in jobs])
+
+    for job in jobs:
+        activity = activities.get(job.activity_id)
+        if activity is None:
+            # the activity was deleted meanwhile
+            job.delete()
+            continue
+
+        try:
+            weather = activity.fetch_weather(quiet_fail=False, provider=provider)
+        except WeatherUnavailable as e:
+            # not the activity's fault (eg: circuit open): retry, keeping attempts
+            _postpone(job, activity, e)
+            continue
+        except Exception as e:  # pylint: disable=broad-except
+            _retry_or_fail(job, activity, e)
+            continue
+
+        _complete(job, activity, weather, WeatherStatus.DONE)
+
+    return len(jobs)
+
+
+def _complete(job, activity, weather, weather_status: WeatherStatus):
+    with transaction.atomic():
+        if not _claimed(job).delete()[0]:
+            # re-enqueued meanwhile: the weather is stale, left to the new job
+            return
+        # update() doesn't call Activity.save(): no weather lookup, no job enqueued
+        Activity.objects.filter(id=activity.id).update(
+            weather=weather,
+            weather_status=weather_status.value,
+            updated_at=timezone.now(),
+            change_seq=None,
+        )
+    activities_changed.send(
+        sender=Activity, user_id=activity.user_id, dates={activity.date}
+    )
+
+
+def _postpone(job, activity, error: Exception):
+    deferrals = job.deferrals + 1
+    if deferrals >= settings.WEATHER_JOB_MAX_DEFERRALS:
+        logger.error(
+            "Giving up weather for activity %s after %d deferrals: %s",
+            activity.id,
+            deferrals,
+            error,
+        )
+        _complete(job, activity, None, WeatherStatus.FAILED)
+        return
+
+    _claimed(job).update(
+        deferrals=deferrals,
+        last_error=str(error),
+        run_after=timezone.now() + backoff(max(job.attempts, 1)),
+    )
+
+
+def _retry_or_fail(job, activity, error: Exception):
+    attempts = job.attempts + 1
+    if attempts >= settings.WEATHER_JOB_MAX_ATTEMPTS:
+        logger.error(
+            "Giving up weather for activity %s after %d attempts: %s",
+            activity.id,
+            attempts,
+            error,
+        )
+        _complete(job, activity, None, WeatherStatus.FAILED)
+        return
+
+    _claimed(job).update(
+        attempts=attempts,
+        last_error=str(error),
+        run_after=timezone.now() + backoff(attempts),
+    )
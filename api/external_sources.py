@@ -1,10 +1,22 @@
 "This handles extracting data from external services / APIs"
 import abc
 import logging
+import os
+import threading
+import urllib.parse
 from typing import Optional, TypedDict
 import datetime
 import pyowm
+import requests
 from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from pyowm.commons.http_client import HttpClient
+from pyowm.constants import PYOWM_VERSION
+from pyowm.exceptions import api_call_error, parse_response_error
+
+from .deadlines import call_timeout
 
 logger = logging.getLogger(__name__)
 
@@ -28,14 +40,77 @@ class AbstractWeatherProvider(abc.ABC):
         pass
 
 
+class PooledHttpClient(HttpClient):
+    """pyowm's HttpClient, reusing keep-alive connections from a bounded pool.
+    Calls time out after `timeout` seconds, or earlier if the deadline is closer"""
+
+    def __init__(
+        self, pool_size: int = 10, base_url: Optional[str] = None, **kwargs
+    ):
+        super().__init__(**kwargs)
+        # eg: a local stand-in of the API, for load tests
+        self.base_url = base_url
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size, pool_block=True
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def get_json(self, uri, params=None, headers=None):
+        if self.base_url:
+            url = urllib.parse.urlsplit(uri)
+            uri = urllib.parse.urljoin(self.base_url, url.path) + (
+                "?" + url.query if url.query else ""
+            )
+        try:
+            resp = self.session.get(
+                uri,
+                params=params,
+                headers=headers,
+                timeout=call_timeout(self.timeout),
+                verify=self.verify_ssl_certs,
+            )
+        except requests.exceptions.SSLError as e:
+            raise api_call_error.APIInvalidSSLCertificateError(str(e))
+        except requests.exceptions.ConnectionError as e:
+            raise api_call_error.APICallError(str(e))
+        except requests.exceptions.Timeout:
+            raise api_call_error.APICallTimeoutError("API call timeouted")
+        self.check_status_code(resp.status_code, resp.text)
+        try:
+            return resp.status_code, resp.json()
+        except ValueError:
+            raise parse_response_error.ParseResponseError(
+                "Impossible to parse API response data"
+            )
+
+
+def use_http_client(client, http_client: HttpClient) -> bool:
+    """make the pyowm `client` call the API through `http_client`. pyowm (2.10)
+    has no option for it: this replaces its private HttpClient, if still there.
+    Otherwise (eg: pyowm was upgraded) its own client is kept, and False returned"""
+    if not isinstance(getattr(client, "_wapi", None), HttpClient):
+        logger.warning(
+            "pyowm %s has no HttpClient to replace: connections are not pooled",
+            PYOWM_VERSION,
+        )
+        return False
+    client._wapi = http_client  # pylint: disable=protected-access
+    return True
+
+
 class OpenWeatherMapProvider(AbstractWeatherProvider):
-    def __init__(self):
+    def __init__(self, http_client: HttpClient = None):
         self.client = pyowm.OWM(
             # settings.OWM_SECRET, use_ssl=True, subscription_type="pro"
             settings.OWM_SECRET,
             use_ssl=True,
             subscription_type="free",  # XXX: until I have a pro account for testing this
         )
+        if http_client is not None:
+            # pyowm builds a plain HttpClient (a new connection per request)
+            use_http_client(self.client, http_client)
 
     def getWeather(
         self, lat: float, lon: float, when: datetime.datetime = None, quiet_fail=True
@@ -74,5 +149,89 @@ class OpenWeatherMapProvider(AbstractWeatherProvider):
         return return_dict
 
 
-class WeatherProvider(OpenWeatherMapProvider):
-    pass
+def build_weather_backend(path: str) -> AbstractWeatherProvider:
+    "the provider class at `path`, behind its circuit breaker (and quota, for OWM)"
+    # late imports: these modules depend on this one
+    from .quota import with_quota
+    from .resilience import resilient
+
+    provider_class = import_string(path)
+    if issubclass(provider_class, OpenWeatherMapProvider):
+        provider = provider_class(
+            http_client=PooledHttpClient(
+                pool_size=settings.WEATHER_HTTP_POOL_SIZE,
+                base_url=settings.OWM_BASE_URL,
+                timeout=settings.WEATHER_HTTP_TIMEOUT,
+            )
+        )
+        if settings.WEATHER_QUOTA_PER_MINUTE:
+            provider = with_quota(provider)
+    else:
+        provider = provider_class()
+
+    return resilient(provider, "weather.breaker.%s" % provider_class.__name__)
+
+
+def build_weather_provider() -> AbstractWeatherProvider:
+    "the provider configured in settings (WEATHER_PROVIDERS, WEATHER_*)"
+    from .hedging import HedgedWeatherProvider
+    from .singleflight import SingleFlightWeatherProvider
+
+    backends = [build_weather_backend(path) for path in settings.WEATHER_PROVIDERS]
+    if len(backends) == 1:
+        provider = backends[0]
+    else:
+        provider = HedgedWeatherProvider(
+            backends,
+            names=[path.rsplit(".", 1)[-1] for path in settings.WEATHER_PROVIDERS],
+        )
+    provider = SingleFlightWeatherProvider(provider)
+
+    if settings.WEATHER_CACHE_ENABLED:
+        from .weather_cache import CachedWeatherProvider
+
+        provider = CachedWeatherProvider(provider)
+    return provider
+
+
+# (pid, provider): built once per process, and again in forked children,
+# which must not share the parent's connections
+_provider = (None, None)
+_provider_lock = threading.Lock()
+
+
+def get_weather_provider() -> AbstractWeatherProvider:
+    "the process-wide weather provider"
+    global _provider
+    pid, provider = _provider
+    if pid != os.getpid():
+        with _provider_lock:
+            pid, provider = _provider
+            if pid != os.getpid():
+                provider = build_weather_provider()
+                _provider = (os.getpid(), provider)
+    return provider
+
+
+def reset_weather_provider():
+    "drop the process-wide provider. It is built again on next use"
+    global _provider
+    with _provider_lock:
+        _provider = (None, None)
+
+
+@receiver(setting_changed)
+def reset_weather_provider_on_setting_changed(setting, **kwargs):
+    if setting.startswith("WEATHER_") or setting.startswith("OWM_"):
+        reset_weather_provider()
+
+
+class WeatherProvider(AbstractWeatherProvider):
+    "The weather provider used by the application"
+
+    def getWeather(
+        self, lat: float, lon: float, when: datetime.datetime = None, quiet_fail=True
+    ) -> Optional[WeatherDict]:
+        return get_weather_provider().getWeather(
+            lat, lon, when=when, quiet_fail=quiet_fail
+        )
@@ -0,0 +1,116 @@
+"""Hedged lookups over several weather providers
+
+The providers are tried in order. When a provider hasn't answered within its
+usual latency (a percentile of its latency histogram), a hedged request goes
+to the next one, and the first valid answer wins. A provider that fails or has
+no weather hands over to the next one right away.
+"""
+
+import contextvars
+import datetime
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import List, Optional, Sequence
+
+from django.conf import settings
+
+from . import metrics
+from .deadlines import DeadlineExceeded, remaining
+from .external_sources import AbstractWeatherProvider, WeatherDict
+
+logger = logging.getLogger(__name__)
+
+
+class HedgedWeatherProvider(AbstractWeatherProvider):
+    "Composite of `providers` (in order of preference), with hedged requests"
+
+    def __init__(
+        self, providers: Sequence[AbstractWeatherProvider], names: Sequence[str]
+    ):
+        self.providers = list(providers)
+        self.names = list(names)
+        self.executor = ThreadPoolExecutor(
+            max_workers=settings.WEATHER_HEDGE_WORKERS,
+            thread_name_prefix="weather-hedge",
+        )
+
+    def latency_metric(self, index: int) -> str:
+        return "weather.provider.%s.latency" % self.names[index]
+
+    def hedge_delay(self, index: int) -> float:
+        "seconds to wait for provider `index` before hedging to the next one"
+        metric = self.latency_metric(index)
+        if metrics.histogram_count(metric) < settings.WEATHER_HEDGE_MIN_SAMPLES:
+            return settings.WEATHER_HEDGE_MAX_DELAY
+        return min(
+            max(
+                metrics.quantile(metric, settings.WEATHER_HEDGE_QUANTILE),
+                settings.WEATHER_HEDGE_MIN_DELAY,
+            ),
+            settings.WEATHER_HEDGE_MAX_DELAY,
+        )
+
+    def _call(self, index: int, lat: float, lon: float, when: datetime.datetime):
+        start = time.monotonic()
+        weather = self.providers[index].getWeather(
+            lat, lon, when=when, quiet_fail=False
+        )
+        metrics.observe(self.latency_metric(index), time.monotonic() - start)
+        return weather
+
+    def getWeather(
+        self, lat: float, lon: float, when: datetime.datetime = None, quiet_fail=True
+    ) -> Optional[WeatherDict]:
+        pending = {}  # future: provider index
+        launched: List[int] = []
+        errors: List[Exception] = []
+
+        def launch():
+            index = len(launched)
+            # the calls run in other threads: they get this context's deadline
+            context = contextvars.copy_context()
+            future = self.executor.submit(
+                context.run, self._call, index, lat, lon, when
+            )
+            pending[future] = index
+            launched.append(index)
+
+        launch()
+        while pending:
+            more = len(launched) < len(self.providers)
+            timeout = self.hedge_delay(launched[-1]) if more else remaining()
+            if more and remaining() is not None:
+                timeout = min(timeout, remaining())
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            if not done:
+                if not more:
+                    break  # out of time
+                metrics.incr("weather.hedge.hedged")
+                launch()
+                continue
+
+            for future in done:
+                index = pending.pop(future)
+                try:
+                    weather = future.result()
+                except Exception as e:  # pylint: disable=broad-except
+                    logger.warning(
+                        "Weather provider %s failed: %s", self.names[index], e
+                    )
+                    errors.append(e)
+                    continue
+                if weather is not None:
+                    if index:
+                        metrics.incr("weather.hedge.won.%s" % self.names[index])
+                    return weather
+
+            if not pending and len(launched) < len(self.providers):
+                launch()
+
+        if pending:
+            errors.append(DeadlineExceeded("weather lookup deadline exceeded"))
+        if errors and not quiet_fail:
+            raise errors[-1]
+        return None
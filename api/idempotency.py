@@ -0,0 +1,137 @@
+"""Idempotency keys for create requests
+
+Clients on flaky networks retry their requests. A request sent with an
+`Idempotency-Key` header (eg: a UUID, the same on every retry) is executed once:
+its response is stored with a fingerprint of the request for
+IDEMPOTENCY_KEY_TTL seconds, and its retries get that response (with an
+`Idempotent-Replayed: true` header) without executing the write, nor looking
+the weather up, again.
+
+- a retry while the request is still running gets 409 Conflict. After
+  IDEMPOTENCY_LOCK_TIMEOUT seconds the request is taken as lost, and a retry
+  is executed
+- the same key with a different request gets 422
+- errors (exceptions, 5xx responses) are not stored: retries are executed
+- the request runs in a transaction with the storing of its response (eg:
+  the weather lookups of a bulk request run one at a time)
+"""
+
+import datetime
+import functools
+import hashlib
+import json
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import IdempotencyKey
+
+HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyConflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "A request with this Idempotency-Key is still running"
+
+
+class IdempotencyKeyReused(APIException):
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = "This Idempotency-Key was used for a different request"
+
+
+def fingerprint(request) -> str:
+    "sha256 of the method, path and data (parsed: the key order doesn't matter)"
+    digest = hashlib.sha256()
+    digest.update(request.method.encode())
+    digest.update(request.get_full_path().encode())
+    digest.update(json.dumps(request.data, sort_keys=True, cls=JSONEncoder).encode())
+    return digest.hexdigest()
+
+
+def _reserve(user, key: str, request_fingerprint: str) -> IdempotencyKey:
+    """the key reserved for a new request (status_code None), or the one of a
+    completed request to replay. Raises IdempotencyConflict/IdempotencyKeyReused"""
+    now = timezone.now()
+    IdempotencyKey.objects.filter(user=user, key=key, expires_at__lte=now).delete()
+    try:
+        with transaction.atomic():
+            record = IdempotencyKey.objects.create(
+                user=user,
+                key=key,
+                fingerprint=request_fingerprint,
+                started_at=now,
+                expires_at=now
+                + datetime.timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL),
+            )
+    except IntegrityError:
+        record = IdempotencyKey.objects.filter(user=user, key=key).first()
+    else:
+        if next(IdempotencyKey._records) % settings.IDEMPOTENCY_PRUNE_EVERY == 0:
+            IdempotencyKey.prune()
+        return record
+
+    if record is None:
+        # deleted meanwhile (eg: the request failed)
+        raise IdempotencyConflict()
+    if record.fingerprint != request_fingerprint:
+        raise IdempotencyKeyReused()
+    if record.status_code is None:
+        lost = now - datetime.timedelta(seconds=settings.IDEMPOTENCY_LOCK_TIMEOUT)
+        # take over a lost request (only one retry can)
+        if record.started_at > lost or not IdempotencyKey.objects.filter(
+            id=record.id, status_code__isnull=True, started_at=record.started_at
+        ).update(started_at=now):
+            raise IdempotencyConflict()
+        record.started_at = now
+    return record
+
+
+def idempotent(method):
+    "make a view method (eg: create) idempotent for requests with an Idempotency-Key"
+
+    @functools.wraps(method)
+    def view(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if key is None:
+            return method(self, request, *args, **kwargs)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            raise ValidationError(
+                {HEADER: "Expected 1 to %d characters" % MAX_KEY_LENGTH}
+            )
+
+        record = _reserve(request.user, key, fingerprint(request))
+        if record.status_code is not None:
+            return Response(
+                json.loads(record.body) if record.body else None,
+                status=record.status_code,
+                headers={REPLAYED_HEADER: "true"},
+            )
+
+        try:
+            # the write and its stored response commit together: a crash can't
+            # leave the write without the response its retries would replay
+            with transaction.atomic():
+                response = method(self, request, *args, **kwargs)
+                if response.status_code < 500:
+                    record.status_code = response.status_code
+                    record.body = (
+                        ""
+                        if response.data is None
+                        else json.dumps(response.data, cls=JSONEncoder)
+                    )
+                    record.save(update_fields=["status_code", "body"])
+        except Exception:
+            record.delete()
+            raise
+        if response.status_code >= 500:
+            record.delete()
+        return response
+
+    return view
@@ -0,0 +1,324 @@
+"""Import of activities from GPX, TCX and CSV files
+
+Files are parsed incrementally (XML with iterparse, dropping every element once
+read; CSV row by row), so memory doesn't grow with the file size. Each track is
+reduced to its date, time, distance, duration and start coordinates, and the
+activities are inserted in batches, each in its own transaction. Their weather
+is left to the process_weather_jobs worker.
+"""
+
+import csv
+import datetime
+import math
+import xml.etree.ElementTree as ET
+from typing import BinaryIO, Iterator, List, NamedTuple, Optional, Union
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.dateparse import parse_datetime, parse_duration, parse_time
+
+from .bulk import insert_activities, notify
+from .models import Activity, User, WeatherJob, WeatherStatus
+
+FORMATS = ("gpx", "tcx", "csv")
+MAX_REPORTED_ERRORS = 100
+EARTH_RADIUS = 6371008.8  # meters
+MAX_DISTANCE = 2**31  # meters (PositiveIntegerField)
+
+
+class ActivityImportError(ValueError):
+    "the file can't be read (eg: malformed XML)"
+
+    result: Optional["ImportResult"] = None  # what was imported before the error
+
+
+class Track(NamedTuple):
+    position: str  # eg: "line 12", "track 3"
+    start: datetime.datetime  # UTC
+    distance: float  # meters
+    duration: datetime.timedelta
+    latitude: Optional[float]
+    longitude: Optional[float]
+
+
+class Invalid(NamedTuple):
+    "a track or row that can't be imported"
+
+    position: str  # eg: "line 12", "track 3"
+    reason: str
+
+
+class ImportResult(NamedTuple):
+    imported: int
+    skipped: int
+    errors: List[str]  # the first MAX_REPORTED_ERRORS
+
+
+def haversine(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    "great-circle distance between two points, in meters"
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = (
+        math.sin(dphi / 2) ** 2
+        + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+
+
+def _utc(value: Optional[str]) -> Optional[datetime.datetime]:
+    "an ISO 8601 timestamp as naive UTC (naive timestamps are taken as UTC)"
+    when = parse_datetime((value or "").strip())
+    if when is not None and when.tzinfo is not None:
+        when = when.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return when
+
+
+def _float(value: Optional[str]) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _elements(file: BinaryIO) -> Iterator[tuple]:
+    """("start"|"end", tag without namespace, element, parent tag) of an XML
+    file. Ended elements are removed from their parent: only the path to the
+    current element is kept in memory"""
+    path = []
+    try:
+        for event, element in ET.iterparse(file, events=("start", "end")):
+            tag = element.tag.rpartition("}")[2]
+            if event == "start":
+                path.append(element)
+                parent = path[-2].tag.rpartition("}")[2] if len(path) > 1 else None
+                yield event, tag, element, parent
+            else:
+                path.pop()
+                parent = path[-1].tag.rpartition("}")[2] if path else None
+                yield event, tag, element, parent
+                if path:
+                    path[-1].remove(element)
+    except ET.ParseError as e:
+        raise ActivityImportError("Invalid XML: %s" % e)
+
+
+def parse_gpx(file: BinaryIO) -> Iterator[Union[Track, Invalid]]:
+    "a Track per <trk> (over all its segments), from its timed points"
+    count = 0
+    first = last = previous = point = when = None
+    distance = 0.0
+    for event, tag, element, parent in _elements(file):
+        if event == "start" and tag == "trk":
+            count += 1
+            first = last = previous = None
+            distance = 0.0
+        elif event == "start" and tag == "trkpt":
+            point = (_float(element.get("lat")), _float(element.get("lon")))
+            when = None
+        elif event == "end" and tag == "time" and parent == "trkpt":
+            when = _utc(element.text)
+        elif event == "end" and tag == "trkpt":
+            if point is None or None in point or when is None:
+                continue
+            if previous is not None:
+                distance += haversine(*previous, *point)
+            previous = point
+            if first is None:
+                first = (when, point)
+            last = when
+        elif event == "end" and tag == "trk":
+            if first is None:
+                yield Invalid("track %d" % count, "no points with time and position")
+                continue
+            start, (latitude, longitude) = first
+            yield Track(
+                "track %d" % count, start, distance, last - start, latitude, longitude
+            )
+
+
+def parse_tcx(file: BinaryIO) -> Iterator[Union[Track, Invalid]]:
+    "a Track per <Activity>, with the totals of its laps"
+    count = 0
+    start = latitude = longitude = position_latitude = position_longitude = None
+    distance = seconds = 0.0
+    for event, tag, element, parent in _elements(file):
+        if event == "start" and tag == "Activity":
+            count += 1
+            start = latitude = longitude = None
+            distance = seconds = 0.0
+        elif event == "start" and tag == "Lap" and start is None:
+            start = _utc(element.get("StartTime"))
+        elif event == "end" and tag == "Id" and parent == "Activity":
+            start = start or _utc(element.text)
+        elif event == "end" and parent == "Lap" and tag == "TotalTimeSeconds":
+            seconds += _float(element.text) or 0.0
+        elif event == "end" and parent == "Lap" and tag == "DistanceMeters":
+            distance += _float(element.text) or 0.0
+        elif event == "end" and parent == "Position" and latitude is None:
+            if tag == "LatitudeDegrees":
+                position_latitude = _float(element.text)
+            elif tag == "LongitudeDegrees":
+                position_longitude = _float(element.text)
+        elif event == "start" and tag == "Position":
+            position_latitude = position_longitude = None
+        elif event == "end" and tag == "Position" and latitude is None:
+            if position_latitude is not None and position_longitude is not None:
+                latitude, longitude = position_latitude, position_longitude
+        elif event == "end" and tag == "Activity":
+            if start is None:
+                yield Invalid("activity %d" % count, "no start time")
+                continue
+            yield Track(
+                "activity %d" % count,
+                start,
+                distance,
+                datetime.timedelta(seconds=seconds),
+                latitude,
+                longitude,
+            )
+
+
+def _csv_lines(file: BinaryIO) -> Iterator[str]:
+    """the lines of a UTF-8 file, decoded one at a time (the lines before an
+    invalid one are read). Raises ActivityImportError on invalid text"""
+    for number, line in enumerate(file, 1):
+        try:
+            yield line.decode("utf-8-sig" if number == 1 else "utf-8")
+        except UnicodeDecodeError:
+            raise ActivityImportError("line %d: invalid UTF-8 text" % number)
+
+
+def _csv_rows(reader: csv.DictReader) -> Iterator[dict]:
+    "the rows of `reader`. Raises ActivityImportError on malformed rows"
+    while True:
+        try:
+            row = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as e:
+            raise ActivityImportError("line %d: %s" % (reader.line_num + 1, e))
+        yield row
+
+
+def parse_csv(file: BinaryIO) -> Iterator[Union[Track, Invalid]]:
+    """a Track per row, with the columns of the API: date, time, distance
+    (meters), duration ([HH:]MM:SS or seconds), and optional latitude/longitude"""
+    reader = csv.DictReader(_csv_lines(file))
+    for row in _csv_rows(reader):
+        position = "line %d" % reader.line_num
+        try:
+            date = datetime.date.fromisoformat((row.get("date") or "").strip())
+            time = parse_time((row.get("time") or "").strip())
+            distance = float(row.get("distance") or "")
+            duration = parse_duration((row.get("duration") or "").strip())
+        except ValueError as e:
+            yield Invalid(position, str(e))
+            continue
+        if time is None or duration is None:
+            yield Invalid(position, "invalid time or duration")
+            continue
+        yield Track(
+            position,
+            datetime.datetime.combine(date, time),
+            distance,
+            duration,
+            _float(row.get("latitude")),
+            _float(row.get("longitude")),
+        )
+
+
+PARSERS = {"gpx": parse_gpx, "tcx": parse_tcx, "csv": parse_csv}
+
+
+def detect_format(filename: str) -> Optional[str]:
+    "the format of a file, by its extension"
+    extension = filename.rpartition(".")[2].lower()
+    return extension if extension in FORMATS else None
+
+
+def _check(track: Track) -> Optional[str]:
+    "why a track can't be stored (None if it can)"
+    if not 0 <= track.distance < MAX_DISTANCE:
+        return "invalid distance %s" % track.distance
+    if track.duration < datetime.timedelta(0):
+        return "negative duration"
+    if track.latitude is not None and not -90 <= track.latitude <= 90:
+        return "invalid latitude %s" % track.latitude
+    if track.longitude is not None and not -180 <= track.longitude <= 180:
+        return "invalid longitude %s" % track.longitude
+    return None
+
+
+def _activity(user: User, track: Track) -> Activity:
+    located = track.latitude is not None and track.longitude is not None
+    return Activity(
+        user=user,
+        date=track.start.date(),
+        time=track.start.time().replace(microsecond=0),
+        distance=int(round(track.distance)),
+        duration=track.duration,
+        latitude=round(track.latitude, 6) if located else None,
+        longitude=round(track.longitude, 6) if located else None,
+        # looked up later, by the process_weather_jobs worker
+        weather_status=(
+            WeatherStatus.PENDING.value if located else WeatherStatus.DONE.value
+        ),
+    )
+
+
+def _save_batch(activities: List[Activity]):
+    with transaction.atomic():
+        insert_activities(activities)
+        pending = [
+            activity.id
+            for activity in activities
+            if activity.weather_status == WeatherStatus.PENDING.value
+        ]
+        if pending:
+            WeatherJob.enqueue(pending)
+    notify(activities)
+
+
+def import_activities(
+    user: User,
+    file: BinaryIO,
+    format: str,
+    batch_size: Optional[int] = None,
+) -> ImportResult:
+    """import the activities of a file (gpx, tcx or csv) for `user`, in batches
+    of `batch_size`. Raises ActivityImportError if the file can't be read (the
+    batches already inserted are kept)"""
+    batch_size = batch_size or settings.ACTIVITY_IMPORT_BATCH_SIZE
+    imported = skipped = 0
+    errors = []
+    batch = []
+
+    try:
+        for track in PARSERS[format](file):
+            if isinstance(track, Track):
+                reason = _check(track)
+                if reason is not None:
+                    track = Invalid(track.position, reason)
+            if isinstance(track, Invalid):
+                skipped += 1
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append("%s: %s" % track)
+                continue
+            batch.append(_activity(user, track))
+            if len(batch) >= batch_size:
+                _save_batch(batch)
+                imported += len(batch)
+                batch = []
+    except ActivityImportError as e:
+        # keep what was read before the error
+        if batch:
+            _save_batch(batch)
+            imported += len(batch)
+        e.result = ImportResult(imported, skipped, errors)
+        raise
+
+    if batch:
+        _save_batch(batch)
+        imported += len(batch)
+    return ImportResult(imported, skipped, errors)
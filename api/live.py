@@ -0,0 +1,258 @@
+"""Live feed of activities, as Server-Sent Events
+
+GET /api/v1/activities/live streams the activities created or updated from
+then on, as `activity` events (with the fields of the API), optionally matching
+an AdvancedFilter `q`. ASGI only (see jogging_tracker/asgi.py): each subscriber
+holds its connection open.
+
+A single poller per process reads the changes (see sync.py) every
+LIVE_POLL_INTERVAL seconds while there are subscribers. Each change is
+serialized once, and matched in memory against the `q` of every subscriber,
+compiled to a predicate when it subscribed. The relations those predicates
+follow (eg: weather__title) are loaded with the changes (select_related):
+subscribers never query the database. A subscriber too slow to keep up with
+LIVE_QUEUE_SIZE events gets an `overflow` event and is disconnected (it can
+catch up with the sync feed).
+"""
+
+import asyncio
+import io
+import json
+import logging
+from importlib import import_module
+from typing import Callable, List, Optional, Set, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.core.exceptions import FieldError, ValidationError
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections
+from rest_framework.exceptions import APIException, NotAuthenticated
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+
+from advanced_filters.filters import (
+    AdvancedFilter,
+    ParseError,
+    compile_q,
+    related_paths,
+)
+
+from . import sync
+from .models import Activity
+from .serializers import ActivitySerializer
+from .views import ActivityViewSet
+
+logger = logging.getLogger(__name__)
+
+PATH = "/api/v1/activities/live"
+KEEPALIVE = b": keepalive\n\n"
+OVERFLOW = b"event: overflow\ndata: {}\n\n"
+
+
+class Subscriber:
+    def __init__(
+        self, owner: Optional[int], predicate: Callable, related: Set[str] = frozenset()
+    ):
+        self.owner = owner  # None: the activities of every user
+        self.predicate = predicate
+        self.related = related  # relations followed by the predicate
+        self.queue = asyncio.Queue(maxsize=settings.LIVE_QUEUE_SIZE)
+        self.overflowed = False
+
+    def offer(self, activity: Activity, event: bytes):
+        "queue the event of a changed activity, if it matches"
+        if self.overflowed:
+            return
+        if self.owner is not None and activity.user_id != self.owner:
+            return
+        if not self.predicate(activity):
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+
+def _event(activity: Activity) -> bytes:
+    data = json.dumps(ActivitySerializer(activity).data, cls=JSONEncoder)
+    return b"event: activity\ndata: %s\n\n" % data.encode()
+
+
+class Broadcaster:
+    "polls the changes while there are subscribers, and offers them to each"
+
+    def __init__(self):
+        self.subscribers = set()
+        self.cursor = None
+        self.task = None
+
+    def subscribe(self, subscriber: Subscriber, cursor: sync.Cursor):
+        "add a subscriber. The changes are polled from `cursor` if not yet polling"
+        self.subscribers.add(subscriber)
+        if self.task is None:
+            self.cursor = cursor
+            self.task = asyncio.ensure_future(self.run())
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self.subscribers.discard(subscriber)
+        if not self.subscribers and self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(settings.LIVE_POLL_INTERVAL)
+            try:
+                await self.poll()
+            except Exception as e:  # pylint: disable=broad-except
+                logger.error("Could not poll the activity changes: %s", e)
+
+    async def poll(self) -> int:
+        "offer the changes since the last poll. Returns the number of changes"
+        related = set().union(*(s.related for s in self.subscribers))
+        changes = await sync_to_async(self._read_changes)(related)
+        for subscriber in list(self.subscribers):
+            if not subscriber.related <= related:
+                # subscribed meanwhile: its relations were not loaded
+                continue
+            for activity, event in changes:
+                try:
+                    subscriber.offer(activity, event)
+                except Exception as e:  # pylint: disable=broad-except
+                    logger.error("Could not match a change to a subscriber: %s", e)
+        return len(changes)
+
+    def _read_changes(self, related: Set[str]) -> List[Tuple[Activity, bytes]]:
+        close_old_connections()
+        changes = []
+        while True:
+            result = sync.changes(self.cursor, None, related=related)
+            self.cursor = result.cursor
+            changes.extend(
+                (activity, _event(activity)) for activity in result.activities
+            )
+            if not result.more:
+                return changes
+
+
+broadcaster = Broadcaster()
+
+
+def _subscription(scope) -> Tuple[Optional[int], Callable, Set[str]]:
+    """authenticate the request (like the API: session, basic or token) and
+    compile its `q`: the owner, predicate and relations of a Subscriber (built
+    on the event loop, which its queue belongs to). Raises APIException, or ParseError/FieldError/ValidationError
+    for an invalid `q`"""
+    close_old_connections()
+    http_request = ASGIRequest(scope, io.BytesIO())
+    # what SessionMiddleware and AuthenticationMiddleware would do
+    engine = import_module(settings.SESSION_ENGINE)
+    http_request.session = engine.SessionStore(
+        http_request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    )
+    http_request.user = get_user(http_request)
+
+    request = Request(
+        http_request,
+        authenticators=[
+            authentication()
+            for authentication in api_settings.DEFAULT_AUTHENTICATION_CLASSES
+        ],
+    )
+    user = request.user
+    if not user.is_authenticated:
+        raise NotAuthenticated()
+
+    owner = None if ActivityViewSet._sees_all_activities(user) else user.id
+    q = AdvancedFilter().build_query(
+        request.query_params.get(AdvancedFilter.SEARCH_QUERY, "")
+    )
+    return owner, compile_q(q, Activity), related_paths(q, Activity)
+
+
+async def _respond(send, status_code: int, detail: str):
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status_code,
+            "headers": [(b"content-type", b"application/json")],
+        }
+    )
+    await send(
+        {"type": "http.response.body", "body": json.dumps({"detail": detail}).encode()}
+    )
+
+
+async def _disconnected(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def _stream(subscriber: Subscriber, receive, send):
+    "send the events of a subscriber, until it disconnects or overflows"
+    disconnected = asyncio.ensure_future(_disconnected(receive))
+    try:
+        while True:
+            event = asyncio.ensure_future(subscriber.queue.get())
+            await asyncio.wait(
+                {event, disconnected},
+                timeout=settings.LIVE_KEEPALIVE,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if disconnected.done():
+                event.cancel()
+                return
+            if event.done():
+                body = event.result()
+            else:
+                event.cancel()
+                body = KEEPALIVE
+            await send({"type": "http.response.body", "body": body, "more_body": True})
+
+            if subscriber.overflowed and subscriber.queue.empty():
+                await send({"type": "http.response.body", "body": OVERFLOW})
+                return
+    finally:
+        disconnected.cancel()
+
+
+async def application(scope, receive, send):
+    "ASGI application of the live feed"
+    if scope["method"] != "GET":
+        await _respond(send, 405, 'Method "%s" not allowed.' % scope["method"])
+        return
+    try:
+        owner, predicate, related = await sync_to_async(_subscription)(scope)
+    except APIException as e:
+        await _respond(send, e.status_code, str(e.detail))
+        return
+    except (ParseError, FieldError, ValidationError, ValueError) as e:
+        await _respond(send, 400, str(e))
+        return
+    if len(broadcaster.subscribers) >= settings.LIVE_MAX_SUBSCRIBERS:
+        await _respond(send, 503, "Too many subscribers, try again later")
+        return
+    subscriber = Subscriber(owner, predicate, related)
+    # changes from now on
+    cursor = await sync_to_async(sync.latest_cursor)()
+
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"text/event-stream"),
+                (b"cache-control", b"no-cache"),
+                # eg: nginx would buffer the events
+                (b"x-accel-buffering", b"no"),
+            ],
+        }
+    )
+    broadcaster.subscribe(subscriber, cursor)
+    try:
+        await _stream(subscriber, receive, send)
+    finally:
+        broadcaster.unsubscribe(subscriber)
@@ -0,0 +1,47 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.backfill import backfill_weather, missing_weather
+
+
+class Command(BaseCommand):
+    help = "Fetch the missing weather of existing activities"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--after-id",
+            type=int,
+            default=0,
+            help="resume after this activity id (printed with the progress)",
+        )
+        parser.add_argument("--chunk-size", type=int, default=500)
+        parser.add_argument(
+            "--workers", type=int, default=settings.WEATHER_BACKFILL_WORKERS
+        )
+        parser.add_argument(
+            "--rate",
+            type=float,
+            default=settings.WEATHER_BACKFILL_RATE,
+            help="maximum weather API requests per second",
+        )
+
+    def handle(self, *args, **options):
+        total = missing_weather(options["after_id"]).count()
+        self.stdout.write("%d activities without weather" % total)
+
+        done = lookups = filled = 0
+        for chunk in backfill_weather(
+            after_id=options["after_id"],
+            chunk_size=options["chunk_size"],
+            workers=options["workers"],
+            rate=options["rate"],
+        ):
+            done += chunk.activities
+            lookups += chunk.lookups
+            filled += chunk.filled
+            self.stdout.write(
+                "%d/%d activities (%d lookups, %d filled), last id %d"
+                % (done, total, lookups, filled, chunk.last_id)
+            )
+
+        self.stdout.write("Filled the weather of %d activities" % filled)
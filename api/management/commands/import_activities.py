@@ -0,0 +1,50 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.imports import FORMATS, ActivityImportError, detect_format, import_activities
+from api.models import User
+
+
+class Command(BaseCommand):
+    help = "Import the activities of a GPX, TCX or CSV file"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--user", required=True, help="username of the owner")
+        parser.add_argument(
+            "--format", choices=FORMATS, help="default: by the file extension"
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.ACTIVITY_IMPORT_BATCH_SIZE,
+            help="activities inserted per transaction",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options["user"])
+        except User.DoesNotExist:
+            raise CommandError("Unknown user %s" % options["user"])
+        format = options["format"] or detect_format(options["path"])
+        if format is None:
+            raise CommandError("Unknown file format: use --format")
+
+        try:
+            with open(options["path"], "rb") as file:
+                result = import_activities(
+                    user, file, format, batch_size=options["batch_size"]
+                )
+        except OSError as e:
+            raise CommandError(str(e))
+        except ActivityImportError as e:
+            self.report(e.result)
+            raise CommandError(str(e))
+        self.report(result)
+
+    def report(self, result):
+        for error in result.errors:
+            self.stderr.write(error)
+        self.stdout.write(
+            "Imported %d activities, skipped %d" % (result.imported, result.skipped)
+        )
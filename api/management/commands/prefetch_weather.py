@@ -0,0 +1,41 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from api.prefetch import prefetch_stats, prefetch_weather
+
+
+class Command(BaseCommand):
+    help = "Warm the weather cache for the users' habitual running spots and times"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--stats-days",
+            type=int,
+            default=7,
+            help="report the use of the entries prefetched in the last days",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            result = prefetch_weather()
+        except RuntimeError as e:
+            raise CommandError(str(e))
+        self.stdout.write(
+            "%d habitual slots, %d due, %d prefetched"
+            % (result.slots, result.due, result.prefetched)
+        )
+
+        since = timezone.now() - datetime.timedelta(days=options["stats_days"])
+        stats = prefetch_stats(since)
+        self.stdout.write(
+            "Last %d days: %d prefetched entries, %d used (hit ratio %s), %d hits"
+            % (
+                options["stats_days"],
+                stats["entries"],
+                stats["used"],
+                stats["hit_ratio"],
+                stats["hits"],
+            )
+        )
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.deletion import process_user_deletions
+
+
+class Command(BaseCommand):
+    help = "Worker deleting the users queued for deletion (with USER_DELETION_ASYNC)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=5.0,
+            help="seconds to wait when there are no due deletions",
+        )
+        parser.add_argument(
+            "--once", action="store_true", help="process a single deletion and exit"
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            processed = process_user_deletions()
+            if processed:
+                self.stdout.write("Processed %d user deletions" % processed)
+            if options["once"]:
+                break
+            if not processed:
+                time.sleep(options["sleep"])
@@ -0,0 +1,34 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.enrichment import process_weather_jobs
+
+
+class Command(BaseCommand):
+    help = "Worker fetching the weather of activities saved with weather pending"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=settings.WEATHER_JOB_BATCH_SIZE
+        )
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=1.0,
+            help="seconds to wait when there are no due jobs",
+        )
+        parser.add_argument(
+            "--once", action="store_true", help="process a single batch and exit"
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            processed = process_weather_jobs(options["batch_size"])
+            if processed:
+                self.stdout.write("Processed %d weather jobs" % processed)
+            if options["once"]:
+                break
+            if not processed:
+                time.sleep(options["sleep"])
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from api import rollups
+
+
+class Command(BaseCommand):
+    help = "Rebuild the per-user rollups (weekly distances, sketches...) from activities"
+
+    def handle(self, *args, **options):
+        count = rollups.rebuild_weekly_distances()
+        self.stdout.write("Rebuilt %d weekly distances" % count)
+
+        count = rollups.rebuild_training_loads()
+        self.stdout.write("Rebuilt %d daily training loads" % count)
+
+        count = rollups.rebuild_activity_days()
+        self.stdout.write("Rebuilt %d yearly activity day bitmaps" % count)
@@ -0,0 +1,111 @@
+"""In-process metrics (counters, gauges and histograms)
+
+Metrics are per process (eg: per gunicorn worker), and are exposed by the
+/metrics endpoint of the worker that answers the request.
+"""
+
+import math
+import threading
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional
+
+
+class Histogram:
+    """Histogram of positive values (eg: latencies in seconds), in exponential
+    buckets: bucket i counts values up to `start * factor ** i`"""
+
+    def __init__(self, start: float = 0.001, factor: float = 1.25, buckets: int = 64):
+        self.start = start
+        self.factor = factor
+        self.counts: List[int] = [0] * buckets
+        self.count = 0
+
+    def observe(self, value: float):
+        index = 0
+        if value > self.start:
+            index = math.ceil(math.log(value / self.start, self.factor) - 1e-9)
+        self.counts[min(index, len(self.counts) - 1)] += 1
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        "upper bound of the bucket of the q-quantile (None if empty)"
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return self.start * self.factor**index
+        return self.start * self.factor ** (len(self.counts) - 1)
+
+
+_lock = threading.Lock()
+_counters: Dict[str, float] = defaultdict(float)
+_gauges: Dict[str, Callable[[], Optional[float]]] = {}
+_histograms: Dict[str, Histogram] = defaultdict(Histogram)
+
+
+def incr(name: str, value: float = 1):
+    with _lock:
+        _counters[name] += value
+
+
+def counter(name: str) -> float:
+    return _counters.get(name, 0)
+
+
+def register_gauge(name: str, function: Callable[[], Optional[float]]):
+    "`function` is called for the gauge's value on every snapshot"
+    _gauges[name] = function
+
+
+def observe(name: str, value: float):
+    with _lock:
+        _histograms[name].observe(value)
+
+
+def quantile(name: str, q: float) -> Optional[float]:
+    "q-quantile of a histogram (None if it has no values)"
+    with _lock:
+        histogram = _histograms.get(name)
+        return None if histogram is None else histogram.quantile(q)
+
+
+def histogram_count(name: str) -> int:
+    histogram = _histograms.get(name)
+    return 0 if histogram is None else histogram.count
+
+
+def ratio(numerator: str, *others: str) -> Optional[float]:
+    "numerator / (numerator + others), or None if all are zero"
+    total = counter(numerator) + sum(counter(name) for name in others)
+    if not total:
+        return None
+    return counter(numerator) / total
+
+
+def snapshot() -> Dict:
+    with _lock:
+        counters = dict(_counters)
+        histograms = {
+            name: {
+                "count": histogram.count,
+                "p50": histogram.quantile(0.5),
+                "p95": histogram.quantile(0.95),
+                "p99": histogram.quantile(0.99),
+            }
+            for name, histogram in _histograms.items()
+        }
+    return {
+        "counters": counters,
+        "gauges": {name: function() for name, function in _gauges.items()},
+        "histograms": histograms,
+    }
+
+
+def reset():
+    "reset the counters and histograms (eg: between tests). Gauges are kept"
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
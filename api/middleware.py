@@ -0,0 +1,17 @@
+"Middleware of the api app"
+
+from django.conf import settings
+
+from .deadlines import deadline
+
+
+class WeatherBudgetMiddleware:
+    """Limits the time each request spends on weather lookups to
+    WEATHER_REQUEST_BUDGET seconds. Lookups past the budget fail fast"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with deadline(settings.WEATHER_REQUEST_BUDGET):
+            return self.get_response(request)
@@ -0,0 +1,40 @@
+# Generated by Django 3.2.25 on 2026-10-19 11:10
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_activity_duration'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WeeklyDistanceSketch',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveSmallIntegerField()),
+                ('week', models.PositiveSmallIntegerField()),
+                ('data', models.BinaryField()),
+            ],
+            options={
+                'unique_together': {('year', 'week')},
+            },
+        ),
+        migrations.CreateModel(
+            name='WeeklyDistance',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveSmallIntegerField()),
+                ('week', models.PositiveSmallIntegerField()),
+                ('distance', models.PositiveIntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='weekly_distances', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'year', 'week')},
+            },
+        ),
+    ]
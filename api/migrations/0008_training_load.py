@@ -0,0 +1,30 @@
+# Generated by Django 3.2.25 on 2026-10-19 11:12
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_weekly_distance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrainingLoad',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('load', models.FloatField(default=0)),
+                ('acute', models.FloatField(default=0)),
+                ('chronic', models.FloatField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='training_loads', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ('user', 'date'),
+                'unique_together': {('user', 'date')},
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.2.25 on 2026-10-19 11:19
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_activity_days'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activity',
+            name='weather_status',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'DONE'), (2, 'PENDING'), (3, 'FAILED')], default=1),
+        ),
+        migrations.CreateModel(
+            name='WeatherJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('run_after', models.DateTimeField(db_index=True)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('activity', models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='weather_job', to='api.activity')),
+            ],
+        ),
+    ]
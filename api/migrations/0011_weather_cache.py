@@ -0,0 +1,29 @@
+# Generated by Django 3.2.25 on 2026-10-19 11:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_weather_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WeatherCacheEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('geocell', models.CharField(max_length=12)),
+                ('bucket', models.BigIntegerField()),
+                ('weather_id', models.IntegerField()),
+                ('title', models.CharField(max_length=80)),
+                ('description', models.CharField(max_length=254)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'unique_together': {('geocell', 'bucket')},
+            },
+        ),
+    ]
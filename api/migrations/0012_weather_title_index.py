@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-19 11:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_weather_cache'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='weather',
+            name='title',
+            field=models.CharField(db_index=True, max_length=80),
+        ),
+    ]
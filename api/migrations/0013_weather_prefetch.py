@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-19 11:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_weather_title_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='weathercacheentry',
+            name='hits',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='weathercacheentry',
+            name='prefetched',
+            field=models.BooleanField(default=False),
+        ),
+    ]
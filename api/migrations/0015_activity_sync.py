@@ -0,0 +1,45 @@
+# Generated by Django 3.2.25 on 2026-10-19 12:12
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_user_deletion_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivityTombstone',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('activity_id', models.IntegerField()),
+                ('deleted_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='activity',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='activity',
+            index=models.Index(fields=['user', 'updated_at', 'id'], name='api_activit_user_id_5bfacc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='activity',
+            index=models.Index(fields=['updated_at', 'id'], name='api_activit_updated_b1e6b9_idx'),
+        ),
+        migrations.AddField(
+            model_name='activitytombstone',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='activitytombstone',
+            index=models.Index(fields=['user', 'deleted_at', 'id'], name='api_activit_user_id_86baf9_idx'),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 3.2.25 on 2026-10-19 13:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeSequence',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.BigIntegerField(default=0)),
+                ('pruned', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name='activity',
+            name='api_activit_user_id_5bfacc_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='activity',
+            name='api_activit_updated_b1e6b9_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='activitytombstone',
+            name='api_activit_user_id_86baf9_idx',
+        ),
+        migrations.AddField(
+            model_name='activity',
+            name='change_seq',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='activitytombstone',
+            name='change_seq',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='activity',
+            index=models.Index(fields=['user', 'change_seq', 'id'], name='api_activit_user_id_e437ed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='activity',
+            index=models.Index(fields=['change_seq', 'id'], name='api_activit_change__910295_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='activitytombstone',
+            index=models.Index(fields=['user', 'change_seq', 'id'], name='api_activit_user_id_895740_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='activitytombstone',
+            index=models.Index(fields=['change_seq', 'id'], name='api_activit_change__485f4c_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-19 13:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_sync_change_sequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='weatherjob',
+            name='deferrals',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
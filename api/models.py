@@ -1,12 +1,22 @@
 import datetime
+import itertools
+import logging
+import threading
+from decimal import Decimal
 from enum import Enum
-from typing import Optional
+from typing import Dict, List, Optional
 
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
 
+from .deadlines import WeatherUnavailable
 from .external_sources import WeatherProvider
+from .signals import activities_changed
+from .sketches import QuantileSketch
 
 
 class UserRoles(Enum):
@@ -20,12 +30,29 @@ class UserRoles(Enum):
         return ((x.value, x.name) for x in cls)
 
 
+class WeatherStatus(Enum):
+    DONE = 1  # fetched (weather may still be null, if the provider had no data)
+    PENDING = 2  # waiting for the weather worker
+    FAILED = 3  # the weather worker gave up
+
+    @classmethod
+    def as_choices(cls):
+        return ((x.value, x.name) for x in cls)
+
+
 class User(AbstractUser):
     role = models.PositiveSmallIntegerField(
         choices=UserRoles.as_choices(), default=UserRoles.REGULAR.value
     )
 
 
+def _normalize_coordinate(value) -> Optional[Decimal]:
+    "coordinate as stored (6 decimal places), to compare assigned and loaded values"
+    if value is None:
+        return None
+    return Decimal(str(value)).quantize(Decimal("0.000001"))
+
+
 class Activity(models.Model):
     date = models.DateField(null=False)
     time = models.TimeField(null=False)
@@ -46,33 +73,157 @@ class Activity(models.Model):
     longitude = models.DecimalField(
         max_digits=9, decimal_places=6, null=True, blank=True
     )
+    weather_status = models.PositiveSmallIntegerField(
+        choices=WeatherStatus.as_choices(), default=WeatherStatus.DONE.value
+    )
+    # set on every write, including the bulk/set-based ones
+    updated_at = models.DateTimeField(auto_now=True)
+    # reset on every write, and numbered once committed (see sync.py)
+    change_seq = models.BigIntegerField(null=True, blank=True, editable=False)
+
+    class Meta:
+        # the sync feed: changes after a cursor, per user or for everyone
+        indexes = [
+            models.Index(fields=["user", "change_seq", "id"]),
+            models.Index(fields=["change_seq", "id"]),
+        ]
+
+    # fields snapshotted when loaded from the database (see from_db)
+    TRACKED_FIELDS = ("user_id", "date", "time", "latitude", "longitude")
+    # fields the weather depends on
+    WEATHER_FIELDS = ("date", "time", "latitude", "longitude")
 
     def __str__(self):
         return "{}: {} - {}".format(self.user, self.date, self.distance)
 
-    def save(self, *args, **kwargs):
-        if (
-            hasattr(self, "latitude")
-            and hasattr(self, "longitude")
-            and hasattr(self, "date")
-            and hasattr(self, "time")
-        ):
-            when = datetime.datetime.combine(self.date, self.time)
-
-            weather_dict = WeatherProvider().getWeather(
-                float(self.latitude), float(self.longitude), when=when
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Activity, cls).from_db(db, field_names, values)
+        instance._loaded_values = {
+            field: getattr(instance, field)
+            for field in cls.TRACKED_FIELDS
+            if field in instance.__dict__
+        }
+        return instance
+
+    def _notify_changed(self):
+        "send activities_changed for the current and the previously loaded owner/date"
+        loaded = getattr(self, "_loaded_values", {})
+        old_user_id = loaded.get("user_id", self.user_id)
+        old_date = loaded.get("date", self.date)
+
+        if old_user_id == self.user_id:
+            activities_changed.send(
+                sender=Activity, user_id=self.user_id, dates={self.date, old_date}
             )
-            weather = (
-                None if weather_dict is None else Weather.get_or_create(**weather_dict)
+        else:
+            activities_changed.send(
+                sender=Activity, user_id=old_user_id, dates={old_date}
             )
-            self.weather = weather
+            activities_changed.send(
+                sender=Activity, user_id=self.user_id, dates={self.date}
+            )
+
+        deferred = self.get_deferred_fields()
+        self._loaded_values = {
+            field: getattr(self, field)
+            for field in self.TRACKED_FIELDS
+            if field not in deferred
+        }
+
+    def weather_outdated(self) -> bool:
+        """whether the weather must be looked up (again): the location or time
+        changed since loaded (or never saved), or the weather is missing"""
+        loaded = getattr(self, "_loaded_values", {})
+        deferred = self.get_deferred_fields()
+        for field in self.WEATHER_FIELDS:
+            if field in deferred:
+                continue
+            if field not in loaded:
+                return True
+            value, loaded_value = getattr(self, field), loaded[field]
+            if field in ("latitude", "longitude"):
+                value = _normalize_coordinate(value)
+                loaded_value = _normalize_coordinate(loaded_value)
+            if value != loaded_value:
+                return True
+        return (
+            self.weather_id is None
+            and self.weather_status != WeatherStatus.PENDING.value
+        )
 
-        super(Activity, self).save(*args, **kwargs)
+    def save(self, *args, **kwargs):
+        weather_outdated = self.weather_outdated()
+        if weather_outdated:
+            if self.latitude is None or self.longitude is None:
+                # nowhere to look the weather up
+                self.weather = None
+                self.weather_status = WeatherStatus.DONE.value
+            elif settings.WEATHER_ENRICHMENT_ASYNC:
+                # fetched later, by the process_weather_jobs worker
+                self.weather = None
+                self.weather_status = WeatherStatus.PENDING.value
+            else:
+                try:
+                    self.weather = self.fetch_weather(quiet_fail=False)
+                    self.weather_status = WeatherStatus.DONE.value
+                except WeatherUnavailable:
+                    # eg: out of quota: deferred to the process_weather_jobs worker
+                    self.weather = None
+                    self.weather_status = WeatherStatus.PENDING.value
+                except Exception as e:  # pylint: disable=broad-except
+                    logging.error("Could not get the weather: %s", e)
+                    self.weather = None
+                    self.weather_status = WeatherStatus.DONE.value
+
+            if kwargs.get("update_fields") is not None:
+                kwargs["update_fields"] = set(kwargs["update_fields"]) | {
+                    "weather",
+                    "weather_status",
+                }
+        self.change_seq = None
+        if kwargs.get("update_fields") is not None:
+            kwargs["update_fields"] = set(kwargs["update_fields"]) | {
+                "updated_at",
+                "change_seq",
+            }
+
+        # a pending activity is never left without its job
+        with transaction.atomic():
+            ActivityTombstone.record_moves([self])
+            super(Activity, self).save(*args, **kwargs)
+            pending = self.weather_status == WeatherStatus.PENDING.value
+            if weather_outdated and pending:
+                WeatherJob.enqueue([self.id])
+        self._notify_changed()
+
+    def fetch_weather(self, quiet_fail=True, provider=None) -> Optional["Weather"]:
+        "get the Weather on the activity's location and time (None if unavailable)"
+        if self.latitude is None or self.longitude is None:
+            return None
+        when = datetime.datetime.combine(self.date, self.time)
+        weather_dict = (provider or WeatherProvider()).getWeather(
+            float(self.latitude),
+            float(self.longitude),
+            when=when,
+            quiet_fail=quiet_fail,
+        )
+        return None if weather_dict is None else Weather.get_or_create(**weather_dict)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            ActivityTombstone.record([(self.id, self.user_id)])
+            result = super(Activity, self).delete(*args, **kwargs)
+        self._loaded_values = {}
+        activities_changed.send(
+            sender=Activity, user_id=self.user_id, dates={self.date}
+        )
+        return result
 
 
 class Weather(models.Model):
     id = models.AutoField(primary_key=True)
-    title = models.CharField(max_length=80, null=False)
+    title = models.CharField(max_length=80, null=False, db_index=True)
     description = models.CharField(max_length=254, null=False)
 
     def __str__(self):
@@ -89,7 +240,391 @@ class Weather(models.Model):
         if id is None or title is None or description is None:
             return None
 
-        weather, _ = Weather.objects.get_or_create(
-            id=id, defaults={"title": title, "description": description}
+        return weather_catalog.upsert(id, title, description)
+
+
+class WeatherCatalog:
+    """Process-level, in-memory copy of the Weather table.
+    There are only ~60 weather conditions (OWM codes), so they are loaded once,
+    and reloaded when an unknown id or title is requested.
+    Only committed rows are kept (rows read or written in a transaction are
+    kept when it commits), so a rollback can't leave unknown rows in memory"""
+
+    def __init__(self):
+        self._by_id: Optional[Dict[int, Weather]] = None
+        self._by_title: Dict[str, Weather] = {}
+        self._lock = threading.Lock()
+
+    def _keep(self, weathers: List[Weather], replace: bool):
+        def keep():
+            with self._lock:
+                if not replace and self._by_id is None:
+                    # not loaded: the next read loads every row, these included
+                    return
+                by_id = {} if replace else dict(self._by_id)
+                by_id.update((weather.id, weather) for weather in weathers)
+                by_title = {}
+                # titles are not unique (eg: "Rain"): the lowest id wins
+                for weather in sorted(by_id.values(), key=lambda w: w.id):
+                    by_title.setdefault(weather.title, weather)
+                self._by_id, self._by_title = by_id, by_title
+
+        if transaction.get_connection().in_atomic_block:
+            transaction.on_commit(keep)
+        else:
+            keep()
+
+    def _load(self) -> Dict[int, Weather]:
+        weathers = list(Weather.objects.all())
+        self._keep(weathers, replace=True)
+        return {weather.id: weather for weather in weathers}
+
+    def _by_id_or_load(self) -> Dict[int, Weather]:
+        by_id = self._by_id
+        return by_id if by_id is not None else self._load()
+
+    def get(self, id: Optional[int]) -> Optional[Weather]:
+        if id is None:
+            return None
+        by_id = self._by_id_or_load()
+        if id not in by_id:
+            by_id = self._load()
+        return by_id.get(id)
+
+    def get_by_title(self, title: str) -> Optional[Weather]:
+        "the Weather with `title` (the lowest id, when there are several)"
+        self._by_id_or_load()
+        weather = self._by_title.get(title)
+        if weather is None:
+            weather = Weather.objects.filter(title=title).order_by("id").first()
+            if weather is not None:
+                self._keep([weather], replace=False)
+        return weather
+
+    def all(self) -> List[Weather]:
+        "every Weather, by id"
+        return sorted(self._by_id_or_load().values(), key=lambda w: w.id)
+
+    def upsert(self, id: int, title: str, description: str) -> Weather:
+        "the Weather of `id`, inserted if unknown (an existing one is kept as is)"
+        weather = self._by_id_or_load().get(id)
+        if weather is not None:
+            return weather
+
+        Weather.objects.bulk_create(
+            [Weather(id=id, title=title, description=description)],
+            ignore_conflicts=True,
         )
+        weather = Weather.objects.get(id=id)
+        self._keep([weather], replace=False)
         return weather
+
+    def reset(self):
+        "forget the loaded rows (eg: between tests, or when the table is edited)"
+        with self._lock:
+            self._by_id = None
+            self._by_title = {}
+
+
+weather_catalog = WeatherCatalog()
+
+
+@receiver([post_save, post_delete], sender=Weather)
+def reset_weather_catalog(sender, **kwargs):
+    # eg: edited in the admin. (bulk_create doesn't send post_save)
+    weather_catalog.reset()
+
+
+class WeeklyDistance(models.Model):
+    "Rollup: total distance ran by a user in a (year, week)"
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        null=False,
+        related_name="weekly_distances",
+    )
+    year = models.PositiveSmallIntegerField(null=False)
+    week = models.PositiveSmallIntegerField(null=False)
+    distance = models.PositiveIntegerField(null=False, default=0)
+
+    class Meta:
+        unique_together = ("user", "year", "week")
+
+    def __str__(self):
+        return "{}: {}/{} - {}".format(self.user, self.year, self.week, self.distance)
+
+
+class WeeklyDistanceSketch(models.Model):
+    """Quantile sketch over the WeeklyDistance of every user, for a (year, week).
+    Used for answering "you ran more than 83% of users this week" """
+
+    year = models.PositiveSmallIntegerField(null=False)
+    week = models.PositiveSmallIntegerField(null=False)
+    data = models.BinaryField(null=False)
+
+    class Meta:
+        unique_together = ("year", "week")
+
+    def __str__(self):
+        return "{}/{}".format(self.year, self.week)
+
+    @property
+    def sketch(self) -> QuantileSketch:
+        if not self.data:
+            return QuantileSketch(settings.PERCENTILE_SKETCH_ACCURACY)
+        return QuantileSketch.from_bytes(self.data)
+
+    @sketch.setter
+    def sketch(self, value: QuantileSketch):
+        self.data = value.to_bytes()
+
+
+class TrainingLoad(models.Model):
+    """Rollup: training load of a user on a day, with the exponentially weighted
+    acute (fatigue) and chronic (fitness) loads up to that day.
+    Only days with activities are stored: the loads decay in between"""
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        null=False,
+        related_name="training_loads",
+    )
+    date = models.DateField(null=False)
+    load = models.FloatField(null=False, default=0)
+    acute = models.FloatField(null=False, default=0)
+    chronic = models.FloatField(null=False, default=0)
+
+    class Meta:
+        unique_together = ("user", "date")
+        ordering = ("user", "date")
+
+    def __str__(self):
+        return "{}: {} - {:.1f}".format(self.user, self.date, self.load)
+
+
+class ActivityDays(models.Model):
+    """Rollup: bitmap of the days of a year in which a user had activities.
+    Bit n (little-endian) is set when there are activities on the day n+1 of the
+    year: 46 bytes per user and year"""
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        null=False,
+        related_name="activity_days",
+    )
+    year = models.PositiveSmallIntegerField(null=False)
+    days = models.BinaryField(null=False, max_length=46)
+
+    class Meta:
+        unique_together = ("user", "year")
+
+    def __str__(self):
+        return "{}: {} - {} days".format(
+            self.user, self.year, bin(self.bitmap).count("1")
+        )
+
+    @property
+    def bitmap(self) -> int:
+        return int.from_bytes(bytes(self.days or b""), "little")
+
+    @bitmap.setter
+    def bitmap(self, value: int):
+        self.days = value.to_bytes(46, "little")
+
+
+class WeatherJob(models.Model):
+    """Pending weather enrichment of an activity, processed by the
+    process_weather_jobs worker. No database constraint (nor cascade) on the
+    activity, so that activities are still deleted in bulk: orphan jobs are
+    dropped by the worker"""
+
+    activity = models.OneToOneField(
+        Activity,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name="weather_job",
+    )
+    attempts = models.PositiveSmallIntegerField(null=False, default=0)
+    # postponed while the weather was unavailable (eg: circuit open)
+    deferrals = models.PositiveIntegerField(null=False, default=0)
+    run_after = models.DateTimeField(null=False, db_index=True)
+    last_error = models.TextField(blank=True, default="")
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return "{} - attempt {}".format(self.activity_id, self.attempts)
+
+    @staticmethod
+    def enqueue(activity_ids):
+        "(re)schedule the weather enrichment of activities (jobs commit with them)"
+        now = timezone.now()
+        with transaction.atomic():
+            WeatherJob.objects.filter(activity_id__in=activity_ids).update(
+                attempts=0, deferrals=0, run_after=now, last_error=""
+            )
+            existing = set(
+                WeatherJob.objects.filter(activity_id__in=activity_ids).values_list(
+                    "activity_id", flat=True
+                )
+            )
+            WeatherJob.objects.bulk_create(
+                [
+                    WeatherJob(activity_id=id, run_after=now)
+                    for id in activity_ids
+                    if id not in existing
+                ]
+            )
+
+
+class ActivityTombstone(models.Model):
+    """A deleted activity, or one moved to another user, for the sync feed of
+    its (previous) user (see sync.py). Kept for SYNC_TOMBSTONE_RETENTION days,
+    even after the user is deleted: no database constraint on the user"""
+
+    activity_id = models.IntegerField(null=False)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name="+",
+    )
+    deleted_at = models.DateTimeField(null=False, db_index=True)
+    # numbered once committed (see sync.py)
+    change_seq = models.BigIntegerField(null=True, blank=True, editable=False)
+
+    _records = itertools.count(1)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "change_seq", "id"]),
+            models.Index(fields=["change_seq", "id"]),
+        ]
+
+    def __str__(self):
+        return "{} - {}".format(self.activity_id, self.deleted_at)
+
+    @classmethod
+    def record(cls, activities):
+        "record the deletion of activities, as (id, user_id)"
+        now = timezone.now()
+        cls.objects.bulk_create(
+            [
+                cls(activity_id=id, user_id=user_id, deleted_at=now)
+                for id, user_id in activities
+            ]
+        )
+        if next(cls._records) % settings.SYNC_TOMBSTONE_PRUNE_EVERY == 0:
+            cls.prune()
+
+    @classmethod
+    def record_moves(cls, activities):
+        "record the activities moved to another user, as deleted for the previous one"
+        moved = []
+        for activity in activities:
+            loaded = getattr(activity, "_loaded_values", {})
+            old_user_id = loaded.get("user_id", activity.user_id)
+            if activity.pk is not None and old_user_id != activity.user_id:
+                moved.append((activity.id, old_user_id))
+        if moved:
+            cls.record(moved)
+
+    @classmethod
+    def prune(cls) -> int:
+        """delete the tombstones older than SYNC_TOMBSTONE_RETENTION days,
+        remembering the last number pruned (older cursors are expired)"""
+        old = cls.objects.filter(
+            deleted_at__lt=timezone.now()
+            - datetime.timedelta(days=settings.SYNC_TOMBSTONE_RETENTION)
+        )
+        with transaction.atomic():
+            pruned = old.aggregate(models.Max("change_seq"))["change_seq__max"]
+            deleted, _ = old.delete()
+            if pruned is not None:
+                ChangeSequence.objects.get_or_create(id=ChangeSequence.ID)
+                ChangeSequence.objects.filter(
+                    id=ChangeSequence.ID, pruned__lt=pruned
+                ).update(pruned=pruned)
+        return deleted
+
+
+class ChangeSequence(models.Model):
+    """The numbering of committed activity changes and tombstones, for the sync
+    feed (see sync.py): a single row"""
+
+    ID = 1
+
+    value = models.BigIntegerField(default=0)  # the last number given
+    pruned = models.BigIntegerField(default=0)  # the last tombstone number pruned
+
+
+class IdempotencyKey(models.Model):
+    """The response to a request sent with an Idempotency-Key header, replayed
+    to its retries for IDEMPOTENCY_KEY_TTL seconds (see idempotency.py)"""
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="+"
+    )
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)  # sha256 of the request
+    status_code = models.PositiveSmallIntegerField(null=True)  # None: running
+    body = models.TextField(blank=True, default="")  # JSON
+    started_at = models.DateTimeField(null=False)
+    expires_at = models.DateTimeField(null=False, db_index=True)
+
+    _records = itertools.count(1)
+
+    class Meta:
+        unique_together = ("user", "key")
+
+    def __str__(self):
+        return "{}: {} - {}".format(self.user_id, self.key, self.status_code)
+
+    @classmethod
+    def prune(cls) -> int:
+        "delete the expired keys"
+        deleted, _ = cls.objects.filter(expires_at__lte=timezone.now()).delete()
+        return deleted
+
+
+class UserDeletionJob(models.Model):
+    """Pending deletion of a (deactivated) user and its data, processed by the
+    process_weather_jobs worker. See deletion.py"""
+
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name="deletion_job",
+    )
+    attempts = models.PositiveSmallIntegerField(null=False, default=0)
+    run_after = models.DateTimeField(null=False, db_index=True)
+    last_error = models.TextField(blank=True, default="")
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return "{} - attempt {}".format(self.user_id, self.attempts)
+
+
+class WeatherCacheEntry(models.Model):
+    """Weather looked up for a geocell (geohash) and a time bucket.
+    See weather_cache.CachedWeatherProvider"""
+
+    geocell = models.CharField(max_length=12, null=False)
+    bucket = models.BigIntegerField(null=False)  # timestamp // bucket size
+    weather_id = models.IntegerField(null=False)
+    title = models.CharField(max_length=80, null=False)
+    description = models.CharField(max_length=254, null=False)
+    created = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(null=False, db_index=True)
+    # stored by the prefetch job (see prefetch.py), and lookups it served since
+    prefetched = models.BooleanField(default=False)
+    hits = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ("geocell", "bucket")
+
+    def __str__(self):
+        return "{} @{}: {}".format(self.geocell, self.bucket, self.title)
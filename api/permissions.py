@@ -3,6 +3,22 @@ from rest_framework import permissions
 from .models import UserRoles, User
 
 
+class IsAdmin(permissions.BasePermission):
+    """
+    Permission to only allow admins (and superusers).
+    """
+
+    def has_permission(self, request, view):
+        return bool(
+            request.user
+            and request.user.is_authenticated
+            and (
+                request.user.is_superuser
+                or request.user.role in [r.value for r in [UserRoles.ADMIN]]
+            )
+        )
+
+
 class IsOwnerOrReadOnly(permissions.BasePermission):
     """
     Object-level permission to only allow owners of an object to edit it.
@@ -0,0 +1,118 @@
+"""Predictive weather prefetch
+
+Most users run from the same few places at about the same times. The spots
+and times of day where a user ran at least WEATHER_PREFETCH_MIN_RUNS times in
+the last WEATHER_PREFETCH_LOOKBACK_DAYS days are mined from the activities, and
+the weather cache is warmed for those geocells ahead of their usual times, so
+the uploads that follow hit the cache.
+"""
+
+import datetime
+from collections import Counter
+from typing import List, NamedTuple, Optional, Set, Tuple
+
+from django.conf import settings
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from . import geohash, metrics
+from .deadlines import deadline
+from .external_sources import get_weather_provider
+from .models import Activity, WeatherCacheEntry
+from .weather_cache import CachedWeatherProvider
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+class PrefetchResult(NamedTuple):
+    slots: int  # habitual (geocell, time of day) slots
+    due: int  # slots due within the horizon
+    prefetched: int  # lookups stored in the cache
+
+
+def habitual_slots(today: datetime.date) -> Set[Tuple[str, int]]:
+    """(geocell, bucket of the day) where some user ran at least
+    WEATHER_PREFETCH_MIN_RUNS times in the lookback period"""
+    since = today - datetime.timedelta(days=settings.WEATHER_PREFETCH_LOOKBACK_DAYS)
+    runs = Counter()
+    for user_id, latitude, longitude, time in (
+        Activity.objects.filter(
+            date__gte=since, latitude__isnull=False, longitude__isnull=False
+        )
+        .values_list("user_id", "latitude", "longitude", "time")
+        .iterator()
+    ):
+        geocell = geohash.encode(
+            float(latitude), float(longitude), settings.WEATHER_CACHE_PRECISION
+        )
+        seconds = time.hour * 3600 + time.minute * 60 + time.second
+        runs[(user_id, geocell, seconds // settings.WEATHER_CACHE_BUCKET)] += 1
+
+    return {
+        (geocell, slot)
+        for (_, geocell, slot), count in runs.items()
+        if count >= settings.WEATHER_PREFETCH_MIN_RUNS
+    }
+
+
+def due_lookups(
+    slots: Set[Tuple[str, int]], now: datetime.datetime
+) -> List[Tuple[datetime.datetime, str]]:
+    "(bucket start, geocell) of the slots overlapping the next WEATHER_PREFETCH_HORIZON"
+    bucket = settings.WEATHER_CACHE_BUCKET
+    horizon = now + datetime.timedelta(seconds=settings.WEATHER_PREFETCH_HORIZON)
+    # activity times are naive, and the cache keys treat them as UTC
+    midnight = datetime.datetime.combine(
+        now.astimezone(datetime.timezone.utc).date(),
+        datetime.time(),
+        tzinfo=datetime.timezone.utc,
+    )
+
+    due = []
+    for geocell, slot in slots:
+        for day in range(2):
+            start = midnight + datetime.timedelta(
+                days=day, seconds=slot * bucket % SECONDS_PER_DAY
+            )
+            if start + datetime.timedelta(seconds=bucket) > now and start < horizon:
+                due.append((start, geocell))
+    return sorted(due)
+
+
+def prefetch_weather(now: Optional[datetime.datetime] = None) -> PrefetchResult:
+    """Warm the weather cache for the habitual slots due soon, with at most
+    WEATHER_PREFETCH_MAX_LOOKUPS lookups (which also take from the API quota)"""
+    provider = get_weather_provider()
+    if not isinstance(provider, CachedWeatherProvider):
+        raise RuntimeError("the weather cache is disabled (WEATHER_CACHE_ENABLED)")
+
+    now = now or timezone.now()
+    slots = habitual_slots(now.date())
+    due = due_lookups(slots, now)
+
+    prefetched = 0
+    for when, geocell in due[: settings.WEATHER_PREFETCH_MAX_LOOKUPS]:
+        lat, lon = geohash.decode(geocell)
+        # don't wait long for the quota: uploads need it more
+        with deadline(settings.WEATHER_HTTP_TIMEOUT):
+            if provider.prefetch(lat, lon, when):
+                prefetched += 1
+
+    metrics.incr("weather.prefetch.lookups", prefetched)
+    return PrefetchResult(len(slots), len(due), prefetched)
+
+
+def prefetch_stats(since: datetime.datetime) -> dict:
+    "how many of the entries prefetched since `since` were used by lookups"
+    stats = WeatherCacheEntry.objects.filter(
+        prefetched=True, created__gte=since
+    ).aggregate(
+        entries=Count("id"),
+        used=Count("id", filter=Q(hits__gt=0)),
+        hits=Sum("hits"),
+    )
+    stats["hits"] = stats["hits"] or 0
+    stats["hit_ratio"] = (
+        round(stats["used"] / stats["entries"], 3) if stats["entries"] else None
+    )
+    return stats
@@ -0,0 +1,116 @@
+"""API quota shared by the processes of a host
+
+The weather API has a calls per minute cap, which applies to all the workers
+together. Workers take their calls from a token bucket kept in a small SQLite
+file (WEATHER_QUOTA_PATH), so no external service is needed.
+"""
+
+import datetime
+import os
+import sqlite3
+import time
+from typing import Optional
+
+from django.conf import settings
+
+from . import metrics
+from .deadlines import QuotaExceeded, remaining
+from .external_sources import AbstractWeatherProvider, WeatherDict
+
+
+class TokenBucket:
+    """Token bucket of `capacity` tokens, refilled at `rate` tokens per second.
+    The state is in a SQLite file: updates are serialized by its write lock"""
+
+    def __init__(self, path: str, name: str, capacity: float, rate: float):
+        self.path = path
+        self.name = name
+        self.capacity = capacity
+        self.rate = rate
+        db = self._connect()
+        try:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS bucket "
+                "(name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+        finally:
+            db.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        # a connection per call: safe across threads and forks
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        return sqlite3.connect(self.path, timeout=5, isolation_level=None)
+
+    def _take(self) -> float:
+        "take a token: returns 0, or the seconds until one is available"
+        db = self._connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            row = db.execute(
+                "SELECT tokens, updated FROM bucket WHERE name = ?", (self.name,)
+            ).fetchone()
+            tokens = (
+                self.capacity
+                if row is None
+                else min(self.capacity, row[0] + max(now - row[1], 0) * self.rate)
+            )
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            db.execute(
+                "INSERT OR REPLACE INTO bucket (name, tokens, updated) "
+                "VALUES (?, ?, ?)",
+                (self.name, tokens, now),
+            )
+            db.execute("COMMIT")
+            return wait
+        finally:
+            db.close()
+
+    def acquire(self, timeout: float = 0) -> bool:
+        "take a token, waiting up to `timeout` seconds for one. False if none"
+        give_up = time.monotonic() + timeout
+        while True:
+            wait = self._take()
+            if not wait:
+                return True
+            if time.monotonic() + wait > give_up:
+                return False
+            time.sleep(wait)
+
+
+class QuotaWeatherProvider(AbstractWeatherProvider):
+    """Calls `provider` only with a token from `bucket`, waiting for one within
+    the current deadline (or WEATHER_QUOTA_MAX_WAIT seconds)"""
+
+    def __init__(self, provider: AbstractWeatherProvider, bucket: TokenBucket):
+        self.provider = provider
+        self.bucket = bucket
+
+    def getWeather(
+        self, lat: float, lon: float, when: datetime.datetime = None, quiet_fail=True
+    ) -> Optional[WeatherDict]:
+        left = remaining()
+        wait = settings.WEATHER_QUOTA_MAX_WAIT if left is None else left
+        if not self.bucket.acquire(timeout=wait):
+            metrics.incr("weather.quota.exceeded")
+            if quiet_fail:
+                return None
+            raise QuotaExceeded("weather API quota exceeded")
+        return self.provider.getWeather(lat, lon, when=when, quiet_fail=quiet_fail)
+
+
+def with_quota(provider: AbstractWeatherProvider) -> QuotaWeatherProvider:
+    "wrap `provider` with the quota configured in settings"
+    return QuotaWeatherProvider(
+        provider,
+        TokenBucket(
+            settings.WEATHER_QUOTA_PATH,
+            "weather",
+            capacity=settings.WEATHER_QUOTA_PER_MINUTE,
+            rate=settings.WEATHER_QUOTA_PER_MINUTE / 60,
+        ),
+    )
@@ -0,0 +1,151 @@
+"""Circuit breaking around weather lookups
+
+The circuit breaker stops calling a failing (or slow) provider for a while, so
+lookups fail fast instead of tying up the workers. Calls also respect the
+current deadline (see deadlines.py).
+"""
+
+import datetime
+import logging
+import threading
+import time
+from enum import Enum
+from typing import Optional
+
+from django.conf import settings
+
+from . import metrics
+from .deadlines import CircuitOpen, DeadlineExceeded, WeatherUnavailable, remaining
+from .external_sources import AbstractWeatherProvider, WeatherDict
+
+logger = logging.getLogger(__name__)
+
+
+class BreakerState(Enum):
+    CLOSED = 0
+    HALF_OPEN = 1
+    OPEN = 2
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures (slow calls count as
+    failures). While open, calls are rejected; after `reset_timeout` seconds a
+    single probe call is let through (half-open), which closes the circuit on
+    success or opens it again on failure"""
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int,
+        slow_call_duration: float,
+        reset_timeout: float,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.slow_call_duration = slow_call_duration
+        self.reset_timeout = reset_timeout
+
+        self.state = BreakerState.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+        metrics.register_gauge("%s.state" % name, lambda: self.state.value)
+
+    def allow(self) -> bool:
+        "whether a call may go through now"
+        with self._lock:
+            if self.state == BreakerState.CLOSED:
+                return True
+            if self.state == BreakerState.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    metrics.incr("%s.rejected" % self.name)
+                    return False
+                self.state = BreakerState.HALF_OPEN
+            # half-open: a single probe at a time
+            if self._probing:
+                metrics.incr("%s.rejected" % self.name)
+                return False
+            self._probing = True
+            return True
+
+    def release(self):
+        "an allowed call was not made (eg: no time left): the outcome is unknown"
+        with self._lock:
+            self._probing = False
+
+    def record(self, success: bool, duration: float):
+        if success and duration > self.slow_call_duration:
+            metrics.incr("%s.slow_calls" % self.name)
+            success = False
+
+        with self._lock:
+            self._probing = False
+            if success:
+                self.failures = 0
+                self.state = BreakerState.CLOSED
+                return
+
+            self.failures += 1
+            if (
+                self.state == BreakerState.HALF_OPEN
+                or self.failures >= self.failure_threshold
+            ):
+                if self.state != BreakerState.OPEN:
+                    logger.warning("Circuit %s opened", self.name)
+                    metrics.incr("%s.trips" % self.name)
+                self.state = BreakerState.OPEN
+                self.opened_at = time.monotonic()
+
+
+class ResilientWeatherProvider(AbstractWeatherProvider):
+    "Calls `provider` within the current deadline, behind a circuit breaker"
+
+    def __init__(self, provider: AbstractWeatherProvider, breaker: CircuitBreaker):
+        self.provider = provider
+        self.breaker = breaker
+
+    def getWeather(
+        self, lat: float, lon: float, when: datetime.datetime = None, quiet_fail=True
+    ) -> Optional[WeatherDict]:
+        try:
+            return self._get_weather(lat, lon, when)
+        except Exception as e:  # pylint: disable=broad-except
+            if not quiet_fail:
+                raise
+            logger.warning("Weather lookup failed: %s", e)
+            return None
+
+    def _get_weather(self, lat: float, lon: float, when: datetime.datetime):
+        if remaining() == 0:
+            raise DeadlineExceeded("weather lookup deadline exceeded")
+        if not self.breaker.allow():
+            raise CircuitOpen("circuit %s is open" % self.breaker.name)
+
+        start = time.monotonic()
+        try:
+            weather = self.provider.getWeather(lat, lon, when=when, quiet_fail=False)
+        except WeatherUnavailable:
+            self.breaker.release()
+            raise
+        except Exception:
+            self.breaker.record(False, time.monotonic() - start)
+            raise
+        self.breaker.record(True, time.monotonic() - start)
+        return weather
+
+
+def resilient(
+    provider: AbstractWeatherProvider, name: str = "weather.breaker"
+) -> ResilientWeatherProvider:
+    "wrap `provider` with a circuit breaker configured from settings"
+    return ResilientWeatherProvider(
+        provider,
+        CircuitBreaker(
+            name,
+            failure_threshold=settings.WEATHER_BREAKER_FAILURES,
+            slow_call_duration=settings.WEATHER_BREAKER_SLOW_CALL,
+            reset_timeout=settings.WEATHER_BREAKER_RESET,
+        ),
+    )
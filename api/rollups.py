@@ -0,0 +1,391 @@
+"""Per-user data derived from activities (rollups)
+
+Rollups are refreshed for the (user, dates) touched by every activity change,
+through the activities_changed signal. They can always be rebuilt from the raw
+activities with `manage.py rebuild_rollups`.
+"""
+
+import datetime
+import math
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.functions import ExtractWeek, ExtractYear
+from django.dispatch import receiver
+
+from .models import (
+    Activity,
+    ActivityDays,
+    TrainingLoad,
+    WeeklyDistance,
+    WeeklyDistanceSketch,
+)
+from .signals import activities_changed
+from .sketches import QuantileSketch
+
+
+def week_of(date: datetime.date) -> Tuple[int, int]:
+    "(year, week) as used by the reports: calendar year and ISO week number"
+    return date.year, date.isocalendar()[1]
+
+
+@receiver(activities_changed)
+def refresh_activity_rollups(sender, user_id: int, dates: Iterable, **kwargs):
+    "Recompute the rollups of a user affected by changes on `dates`"
+    dates = {d for d in dates if d is not None}
+    if user_id is None or not dates:
+        return
+
+    refresh_weekly_distances(user_id, dates)
+    refresh_training_load(user_id, dates)
+    refresh_activity_days(user_id, dates)
+
+
+def refresh_weekly_distances(user_id: int, dates: Set[datetime.date]):
+    "Recompute the user's WeeklyDistance of the weeks of `dates`, and the sketches"
+    for year, week in sorted({week_of(d) for d in dates}):
+        with transaction.atomic():
+            weekly, _ = WeeklyDistance.objects.select_for_update().get_or_create(
+                user_id=user_id, year=year, week=week
+            )
+            total = (
+                Activity.objects.filter(user_id=user_id, date__year=year)
+                .annotate(week=ExtractWeek("date"))
+                .filter(week=week)
+                .aggregate(total=Sum("distance"))["total"]
+                or 0
+            )
+            if total == weekly.distance:
+                if total == 0:
+                    weekly.delete()
+                continue
+
+            _update_sketch(year, week, old=weekly.distance, new=total)
+
+            if total == 0:
+                weekly.delete()
+            else:
+                weekly.distance = total
+                weekly.save(update_fields=["distance"])
+
+
+def _update_sketch(year: int, week: int, old: int, new: int):
+    "move a user's weekly total from `old` to `new` in the week's sketch"
+    row, _ = WeeklyDistanceSketch.objects.select_for_update().get_or_create(
+        year=year, week=week, defaults={"data": b""}
+    )
+    sketch = row.sketch
+    if old > 0:
+        sketch.remove(old)
+    if new > 0:
+        sketch.add(new)
+    row.sketch = sketch
+    row.save(update_fields=["data"])
+
+
+def remove_user_rollups(user_id: int):
+    "Delete the rollups of a user (eg: being deleted), and its totals from the sketches"
+    with transaction.atomic():
+        weekly_distances = WeeklyDistance.objects.select_for_update().filter(
+            user_id=user_id
+        )
+        for weekly in weekly_distances:
+            _update_sketch(weekly.year, weekly.week, old=weekly.distance, new=0)
+        weekly_distances.delete()
+        TrainingLoad.objects.filter(user_id=user_id).delete()
+        ActivityDays.objects.filter(user_id=user_id).delete()
+
+
+def rebuild_weekly_distances():
+    "Rebuild every WeeklyDistance and WeeklyDistanceSketch from the activities"
+    totals = (
+        Activity.objects.annotate(year=ExtractYear("date"), week=ExtractWeek("date"))
+        .values("user_id", "year", "week")
+        .annotate(distance=Sum("distance"))
+        .order_by()
+    )
+
+    sketches = {}
+    weekly_distances = []
+    for row in totals.iterator():
+        if not row["distance"]:
+            continue
+        weekly_distances.append(WeeklyDistance(**row))
+        key = (row["year"], row["week"])
+        if key not in sketches:
+            sketches[key] = QuantileSketch(settings.PERCENTILE_SKETCH_ACCURACY)
+        sketches[key].add(row["distance"])
+
+    with transaction.atomic():
+        WeeklyDistance.objects.all().delete()
+        WeeklyDistance.objects.bulk_create(weekly_distances, batch_size=1000)
+        WeeklyDistanceSketch.objects.all().delete()
+        WeeklyDistanceSketch.objects.bulk_create(
+            [
+                WeeklyDistanceSketch(year=year, week=week, data=sketch.to_bytes())
+                for (year, week), sketch in sketches.items()
+            ],
+            batch_size=1000,
+        )
+
+    return len(weekly_distances)
+
+
+def activity_load(distance: int, duration: datetime.timedelta) -> float:
+    "training load of a single activity: minutes weighted by the squared speed"
+    seconds = duration.total_seconds()
+    if seconds <= 0:
+        return 0.0
+    intensity = (distance / seconds) / settings.TRAINING_LOAD_REFERENCE_SPEED
+    return seconds / 60 * intensity**2
+
+
+def _decay(days: int) -> Tuple[float, float]:
+    "(acute, chronic) factors for a load carried over `days` days"
+    return (
+        math.exp(-days / settings.TRAINING_LOAD_ACUTE_DAYS),
+        math.exp(-days / settings.TRAINING_LOAD_CHRONIC_DAYS),
+    )
+
+
+def _daily_loads(user_id: int, **filters) -> Dict[datetime.date, float]:
+    loads: Dict[datetime.date, float] = defaultdict(float)
+    activities = Activity.objects.filter(user_id=user_id, **filters).values_list(
+        "date", "distance", "duration"
+    )
+    for date, distance, duration in activities.iterator():
+        loads[date] += activity_load(distance, duration)
+    return loads
+
+
+def _accumulate(previous: Optional[TrainingLoad], rows: List[TrainingLoad]):
+    "recompute acute/chronic of `rows` (sorted by date), carrying from `previous`"
+    for row in rows:
+        acute = chronic = 0.0
+        if previous is not None:
+            acute_decay, chronic_decay = _decay((row.date - previous.date).days)
+            acute = previous.acute * acute_decay
+            chronic = previous.chronic * chronic_decay
+        acute_gain, chronic_gain = _decay(1)
+        row.acute = acute + (1 - acute_gain) * row.load
+        row.chronic = chronic + (1 - chronic_gain) * row.load
+        previous = row
+
+
+def refresh_training_load(user_id: int, dates: Set[datetime.date]):
+    """Recompute the user's daily loads on `dates`, and the acute/chronic loads
+    from the first of those dates onward. Earlier days are left untouched"""
+    loads = _daily_loads(user_id, date__in=dates)
+    since = min(dates)
+
+    with transaction.atomic():
+        existing = {
+            row.date: row
+            for row in TrainingLoad.objects.select_for_update().filter(
+                user_id=user_id, date__in=dates
+            )
+        }
+        TrainingLoad.objects.filter(
+            user_id=user_id, date__in=[d for d in existing if not loads.get(d)]
+        ).delete()
+        TrainingLoad.objects.bulk_create(
+            [
+                TrainingLoad(user_id=user_id, date=d, load=load)
+                for d, load in loads.items()
+                if load and d not in existing
+            ]
+        )
+        for d, row in existing.items():
+            if loads.get(d):
+                row.load = loads[d]
+                row.save(update_fields=["load"])
+
+        previous = (
+            TrainingLoad.objects.filter(user_id=user_id, date__lt=since)
+            .order_by("-date")
+            .first()
+        )
+        rows = list(
+            TrainingLoad.objects.select_for_update()
+            .filter(user_id=user_id, date__gte=since)
+            .order_by("date")
+        )
+        _accumulate(previous, rows)
+        TrainingLoad.objects.bulk_update(rows, ["acute", "chronic"], batch_size=1000)
+
+
+def training_load_series(user_id: int, start: datetime.date, end: datetime.date):
+    "daily training loads between start and end (inclusive), decayed between rows"
+    previous = (
+        TrainingLoad.objects.filter(user_id=user_id, date__lt=start)
+        .order_by("-date")
+        .first()
+    )
+    rows = {
+        row.date: row
+        for row in TrainingLoad.objects.filter(
+            user_id=user_id, date__gte=start, date__lte=end
+        )
+    }
+
+    series = []
+    day = start
+    while day <= end:
+        if day in rows:
+            previous = rows[day]
+            load, acute, chronic = previous.load, previous.acute, previous.chronic
+        elif previous is not None:
+            acute_decay, chronic_decay = _decay((day - previous.date).days)
+            load, acute, chronic = (
+                0.0,
+                previous.acute * acute_decay,
+                previous.chronic * chronic_decay,
+            )
+        else:
+            load = acute = chronic = 0.0
+
+        series.append(
+            {
+                "date": day,
+                "load": load,
+                "acute_load": acute,
+                "chronic_load": chronic,
+                "form": chronic - acute,
+            }
+        )
+        day += datetime.timedelta(days=1)
+    return series
+
+
+def rebuild_training_loads(user_ids: Optional[Iterable[int]] = None):
+    "Rebuild the TrainingLoad rows of every user (or of `user_ids`)"
+    if user_ids is None:
+        user_ids = list(
+            Activity.objects.order_by().values_list("user_id", flat=True).distinct()
+        )
+        TrainingLoad.objects.exclude(user_id__in=user_ids).delete()
+
+    count = 0
+    for user_id in user_ids:
+        loads = _daily_loads(user_id)
+        rows = [
+            TrainingLoad(user_id=user_id, date=d, load=load)
+            for d, load in sorted(loads.items())
+            if load
+        ]
+        _accumulate(None, rows)
+
+        with transaction.atomic():
+            TrainingLoad.objects.filter(user_id=user_id).delete()
+            TrainingLoad.objects.bulk_create(rows, batch_size=1000)
+        count += len(rows)
+
+    return count
+
+
+def _day_bit(date: datetime.date) -> int:
+    return 1 << (date.timetuple().tm_yday - 1)
+
+
+def refresh_activity_days(user_id: int, dates: Set[datetime.date]):
+    "Set/clear the bits of `dates` in the user's ActivityDays bitmaps"
+    active = set(
+        Activity.objects.filter(user_id=user_id, date__in=dates)
+        .order_by()
+        .values_list("date", flat=True)
+        .distinct()
+    )
+
+    for year in sorted({d.year for d in dates}):
+        with transaction.atomic():
+            row, _ = ActivityDays.objects.select_for_update().get_or_create(
+                user_id=user_id, year=year, defaults={"days": bytes(46)}
+            )
+            bitmap = row.bitmap
+            for date in dates:
+                if date.year != year:
+                    continue
+                if date in active:
+                    bitmap |= _day_bit(date)
+                else:
+                    bitmap &= ~_day_bit(date)
+
+            if bitmap == 0:
+                row.delete()
+            elif bitmap != row.bitmap:
+                row.bitmap = bitmap
+                row.save(update_fields=["days"])
+
+
+def _longest_run(bitmap: int) -> int:
+    "length of the longest run of consecutive set bits"
+    length = 0
+    while bitmap:
+        bitmap &= bitmap >> 1
+        length += 1
+    return length
+
+
+def activity_day_stats(user_id: int, today: datetime.date) -> Dict[str, int]:
+    """Streaks and consistency of a user, from the ActivityDays bitmaps.
+    The current streak is still alive if the user has not run yet today"""
+    rows = ActivityDays.objects.filter(user_id=user_id, year__lte=today.year)
+    bitmaps = {row.year: row.bitmap for row in rows}
+    if not bitmaps:
+        return {
+            "current_streak": 0,
+            "longest_streak": 0,
+            "days_this_year": 0,
+            "days_last_30_days": 0,
+        }
+
+    # join every year in a single bitmap, bit 0 being the 1st of january of `first`
+    first = min(bitmaps)
+    origin = datetime.date(first, 1, 1)
+    bitmap = 0
+    for year, days in bitmaps.items():
+        bitmap |= days << (datetime.date(year, 1, 1) - origin).days
+
+    today_bit = (today - origin).days
+    bitmap &= (1 << (today_bit + 1)) - 1  # ignore days after today
+
+    # current streak: consecutive bits set, ending today (or yesterday)
+    end = today_bit if bitmap >> today_bit & 1 else today_bit - 1
+    current = 0
+    if end >= 0 and bitmap >> end & 1:
+        unset = ~bitmap & ((1 << (end + 1)) - 1)
+        current = end - (unset.bit_length() - 1)
+
+    year_bit = (datetime.date(today.year, 1, 1) - origin).days
+    last_30 = bitmap >> max(today_bit - 29, 0)
+    return {
+        "current_streak": current,
+        "longest_streak": _longest_run(bitmap),
+        "days_this_year": bin(bitmap >> year_bit).count("1"),
+        "days_last_30_days": bin(last_30).count("1"),
+    }
+
+
+def rebuild_activity_days():
+    "Rebuild every ActivityDays bitmap from the activities"
+    bitmaps: Dict[Tuple[int, int], int] = defaultdict(int)
+    dates = Activity.objects.order_by().values_list("user_id", "date").distinct()
+    for user_id, date in dates.iterator():
+        bitmaps[(user_id, date.year)] |= _day_bit(date)
+
+    with transaction.atomic():
+        ActivityDays.objects.all().delete()
+        ActivityDays.objects.bulk_create(
+            [
+                ActivityDays(
+                    user_id=user_id, year=year, days=bitmap.to_bytes(46, "little")
+                )
+                for (user_id, year), bitmap in bitmaps.items()
+            ],
+            batch_size=1000,
+        )
+
+    return len(bitmaps)
@@ -1,21 +1,46 @@
 from django.conf import settings
 from django.contrib.auth.password_validation import validate_password
+from django.utils.encoding import smart_str
 from rest_framework import serializers
 
-from .models import Activity, User, UserRoles, Weather
+from .models import (
+    Activity,
+    User,
+    UserRoles,
+    Weather,
+    WeatherStatus,
+    weather_catalog,
+)
 
 
 class CustomCurrentUserDefault(dict, serializers.CurrentUserDefault):
     pass
 
 
+class UserSlugRelatedField(serializers.SlugRelatedField):
+    "reads the users from context['users'] (by username) when given, eg: in bulk"
+
+    def to_internal_value(self, data):
+        users = self.context.get("users")
+        if users is None:
+            return super(UserSlugRelatedField, self).to_internal_value(data)
+        if not isinstance(data, str):
+            self.fail("invalid")
+        if data not in users:
+            self.fail(
+                "does_not_exist", slug_name=self.slug_field, value=smart_str(data)
+            )
+        return users[data]
+
+
 class ActivitySerializer(serializers.ModelSerializer):
-    user = serializers.SlugRelatedField(
+    user = UserSlugRelatedField(
         queryset=User.objects.all().filter(is_superuser=False),
         slug_field="username",
         default=CustomCurrentUserDefault(),
     )
-    weather = serializers.SlugRelatedField(read_only=True, slug_field="title")
+    weather = serializers.SerializerMethodField()
+    weather_status = serializers.SerializerMethodField()
     latitude = serializers.FloatField(required=False)
     longitude = serializers.FloatField(required=False)
 
@@ -31,8 +56,16 @@ class ActivitySerializer(serializers.ModelSerializer):
             "longitude",
             "user",
             "weather",
+            "weather_status",
         )
 
+    def get_weather(self, obj):
+        weather = weather_catalog.get(obj.weather_id)
+        return None if weather is None else weather.title
+
+    def get_weather_status(self, obj):
+        return WeatherStatus(obj.weather_status).name
+
 
 class UserSerializer(serializers.ModelSerializer):
     role = serializers.SerializerMethodField()
@@ -97,10 +130,77 @@ class ActivityReportSerializer(serializers.Serializer):
     week = serializers.IntegerField()
     average_speed = serializers.SerializerMethodField()
     distance = serializers.SerializerMethodField()
+    percentile = serializers.SerializerMethodField()
+
+    def get_distance(self, obj):
+        return obj["sum_distance"]
+
+    def get_percentile(self, obj):
+        "percentage of users who ran less than this, on the same week"
+        sketch = self.context.get("sketches", {}).get((obj["year"], obj["week"]))
+        if sketch is None:
+            return None
+        percentile = sketch.percentile_rank(obj["sum_distance"])
+        return None if percentile is None else round(percentile, 1)
+
+    def get_average_speed(self, obj):
+        try:
+            return round(obj["sum_distance"] / obj["sum_duration"].total_seconds(), 3)
+        except ZeroDivisionError:
+            return None
+
+
+class TrainingLoadSerializer(serializers.Serializer):
+    date = serializers.DateField()
+    load = serializers.SerializerMethodField()
+    acute_load = serializers.SerializerMethodField()
+    chronic_load = serializers.SerializerMethodField()
+    form = serializers.SerializerMethodField()
+
+    def get_load(self, obj):
+        return round(obj["load"], 2)
+
+    def get_acute_load(self, obj):
+        return round(obj["acute_load"], 2)
+
+    def get_chronic_load(self, obj):
+        return round(obj["chronic_load"], 2)
+
+    def get_form(self, obj):
+        return round(obj["form"], 2)
+
+
+class ActivityDaysSerializer(serializers.Serializer):
+    current_streak = serializers.IntegerField()
+    longest_streak = serializers.IntegerField()
+    days_this_year = serializers.IntegerField()
+    days_last_30_days = serializers.IntegerField()
+
+
+class WeatherReportSerializer(serializers.Serializer):
+    # conditions may share a title (eg: 500 and 501 are both "Rain")
+    weather_id = serializers.IntegerField(allow_null=True)
+    weather = serializers.SerializerMethodField()
+    weather_description = serializers.SerializerMethodField()
+    count = serializers.IntegerField()
+    distance = serializers.SerializerMethodField()
+    average_distance = serializers.SerializerMethodField()
+    average_speed = serializers.SerializerMethodField()
+
+    def get_weather(self, obj):
+        weather = weather_catalog.get(obj["weather_id"])
+        return None if weather is None else weather.title
+
+    def get_weather_description(self, obj):
+        weather = weather_catalog.get(obj["weather_id"])
+        return None if weather is None else weather.description
 
     def get_distance(self, obj):
         return obj["sum_distance"]
 
+    def get_average_distance(self, obj):
+        return round(obj["sum_distance"] / obj["count"], 1)
+
     def get_average_speed(self, obj):
         try:
             return round(obj["sum_distance"] / obj["sum_duration"].total_seconds(), 3)
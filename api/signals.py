@@ -0,0 +1,8 @@
+"Signals sent by the api app"
+from django.dispatch import Signal
+
+# Sent whenever activities are created, changed or deleted, including the
+# bulk/set-based paths that bypass Activity.save() / Activity.delete().
+# Receivers get `user_id` and `dates` (the activity dates that were touched)
+# and keep the per-user rollups up to date.
+activities_changed = Signal()
@@ -0,0 +1,134 @@
+"""Coalescing of identical in-flight weather lookups
+
+Concurrent lookups for the same place and time (same weather cache key) share
+a single upstream call: the first one makes it, the others wait for its
+result. This works across the threads of a process; across processes, lookups
+are serialized by a lock file per key (see WEATHER_SINGLEFLIGHT_LOCK_DIR and
+weather_cache.CachedWeatherProvider), so the later ones find the weather
+cached by the first. A lookup waits for the lock at most
+WEATHER_SINGLEFLIGHT_LOCK_WAIT seconds (within its deadline), then calls
+upstream anyway.
+"""
+
+import contextlib
+import datetime
+import logging
+import os
+import threading
+import time
+import zlib
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from . import metrics
+from .deadlines import DeadlineExceeded, remaining
+from .external_sources import AbstractWeatherProvider, WeatherDict
+
+logger = logging.getLogger(__name__)
+
+# lock files are shared by keys with the same hash (no file per key)
+LOCK_STRIPES = 64
+# seconds between attempts to take a lock file (doubled up to the maximum)
+LOCK_POLL_INTERVAL = 0.005
+MAX_LOCK_POLL_INTERVAL = 0.1
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    "runs a function once per key at a time, sharing its outcome with concurrent callers"
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, function: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            metrics.incr("weather.singleflight.coalesced")
+            if not call.done.wait(timeout=remaining()):
+                raise DeadlineExceeded("weather lookup deadline exceeded")
+        else:
+            try:
+                call.result = function()
+            except BaseException as e:  # pylint: disable=broad-except
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+
+@contextlib.contextmanager
+def file_lock(directory: Optional[str], key: Hashable, timeout: float):
+    """exclusive lock (across processes) for `key`, waiting up to `timeout`
+    seconds (or the current deadline, if sooner). Yields whether it is held:
+    False without a directory, or when the wait timed out"""
+    if not directory:
+        yield False
+        return
+
+    import fcntl  # POSIX only, so imported when enabled
+
+    left = remaining()
+    give_up = time.monotonic() + (timeout if left is None else min(timeout, left))
+    os.makedirs(directory, exist_ok=True)
+    stripe = zlib.crc32(repr(key).encode()) % LOCK_STRIPES
+    path = os.path.join(directory, "weather-%02d.lock" % stripe)
+    with open(path, "a") as lock:
+        delay = LOCK_POLL_INTERVAL
+        while True:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                left = give_up - time.monotonic()
+                if left <= 0:
+                    metrics.incr("weather.singleflight.lock_timeouts")
+                    yield False
+                    return
+                time.sleep(min(delay, left))
+                delay = min(delay * 2, MAX_LOCK_POLL_INTERVAL)
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+class SingleFlightWeatherProvider(AbstractWeatherProvider):
+    "Coalesces concurrent lookups of the same weather cache key (in this process)"
+
+    def __init__(self, provider: AbstractWeatherProvider):
+        self.provider = provider
+        self.flights = SingleFlight()
+
+    def getWeather(
+        self, lat: float, lon: float, when: datetime.datetime = None, quiet_fail=True
+    ) -> Optional[WeatherDict]:
+        # late import: weather_cache imports this module
+        from .weather_cache import cache_key
+
+        try:
+            return self.flights.do(
+                cache_key(lat, lon, when),
+                lambda: self.provider.getWeather(lat, lon, when=when, quiet_fail=False),
+            )
+        except Exception as e:  # pylint: disable=broad-except
+            # the call is shared: each caller decides whether to raise
+            if not quiet_fail:
+                raise
+            logger.warning("Weather lookup failed: %s", e)
+            return None
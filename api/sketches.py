@@ -0,0 +1,127 @@
+"""Streaming quantile sketches
+
+QuantileSketch is a log-bucketed sketch (same idea as DDSketch): every positive
+value x is counted in the bucket ceil(log_gamma(x)), with
+gamma = (1 + accuracy) / (1 - accuracy). All the values sharing a bucket are
+within `accuracy` (relative) of each other, so:
+
+    - quantiles are answered with a relative error <= accuracy
+    - percentile_rank(x) is exact for every value outside x's bucket. Only the
+      values within ~accuracy (relative) of x are uncertain, and they are
+      counted as half below / half above x (mid-rank).
+
+Unlike t-digest or KLL, buckets are plain counters, so values can be removed
+again. That is what lets a user's weekly total move from 5km to 8km.
+The number of buckets is bounded by log_gamma(max / min): with 1% accuracy,
+distances from 1m to 1000km need at most ~700 buckets.
+"""
+
+import bisect
+import math
+import struct
+from typing import Dict, List, Optional
+
+_HEADER = struct.Struct("<d")
+_BUCKET = struct.Struct("<iI")
+
+
+class QuantileSketch:
+    "Mergeable, deletable log-bucketed quantile sketch of positive values"
+
+    def __init__(self, accuracy: float = 0.01):
+        if not 0 < accuracy < 1:
+            raise ValueError("accuracy must be between 0 and 1")
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.buckets: Dict[int, int] = {}
+        self._cumulative: Optional[List[int]] = None
+        self._keys: List[int] = []
+
+    @property
+    def count(self) -> int:
+        return sum(self.buckets.values())
+
+    def key(self, value: float) -> int:
+        "bucket index of a positive value"
+        return int(math.ceil(math.log(value) / self._log_gamma))
+
+    def add(self, value: float, count: int = 1):
+        if value <= 0:
+            raise ValueError("only positive values are supported")
+        k = self.key(value)
+        self.buckets[k] = self.buckets.get(k, 0) + count
+        self._cumulative = None
+
+    def remove(self, value: float, count: int = 1):
+        "remove a value previously added. Unknown values are ignored"
+        if value <= 0:
+            return
+        k = self.key(value)
+        remaining = self.buckets.get(k, 0) - count
+        if remaining > 0:
+            self.buckets[k] = remaining
+        else:
+            self.buckets.pop(k, None)
+        self._cumulative = None
+
+    def merge(self, other: "QuantileSketch"):
+        if other.accuracy != self.accuracy:
+            raise ValueError("cannot merge sketches with different accuracy")
+        for k, c in other.buckets.items():
+            self.buckets[k] = self.buckets.get(k, 0) + c
+        self._cumulative = None
+
+    def _index(self):
+        "sorted bucket keys + prefix sums, so that ranks are O(log buckets)"
+        if self._cumulative is None:
+            self._keys = sorted(self.buckets)
+            self._cumulative = []
+            total = 0
+            for k in self._keys:
+                total += self.buckets[k]
+                self._cumulative.append(total)
+        return self._keys, self._cumulative
+
+    def percentile_rank(self, value: float, exclude_self=True) -> Optional[float]:
+        """Percentage of values lower than `value` (0-100), or None if empty.
+        With exclude_self, `value` is assumed to be one of the counted values
+        (eg: the user's own total) and is left out of the population"""
+        keys, cumulative = self._index()
+        population = (cumulative[-1] if cumulative else 0) - (1 if exclude_self else 0)
+        if population <= 0:
+            return None
+        if value <= 0:
+            return 0.0
+
+        k = self.key(value)
+        i = bisect.bisect_left(keys, k)
+        below = cumulative[i - 1] if i > 0 else 0
+        same = self.buckets.get(k, 0) - (1 if exclude_self else 0)
+        return 100.0 * (below + max(same, 0) / 2) / population
+
+    def quantile(self, q: float) -> Optional[float]:
+        "approximate value at quantile q (0-1), or None if empty"
+        keys, cumulative = self._index()
+        if not cumulative:
+            return None
+        rank = q * (cumulative[-1] - 1)
+        i = bisect.bisect_right(cumulative, rank)
+        i = min(i, len(keys) - 1)
+        # middle of the bucket (gamma^(k-1), gamma^k] is within accuracy of any value
+        return 2 * self.gamma ** keys[i] / (self.gamma + 1)
+
+    def to_bytes(self) -> bytes:
+        "compact binary form: accuracy + (bucket, count) pairs, 8 bytes per bucket"
+        return _HEADER.pack(self.accuracy) + b"".join(
+            _BUCKET.pack(k, c) for k, c in sorted(self.buckets.items())
+        )
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "QuantileSketch":
+        data = bytes(data)
+        (accuracy,) = _HEADER.unpack_from(data)
+        sketch = cls(accuracy)
+        for k, c in _BUCKET.iter_unpack(data[_HEADER.size :]):
+            sketch.buckets[k] = c
+        return sketch
@@ -0,0 +1,181 @@
+"""Incremental sync of activities
+
+Every write of an activity resets its change_seq, and every deletion (or move
+to another user) records an ActivityTombstone without one. A sync first
+numbers the changes committed since the previous one (stamp()), then returns,
+in (number, id) order, the activities changed and the tombstones recorded
+after an opaque cursor, and the cursor to continue from: a client transfers
+the changes since its last sync instead of every activity.
+
+Changes are numbered once committed, in a transaction serialized by the
+ChangeSequence row, so a change committed late (eg: by a long import) gets a
+number after every cursor handed out before: no change is skipped, however
+long its transaction. Tombstones are kept SYNC_TOMBSTONE_RETENTION days: older
+cursors are expired, and the client must sync from scratch.
+"""
+
+import base64
+import binascii
+import json
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Q, QuerySet
+
+from .models import Activity, ActivityTombstone, ChangeSequence
+
+# the position in a stream of changes: after (number, id), or after every
+# change numbered up to `number` when id is None
+Position = Tuple[int, Optional[int]]
+
+
+class CursorError(ValueError):
+    "the cursor is invalid"
+
+
+class CursorExpired(CursorError):
+    "the tombstones after the cursor were pruned"
+
+
+class Cursor(NamedTuple):
+    activities: Optional[Position]  # None: from the first activity
+    deleted: Position
+
+    def encode(self) -> str:
+        data = {
+            "a": _encode_position(self.activities),
+            "d": _encode_position(self.deleted),
+        }
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).decode()
+
+    @classmethod
+    def decode(cls, value: str) -> "Cursor":
+        try:
+            data = json.loads(base64.urlsafe_b64decode(value.encode()))
+            return cls(_decode_position(data["a"]), _decode_position(data["d"]))
+        except (binascii.Error, ValueError, KeyError, TypeError):
+            raise CursorError("Invalid cursor")
+
+
+def _encode_position(position: Optional[Position]):
+    return None if position is None else list(position)
+
+
+def _decode_position(data) -> Optional[Position]:
+    if data is None:
+        return None
+    number, id = data
+    if not isinstance(number, int) or (id is not None and not isinstance(id, int)):
+        raise ValueError("Invalid position")
+    return number, id
+
+
+class Changes(NamedTuple):
+    activities: List[Activity]
+    deleted: List[int]  # activity ids
+    cursor: Cursor
+    more: bool  # whether there are more changes (before the settle horizon)
+
+
+def _after(queryset: QuerySet, position: Optional[Position]):
+    if position is None:
+        return queryset
+    number, id = position
+    if id is None:
+        return queryset.filter(change_seq__gt=number)
+    return queryset.filter(Q(change_seq__gt=number) | Q(change_seq=number, id__gt=id))
+
+
+def _page(queryset: QuerySet, position, last: int, limit: int):
+    "the next `limit` rows after `position`, up to number `last`, and their position"
+    rows = list(
+        _after(queryset, position)
+        .filter(change_seq__lte=last)
+        .order_by("change_seq", "id")[: limit + 1]
+    )
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if more:
+        position = (rows[-1].change_seq, rows[-1].id)
+    else:
+        # everything up to `last` was read
+        position = (last, None)
+    return rows, position, more
+
+
+def _expired(position: Position, pruned: int) -> bool:
+    "whether tombstones after `position` may have been pruned (up to `pruned`)"
+    number, id = position
+    return number < pruned or (number == pruned and id is not None)
+
+
+def stamp() -> ChangeSequence:
+    """number the changes committed since the last stamp. Returns the sequence:
+    every change up to its `value` is numbered"""
+    pending = (
+        Activity.objects.filter(change_seq__isnull=True).exists()
+        or ActivityTombstone.objects.filter(change_seq__isnull=True).exists()
+    )
+    sequence, _ = ChangeSequence.objects.get_or_create(id=ChangeSequence.ID)
+    if not pending:
+        return sequence
+    with transaction.atomic():
+        # locks the row (sqlite: the database) until the commit: stamps are
+        # serialized, so their numbers are committed in order
+        ChangeSequence.objects.filter(id=ChangeSequence.ID).update(value=F("value") + 1)
+        sequence = ChangeSequence.objects.get(id=ChangeSequence.ID)
+        for model in [Activity, ActivityTombstone]:
+            model.objects.filter(change_seq__isnull=True).update(
+                change_seq=sequence.value
+            )
+    return sequence
+
+
+def latest_cursor() -> Cursor:
+    "a cursor after every change committed so far"
+    last = stamp().value
+    return Cursor((last, None), (last, None))
+
+
+def changes(
+    cursor: Optional[Cursor],
+    user_id: Optional[int],
+    limit: Optional[int] = None,
+    related: Iterable[str] = (),
+) -> Changes:
+    """the activities changed and deleted after `cursor` (None: every
+    activity), of `user_id` (None: of every user), up to `limit` of each. The
+    activities are loaded with their user and the `related` relations.
+    Raises CursorExpired when tombstones after the cursor were pruned"""
+    limit = limit or settings.SYNC_PAGE_SIZE
+    sequence = stamp()
+    if cursor is None:
+        # a first sync: every activity, and the deletions from now on
+        cursor = Cursor(None, (sequence.value, None))
+    elif _expired(cursor.deleted, sequence.pruned):
+        raise CursorExpired("Cursor expired: sync from scratch (without cursor)")
+
+    activities = Activity.objects.select_related("user", *related)
+    tombstones = ActivityTombstone.objects.all()
+    # the activities moved away are still there: not deleted for every user,
+    # nor for a user they were moved back to
+    remaining = Activity.objects.filter(id=OuterRef("activity_id"))
+    if user_id is not None:
+        activities = activities.filter(user_id=user_id)
+        tombstones = tombstones.filter(user_id=user_id)
+        remaining = remaining.filter(user_id=user_id)
+    tombstones = tombstones.exclude(Exists(remaining))
+
+    changed, activities_position, more_activities = _page(
+        activities, cursor.activities, sequence.value, limit
+    )
+    deleted, deleted_position, more_deleted = _page(
+        tombstones, cursor.deleted, sequence.value, limit
+    )
+    return Changes(
+        changed,
+        [tombstone.activity_id for tombstone in deleted],
+        Cursor(activities_position, deleted_position),
+        more_activities or more_deleted,
+    )
@@ -9,7 +9,7 @@ from rest_framework.schemas import get_schema_view
 
 from jogging_tracker import __version__
 
-from . import views
+from . import batch, views
 
 router = SimpleRouter(trailing_slash=False)
 router.register("activities", views.ActivityViewSet)
@@ -21,6 +21,8 @@ urlpatterns = [
     path("", include(router.urls)),
     path("auth/login", obtain_auth_token, name="api_auth_token"),
     path("auth/logout", views.Logout.as_view()),
+    path("metrics", views.Metrics.as_view()),
+    path("batch", views.Batch.as_view(), name=batch.BATCH_URL_NAME),
     path(
         "schema.yaml",
         get_schema_view(
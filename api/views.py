@@ -1,29 +1,92 @@
+import datetime
+
+from django.conf import settings
 from django.contrib.auth import logout
-from django.core.exceptions import ObjectDoesNotExist, ValidationError
-from django.db.models import Sum
+from django.core.cache import cache
+from django.core.exceptions import FieldError, ObjectDoesNotExist, ValidationError
+from django.db.models import Count, Q, Sum
 from django.db.models.functions import ExtractWeek, ExtractYear
-from django.http import HttpResponse, HttpResponseBadRequest
+from django.http import Http404, HttpResponse, HttpResponseBadRequest
 from rest_framework import mixins, status, viewsets
 from rest_framework.decorators import action
 from rest_framework.exceptions import PermissionDenied
+from rest_framework.parsers import MultiPartParser
 from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from advanced_filters.filters import ParseError
+
+from . import batch, imports, metrics, sync
+from .aggregations import (
+    AggregationError,
+    build_aggregation,
+    parse_list,
+    to_representation,
+)
+from .bulk import (
+    BulkUpdateError,
+    matching_updates,
+    resolve_users,
+    save_activities,
+    update_matching,
+)
+from .caching import cache_key
+from .deletion import delete_user, schedule_user_deletion
 from .filter_backends import (
     IsOwnerOrAdminFilterBackend,
     IsSelfOrAdminFilterBackend,
     IsSelfOrManagerFilterBackend,
 )
-from .models import Activity, User, UserRoles, Weather
-from .permissions import IsOwnerOrAdmin, IsSelfOrAdmin, IsSelfOrManager
+from .idempotency import idempotent
+from .models import (
+    Activity,
+    User,
+    UserRoles,
+    Weather,
+    WeeklyDistanceSketch,
+    weather_catalog,
+)
+from .permissions import IsAdmin, IsOwnerOrAdmin, IsSelfOrAdmin, IsSelfOrManager
+from .rollups import activity_day_stats, training_load_series
 from .serializers import (
+    ActivityDaysSerializer,
     ActivityReportSerializer,
     ActivitySerializer,
+    TrainingLoadSerializer,
     UserSerializer,
+    WeatherReportSerializer,
     WeatherSerializer,
 )
 
+MAX_TRAINING_LOAD_DAYS = 366
+
+
+class BulkItemError(Exception):
+    "an item of a bulk request was not saved"
+
+    def __init__(self, status_code, errors):
+        super(BulkItemError, self).__init__(errors)
+        self.status_code = status_code
+        self.errors = errors
+
+
+def _bulk_id(item):
+    "the `id` of a bulk update item (None if missing or invalid)"
+    if not isinstance(item, dict):
+        return None
+    id = item.get("id")
+    return id if isinstance(id, int) and not isinstance(id, bool) else None
+
+
+def _parse_date(value, default):
+    if not value:
+        return default
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise ValueError("Invalid date %s, expected YYYY-MM-DD" % value)
+
 
 # Create your views here.
 def hello_world(request):
@@ -49,6 +112,41 @@ class Logout(APIView):
         return Response(status=status.HTTP_200_OK)
 
 
+class Metrics(APIView):
+    """Return the metrics of the process answering the request (admins only)"""
+
+    permission_classes = (IsAuthenticated, IsAdmin)
+
+    def get(self, request):
+        return Response(metrics.snapshot())
+
+
+class Batch(APIView):
+    """Run a list of up to BATCH_MAX_REQUESTS API requests (each a `method`,
+    a `path` and an optional JSON `body`) as the caller, in one round-trip.
+    Consecutive reads run in parallel, writes in order. `results` has the
+    `status` and `body` of each request"""
+
+    permission_classes = (IsAuthenticated,)
+
+    def post(self, request):
+        items = request.data
+        if not isinstance(items, list):
+            return Response(
+                {"detail": "Expected a list of requests"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if len(items) > settings.BATCH_MAX_REQUESTS:
+            return Response(
+                {
+                    "detail": "Too many requests (more than %d)"
+                    % settings.BATCH_MAX_REQUESTS
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        return Response({"results": batch.run_batch(request, items)})
+
+
 class ActivityViewSet(
     mixins.CreateModelMixin,
     mixins.ListModelMixin,
@@ -82,11 +180,281 @@ class ActivityViewSet(
     """
 
     lookup_field = "id"
-    queryset = Activity.objects.select_related("user", "weather")
+    # the weather title comes from the catalog (see ActivitySerializer)
+    queryset = Activity.objects.select_related("user")
     serializer_class = ActivitySerializer
     permission_classes = (IsAuthenticated, IsOwnerOrAdmin)
     filter_backends = (IsOwnerOrAdminFilterBackend,)
 
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super(ActivityViewSet, self).create(request, *args, **kwargs)
+
+    @action(detail=False, methods=["get"])
+    def aggregate(self, request):
+        """Return owned Activities grouped by `group_by` dimensions
+        (user, weather, date, year, month, week, weekday), with `metrics`
+        (count, or <sum|avg|min|max>:<distance|duration>). Supports `q` filtering"""
+        group_by = parse_list(request.query_params.get("group_by"))
+        aggregates = parse_list(request.query_params.get("metrics"))
+
+        queryset = self.filter_queryset(self.get_queryset())
+        # regular users only see their own activities
+        owner = None if self._sees_all_activities(request.user) else request.user.id
+        key = cache_key(
+            "activities-aggregate",
+            owner,
+            group_by,
+            aggregates,
+            request.query_params.get("q"),
+        )
+
+        results = cache.get(key)
+        if results is None:
+            try:
+                aggregation = build_aggregation(queryset, group_by, aggregates)
+            except AggregationError as e:
+                return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+            rows = list(aggregation[: settings.AGGREGATE_MAX_GROUPS + 1])
+            if len(rows) > settings.AGGREGATE_MAX_GROUPS:
+                return Response(
+                    {
+                        "detail": "Too many groups (more than %d). Narrow the query"
+                        % settings.AGGREGATE_MAX_GROUPS
+                    },
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            results = [to_representation(row) for row in rows]
+            cache.set(key, results, settings.AGGREGATE_CACHE_TTL)
+
+        return Response({"count": len(results), "results": results})
+
+    @action(detail=False, methods=["post", "patch"])
+    @idempotent
+    def bulk(self, request):
+        """Create (POST) or update (PATCH, items with their `id`) a list of up to
+        ACTIVITY_BULK_MAX_ITEMS activities. The valid items are saved in a single
+        transaction. `results` has the `status` of each item, with the `activity`
+        saved or its `errors`"""
+        items = request.data
+        if not isinstance(items, list):
+            return Response(
+                {"detail": "Expected a list of activities"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if len(items) > settings.ACTIVITY_BULK_MAX_ITEMS:
+            return Response(
+                {
+                    "detail": "Too many activities (more than %d)"
+                    % settings.ACTIVITY_BULK_MAX_ITEMS
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        creating = request.method == "POST"
+        instances = {}
+        if not creating:
+            instances = self.filter_queryset(self.get_queryset()).in_bulk(
+                [item["id"] for item in items if _bulk_id(item) is not None]
+            )
+        context = dict(self.get_serializer_context(), users=resolve_users(items))
+
+        results = []
+        valid = []  # (index, activity)
+        seen_ids = set()
+        for index, item in enumerate(items):
+            try:
+                activity = self._bulk_validate(item, instances, seen_ids, context)
+            except BulkItemError as e:
+                results.append({"status": e.status_code, "errors": e.errors})
+                continue
+            results.append(None)
+            valid.append((index, activity))
+
+        activities = [activity for _, activity in valid]
+        save_activities(
+            created=activities if creating else [],
+            updated=[] if creating else activities,
+            workers=settings.ACTIVITY_BULK_WORKERS,
+        )
+
+        saved_status = status.HTTP_201_CREATED if creating else status.HTTP_200_OK
+        for index, activity in valid:
+            results[index] = {
+                "status": saved_status,
+                "activity": self.get_serializer(activity).data,
+            }
+
+        if len(valid) == len(items):
+            response_status = saved_status
+        elif valid:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        return Response({"results": results}, status=response_status)
+
+    @action(detail=False, methods=["get"])
+    def sync(self, request):
+        """Return the owned activities changed (`activities`) and deleted
+        (`deleted`: their ids) after `cursor`, up to `limit` of each, with the
+        `cursor` to continue from. Without `cursor`: every activity. `more` is
+        true until the client is up to date. 410 when the cursor expired"""
+        owner = None if self._sees_all_activities(request.user) else request.user.id
+        try:
+            limit = int(request.query_params.get("limit", settings.SYNC_PAGE_SIZE))
+            cursor = request.query_params.get("cursor")
+            result = sync.changes(
+                sync.Cursor.decode(cursor) if cursor else None,
+                owner,
+                min(max(limit, 1), settings.SYNC_PAGE_SIZE),
+            )
+        except sync.CursorExpired as e:
+            return Response({"detail": str(e)}, status=status.HTTP_410_GONE)
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(
+            {
+                "activities": self.get_serializer(result.activities, many=True).data,
+                "deleted": result.deleted,
+                "cursor": result.cursor.encode(),
+                "more": result.more,
+            }
+        )
+
+    @action(
+        detail=False,
+        methods=["post"],
+        url_path="import",
+        parser_classes=(MultiPartParser,),
+    )
+    def import_file(self, request):
+        """Import the activities of a GPX, TCX or CSV `file` (multipart upload),
+        for `user` (admins only, default: yourself). The `format` defaults to the
+        file extension. Their weather is looked up later"""
+        upload = request.data.get("file")
+        if upload is None:
+            return Response(
+                {"detail": "Expected a `file`"}, status=status.HTTP_400_BAD_REQUEST
+            )
+        format = request.data.get("format") or imports.detect_format(upload.name)
+        if format not in imports.FORMATS:
+            return Response(
+                {
+                    "detail": "Unknown format: expected one of %s"
+                    % ", ".join(imports.FORMATS)
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        user = request.user
+        if "user" in request.data:
+            # (IsOwnerOrAdmin only lets admins name other users)
+            user = User.objects.filter(
+                is_superuser=False, username=request.data["user"]
+            ).first()
+            if user is None:
+                return Response(
+                    {"detail": "Unknown user %s" % request.data["user"]},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+
+        try:
+            result = imports.import_activities(user, upload.file, format)
+        except imports.ActivityImportError as e:
+            return Response(
+                dict(e.result._asdict(), detail=str(e)),
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        return Response(result._asdict(), status=status.HTTP_201_CREATED)
+
+    @action(
+        detail=False,
+        methods=["patch", "delete"],
+        permission_classes=(IsAuthenticated, IsAdmin),
+    )
+    def matching(self, request):
+        """Update (PATCH) or delete (DELETE) every Activity matching the `q`
+        filter, in a single statement (admins only). PATCH sets `distance` and/or
+        `duration` (the distance may be `{"multiply": factor}`). With
+        `dry_run=true`, only counts them. Refused over ACTIVITY_FILTER_MAX_ROWS"""
+        if not request.query_params.get("q"):
+            return Response(
+                {"detail": "Expected a `q` filter"}, status=status.HTTP_400_BAD_REQUEST
+            )
+        values = None
+        if request.method == "PATCH":
+            try:
+                values = matching_updates(request.data)
+            except BulkUpdateError as e:
+                return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            queryset = self.filter_queryset(self.get_queryset())
+            count = queryset.count()
+        except (ParseError, FieldError, ValidationError, ValueError) as e:
+            return Response(
+                {"detail": "Invalid filter: %s" % e}, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        if count > settings.ACTIVITY_FILTER_MAX_ROWS:
+            return Response(
+                {
+                    "detail": "%d activities match, more than %d. Narrow the query"
+                    % (count, settings.ACTIVITY_FILTER_MAX_ROWS),
+                    "count": count,
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if request.query_params.get("dry_run", "").lower() in ["true", "1", "yes"]:
+            return Response({"count": count, "dry_run": True})
+
+        count = update_matching(queryset, values)
+        return Response({"count": count, "dry_run": False})
+
+    def _bulk_validate(self, item, instances, seen_ids, context):
+        "the unsaved Activity of a bulk item. Raises BulkItemError"
+        if not isinstance(item, dict):
+            raise BulkItemError(
+                status.HTTP_400_BAD_REQUEST,
+                {"non_field_errors": ["Expected an activity object"]},
+            )
+
+        instance = None
+        if self.request.method == "PATCH":
+            id = _bulk_id(item)
+            instance = instances.get(id)
+            if instance is None:
+                raise BulkItemError(status.HTTP_404_NOT_FOUND, {"detail": "Not found."})
+            if id in seen_ids:
+                raise BulkItemError(
+                    status.HTTP_400_BAD_REQUEST, {"id": ["Repeated in the request"]}
+                )
+            seen_ids.add(id)
+
+        serializer = self.get_serializer(
+            instance, data=item, partial=instance is not None, context=context
+        )
+        if not serializer.is_valid():
+            raise BulkItemError(status.HTTP_400_BAD_REQUEST, serializer.errors)
+
+        activity = instance or Activity()
+        for attr, value in serializer.validated_data.items():
+            setattr(activity, attr, value)
+
+        # regular users only write their own activities
+        user = self.request.user
+        if activity.user_id != user.id and not self._sees_all_activities(user):
+            raise BulkItemError(
+                status.HTTP_403_FORBIDDEN, {"detail": PermissionDenied.default_detail}
+            )
+        return activity
+
+    @staticmethod
+    def _sees_all_activities(user):
+        return user.is_superuser or user.role == UserRoles.ADMIN.value
+
 
 class UserViewSet(
     mixins.CreateModelMixin,
@@ -128,7 +496,8 @@ class UserViewSet(
 
     @action(detail=True, methods=["get"], filter_backends=(IsSelfOrAdminFilterBackend,))
     def report(self, request, username=None):
-        "Return a report on average speed & distance per week"
+        """Return a report on average speed & distance per week,
+        with the percentile of the user among all users on each week"""
         activities_avg_by_week = (
             self.get_object()
             .activities.values("date", "distance", "duration")
@@ -139,13 +508,98 @@ class UserViewSet(
         )
 
         page = self.paginate_queryset(activities_avg_by_week)
+        rows = page if page is not None else list(activities_avg_by_week)
+        context = {"sketches": self._get_week_sketches(rows)}
+
+        serializer = ActivityReportSerializer(rows, many=True, context=context)
         if page is not None:
-            serializer = ActivityReportSerializer(page, many=True)
             return self.get_paginated_response(serializer.data)
+        return Response(serializer.data)
 
-        serializer = ActivityReportSerializer(activities_avg_by_week, many=True)
+    @action(
+        detail=True,
+        methods=["get"],
+        url_path="training-load",
+        filter_backends=(IsSelfOrAdminFilterBackend,),
+    )
+    def training_load(self, request, username=None):
+        """Return the daily training load, with acute (fatigue) and chronic (fitness)
+        loads. Accepts `start` and `end` dates (default: the last 6 weeks)"""
+        user = self.get_object()
+        try:
+            end = _parse_date(request.query_params.get("end"), datetime.date.today())
+            start = _parse_date(
+                request.query_params.get("start"),
+                end - datetime.timedelta(days=settings.TRAINING_LOAD_CHRONIC_DAYS - 1),
+            )
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        if start > end or (end - start).days >= MAX_TRAINING_LOAD_DAYS:
+            return Response(
+                {
+                    "detail": "start must precede end, by at most %d days"
+                    % MAX_TRAINING_LOAD_DAYS
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        serializer = TrainingLoadSerializer(
+            training_load_series(user.id, start, end), many=True
+        )
         return Response(serializer.data)
 
+    @action(
+        detail=True,
+        methods=["get"],
+        url_path="weather-report",
+        filter_backends=(IsSelfOrAdminFilterBackend,),
+    )
+    def weather_report(self, request, username=None):
+        "Return a report on average speed & distance per weather condition"
+        user = self.get_object()
+        key = cache_key("weather-report", user.id)
+
+        data = cache.get(key)
+        if data is None:
+            activities_by_weather = (
+                user.activities.order_by()
+                .values("weather_id")
+                .annotate(
+                    count=Count("id"),
+                    sum_distance=Sum("distance"),
+                    sum_duration=Sum("duration"),
+                )
+                .order_by("weather_id")
+            )
+            data = WeatherReportSerializer(activities_by_weather, many=True).data
+            cache.set(key, data, settings.WEATHER_REPORT_CACHE_TTL)
+
+        return Response(data)
+
+    @action(detail=True, methods=["get"], filter_backends=(IsSelfOrAdminFilterBackend,))
+    def streaks(self, request, username=None):
+        "Return the current & longest running streaks, and days ran recently"
+        user = self.get_object()
+        serializer = ActivityDaysSerializer(
+            activity_day_stats(user.id, datetime.date.today())
+        )
+        return Response(serializer.data)
+
+    def _get_week_sketches(self, rows):
+        "load the sketches of the weeks present in `rows`, in a single query"
+        weeks = {(row["year"], row["week"]) for row in rows}
+        if not weeks:
+            return {}
+
+        query = Q()
+        for year, week in weeks:
+            query |= Q(year=year, week=week)
+        return {
+            (s.year, s.week): s.sketch
+            for s in WeeklyDistanceSketch.objects.filter(query)
+        }
+
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -175,6 +629,14 @@ class UserViewSet(
             serializer.data, status=status.HTTP_201_CREATED, headers=headers
         )
 
+    def destroy(self, request, *args, **kwargs):
+        instance = self.get_object()
+        if settings.USER_DELETION_ASYNC:
+            schedule_user_deletion(instance)
+            return Response(status=status.HTTP_202_ACCEPTED)
+        delete_user(instance.id)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
     def update(self, request, *args, **kwargs):
         partial = kwargs.pop("partial", False)
         instance = self.get_object()
@@ -228,3 +690,19 @@ class WeatherViewSet(
     lookup_field = "title"
     queryset = Weather.objects.all()
     serializer_class = WeatherSerializer
+
+    # served from the in-memory catalog (no queries)
+    def list(self, request, *args, **kwargs):
+        weathers = weather_catalog.all()
+        page = self.paginate_queryset(weathers)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        return Response(self.get_serializer(weathers, many=True).data)
+
+    def get_object(self):
+        weather = weather_catalog.get_by_title(self.kwargs[self.lookup_field])
+        if weather is None:
+            raise Http404
+        self.check_object_permissions(self.request, weather)
+        return weather
@@ -0,0 +1,159 @@
+"""Persistent weather cache
+
+Runs from the same place at similar times get the same weather: lookups are
+cached in the database, keyed by a geocell (geohash of WEATHER_CACHE_PRECISION)
+and a time bucket (of WEATHER_CACHE_BUCKET seconds).
+"""
+
+import datetime
+import itertools
+import logging
+from typing import Optional, Tuple
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import geohash, metrics
+from .external_sources import AbstractWeatherProvider, WeatherDict
+from .models import WeatherCacheEntry
+from .singleflight import file_lock
+
+logger = logging.getLogger(__name__)
+
+metrics.register_gauge(
+    "weather.cache.hit_ratio",
+    lambda: metrics.ratio("weather.cache.hits", "weather.cache.misses"),
+)
+
+
+def cache_key(
+    lat: float, lon: float, when: datetime.datetime = None
+) -> Tuple[str, int]:
+    "(geocell, time bucket) of a weather lookup. `when` defaults to now"
+    if when is None:
+        when = timezone.now()
+    if timezone.is_naive(when):
+        when = timezone.make_aware(when, datetime.timezone.utc)
+    return (
+        geohash.encode(lat, lon, settings.WEATHER_CACHE_PRECISION),
+        int(when.timestamp()) // settings.WEATHER_CACHE_BUCKET,
+    )
+
+
+class CachedWeatherProvider(AbstractWeatherProvider):
+    "Serves lookups from the WeatherCacheEntry table, falling back to `provider`"
+
+    # inserts between evictions, process-wide
+    _inserts = itertools.count(1)
+
+    def __init__(self, provider: AbstractWeatherProvider):
+        self.provider = provider
+
+    def getWeather(
+        self, lat: float, lon: float, when: datetime.datetime = None, quiet_fail=True
+    ) -> Optional[WeatherDict]:
+        geocell, bucket = cache_key(lat, lon, when)
+
+        weather = self.lookup(geocell, bucket)
+        if weather is not None:
+            metrics.incr("weather.cache.hits")
+            return weather
+
+        metrics.incr("weather.cache.misses")
+        with file_lock(
+            settings.WEATHER_SINGLEFLIGHT_LOCK_DIR,
+            (geocell, bucket),
+            timeout=settings.WEATHER_SINGLEFLIGHT_LOCK_WAIT,
+        ) as locked:
+            if locked:
+                # another worker may have looked it up while we waited for the lock
+                weather = self.lookup(geocell, bucket)
+                if weather is not None:
+                    metrics.incr("weather.singleflight.coalesced")
+                    return weather
+
+            weather = self.provider.getWeather(
+                lat, lon, when=when, quiet_fail=quiet_fail
+            )
+            if weather is not None:
+                self.store(geocell, bucket, weather)
+        return weather
+
+    def lookup(self, geocell: str, bucket: int) -> Optional[WeatherDict]:
+        entry = WeatherCacheEntry.objects.filter(
+            geocell=geocell, bucket=bucket, expires_at__gt=timezone.now()
+        ).first()
+        if entry is None:
+            return None
+        if entry.prefetched:
+            metrics.incr("weather.prefetch.hits")
+            WeatherCacheEntry.objects.filter(id=entry.id).update(hits=F("hits") + 1)
+        return WeatherDict(
+            {
+                "id": entry.weather_id,
+                "title": entry.title,
+                "description": entry.description,
+            }
+        )
+
+    def prefetch(self, lat: float, lon: float, when: datetime.datetime) -> bool:
+        "look the weather up ahead of time, unless cached. Whether it was stored"
+        geocell, bucket = cache_key(lat, lon, when)
+        if WeatherCacheEntry.objects.filter(
+            geocell=geocell, bucket=bucket, expires_at__gt=timezone.now()
+        ).exists():
+            return False
+
+        weather = self.provider.getWeather(lat, lon, when=when)
+        if weather is None:
+            return False
+        self.store(geocell, bucket, weather, prefetched=True)
+        return True
+
+    def store(
+        self, geocell: str, bucket: int, weather: WeatherDict, prefetched=False
+    ):
+        now = timezone.now()
+        try:
+            with transaction.atomic():
+                WeatherCacheEntry.objects.filter(
+                    geocell=geocell, bucket=bucket, expires_at__lte=now
+                ).delete()
+                WeatherCacheEntry.objects.create(
+                    geocell=geocell,
+                    bucket=bucket,
+                    weather_id=weather["id"],
+                    title=weather["title"],
+                    description=weather["description"],
+                    prefetched=prefetched,
+                    expires_at=now
+                    + datetime.timedelta(seconds=settings.WEATHER_CACHE_TTL),
+                )
+        except IntegrityError:
+            # stored concurrently by another request
+            return
+
+        if next(self._inserts) % settings.WEATHER_CACHE_EVICT_EVERY == 0:
+            evict()
+
+
+def evict() -> int:
+    "delete the expired entries, then the oldest ones above WEATHER_CACHE_MAX_ENTRIES"
+    deleted, _ = WeatherCacheEntry.objects.filter(
+        expires_at__lte=timezone.now()
+    ).delete()
+
+    excess = WeatherCacheEntry.objects.count() - settings.WEATHER_CACHE_MAX_ENTRIES
+    if excess > 0:
+        oldest = WeatherCacheEntry.objects.order_by("expires_at").values_list(
+            "id", flat=True
+        )[:excess]
+        excess_deleted, _ = WeatherCacheEntry.objects.filter(
+            id__in=list(oldest)
+        ).delete()
+        deleted += excess_deleted
+
+    metrics.incr("weather.cache.evictions", deleted)
+    return deleted
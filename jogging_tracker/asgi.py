@@ -13,4 +13,15 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'jogging_tracker.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# imported once Django is set up
+from api import live  # noqa: E402
+
+
+async def application(scope, receive, send):
+    "the live activity feed (Server-Sent Events), or Django"
+    if scope["type"] == "http" and scope["path"] == live.PATH:
+        await live.application(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
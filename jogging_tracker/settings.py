@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/3.0/ref/settings/
 """
 
 import os
+import tempfile
 
 import dj_database_url
 
@@ -48,7 +49,7 @@ INSTALLED_APPS = [
     "rest_framework",
     "rest_framework.authtoken",
     # Local Apps
-    "api",
+    "api.apps.ApiConfig",
     "advanced_filters",
 ]
 
@@ -61,6 +62,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "api.middleware.WeatherBudgetMiddleware",
 ]
 
 ROOT_URLCONF = "jogging_tracker.urls"
@@ -93,6 +95,19 @@ DATABASE_URL = os.environ.get(
 DATABASES = {"default": dj_database_url.config(default=DATABASE_URL, conn_max_age=200)}
 
 
+# Cache
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+
+CACHES = {
+    "default": {
+        "BACKEND": os.environ.get(
+            "DJANGO_CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"
+        ),
+        "LOCATION": os.environ.get("DJANGO_CACHE_LOCATION", ""),
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
 
@@ -143,3 +158,155 @@ REST_FRAMEWORK = {
 API_DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
 
 OWM_SECRET = os.environ.get("OWM_SECRET")
+# Send the OWM API calls to another server (eg: a local stand-in, for load tests)
+OWM_BASE_URL = os.environ.get("OWM_BASE_URL")
+
+# Weather providers, in order of preference (comma separated). Built once per
+# process (see external_sources.get_weather_provider)
+WEATHER_PROVIDERS = os.environ.get(
+    "WEATHER_PROVIDERS", "api.external_sources.OpenWeatherMapProvider"
+).split(",")
+# With several providers, a hedged request goes to the next one when a provider
+# takes longer than the WEATHER_HEDGE_QUANTILE of its latencies (within the
+# min/max delays; the max until there are WEATHER_HEDGE_MIN_SAMPLES latencies)
+WEATHER_HEDGE_QUANTILE = float(os.environ.get("WEATHER_HEDGE_QUANTILE", "0.95"))
+WEATHER_HEDGE_MIN_DELAY = 0.05  # seconds
+WEATHER_HEDGE_MAX_DELAY = 1.0  # seconds
+WEATHER_HEDGE_MIN_SAMPLES = 20
+WEATHER_HEDGE_WORKERS = 8  # threads making the calls, per process
+WEATHER_HTTP_POOL_SIZE = int(os.environ.get("WEATHER_HTTP_POOL_SIZE", "10"))
+WEATHER_HTTP_TIMEOUT = float(os.environ.get("WEATHER_HTTP_TIMEOUT", "2"))  # seconds
+# Total time a request may spend on weather lookups (see api.middleware)
+WEATHER_REQUEST_BUDGET = float(os.environ.get("WEATHER_REQUEST_BUDGET", "3"))
+# Circuit breaker: opens after WEATHER_BREAKER_FAILURES consecutive failures or
+# slow calls (over WEATHER_BREAKER_SLOW_CALL seconds), probes again after
+# WEATHER_BREAKER_RESET seconds
+WEATHER_BREAKER_FAILURES = int(os.environ.get("WEATHER_BREAKER_FAILURES", "5"))
+WEATHER_BREAKER_SLOW_CALL = float(os.environ.get("WEATHER_BREAKER_SLOW_CALL", "1.5"))
+WEATHER_BREAKER_RESET = float(os.environ.get("WEATHER_BREAKER_RESET", "30"))
+# Calls per minute allowed by the OWM plan, shared by the processes of the
+# host through a SQLite file (0, the default: unlimited). Lookups wait for the
+# quota within their deadline, or WEATHER_QUOTA_MAX_WAIT seconds. Needs the
+# process_weather_jobs worker: the activities whose lookup ran out of quota are
+# left PENDING to it, even without WEATHER_ENRICHMENT_ASYNC
+WEATHER_QUOTA_PER_MINUTE = int(os.environ.get("WEATHER_QUOTA_PER_MINUTE", "0"))
+WEATHER_QUOTA_PATH = os.environ.get(
+    "WEATHER_QUOTA_PATH",
+    os.path.join(tempfile.gettempdir(), "jogging-tracker-weather-quota.sqlite3"),
+)
+WEATHER_QUOTA_MAX_WAIT = float(os.environ.get("WEATHER_QUOTA_MAX_WAIT", "1"))
+# Identical concurrent lookups share one upstream call within a process. With a
+# lock directory (and the weather cache), also across the processes of the host
+WEATHER_SINGLEFLIGHT_LOCK_DIR = os.environ.get("WEATHER_SINGLEFLIGHT_LOCK_DIR")
+# Seconds a lookup waits for the lock (within its deadline) before calling
+# upstream anyway
+WEATHER_SINGLEFLIGHT_LOCK_WAIT = float(
+    os.environ.get("WEATHER_SINGLEFLIGHT_LOCK_WAIT", "2")
+)
+
+# Relative accuracy of the weekly distance sketches used for percentile ranks
+# (eg: 0.01 -> only users within 1% of your weekly distance may be misranked)
+PERCENTILE_SKETCH_ACCURACY = float(
+    os.environ.get("PERCENTILE_SKETCH_ACCURACY", "0.01")
+)
+
+# Training load: an activity's load is its duration in minutes, weighted by
+# (speed / TRAINING_LOAD_REFERENCE_SPEED)^2. Acute and chronic loads are the
+# exponentially weighted averages of the daily loads, with these time constants
+TRAINING_LOAD_REFERENCE_SPEED = 2.8  # m/s (~6 min/km)
+TRAINING_LOAD_ACUTE_DAYS = 7
+TRAINING_LOAD_CHRONIC_DAYS = 42
+
+# Grouped aggregations over activities: max number of groups, and cache TTL
+# (seconds). Cached results are invalidated on writes, which requires a cache
+# shared by every worker (eg: DJANGO_CACHE_BACKEND=...FileBasedCache)
+AGGREGATE_MAX_GROUPS = int(os.environ.get("AGGREGATE_MAX_GROUPS", "1000"))
+AGGREGATE_CACHE_TTL = int(os.environ.get("AGGREGATE_CACHE_TTL", "300"))
+WEATHER_REPORT_CACHE_TTL = int(os.environ.get("WEATHER_REPORT_CACHE_TTL", "3600"))
+
+# Bulk activity create/update (POST/PATCH /activities/bulk): max items per
+# request, and threads looking up their weather
+ACTIVITY_BULK_MAX_ITEMS = int(os.environ.get("ACTIVITY_BULK_MAX_ITEMS", "500"))
+ACTIVITY_BULK_WORKERS = 8
+# Activity imports (POST /activities/import, manage.py import_activities):
+# activities inserted per transaction
+ACTIVITY_IMPORT_BATCH_SIZE = 500
+# Set-based update/delete of the activities matching a filter (admins only):
+# refused when more activities match
+ACTIVITY_FILTER_MAX_ROWS = int(os.environ.get("ACTIVITY_FILTER_MAX_ROWS", "10000"))
+# Sync feed (GET /activities/sync): activities changed after a cursor, and
+# tombstones of the deleted ones, kept SYNC_TOMBSTONE_RETENTION days (older
+# cursors must sync from scratch)
+SYNC_PAGE_SIZE = int(os.environ.get("SYNC_PAGE_SIZE", "500"))
+SYNC_TOMBSTONE_RETENTION = int(os.environ.get("SYNC_TOMBSTONE_RETENTION", "30"))
+SYNC_TOMBSTONE_PRUNE_EVERY = 100  # deletions
+# Idempotency-Key header (POST /activities, /activities/bulk): seconds the
+# responses are replayed to retries, and seconds after which a request still
+# running is taken as lost (its retries are executed)
+IDEMPOTENCY_KEY_TTL = int(os.environ.get("IDEMPOTENCY_KEY_TTL", "86400"))
+IDEMPOTENCY_LOCK_TIMEOUT = 60
+IDEMPOTENCY_PRUNE_EVERY = 100  # keys
+# Live activity feed (GET /activities/live, Server-Sent Events, ASGI only):
+# seconds between polls of the changes and between keepalives, events queued
+# per subscriber, and subscribers per process
+LIVE_POLL_INTERVAL = float(os.environ.get("LIVE_POLL_INTERVAL", "2"))
+LIVE_KEEPALIVE = 15
+LIVE_QUEUE_SIZE = 1000
+LIVE_MAX_SUBSCRIBERS = int(os.environ.get("LIVE_MAX_SUBSCRIBERS", "1000"))
+# Batch requests (POST /batch): max sub-requests per batch, and threads running
+# consecutive reads
+BATCH_MAX_REQUESTS = int(os.environ.get("BATCH_MAX_REQUESTS", "20"))
+BATCH_WORKERS = 4
+
+# Weather enrichment. When async, activities are saved with weather pending and
+# the weather is fetched by `manage.py process_weather_jobs` workers
+WEATHER_ENRICHMENT_ASYNC = bool(
+    os.environ.get("WEATHER_ENRICHMENT_ASYNC", "False").lower()
+    in ["true", "t", "yes", "y", "1"]
+)
+WEATHER_JOB_BATCH_SIZE = 50
+WEATHER_JOB_MAX_ATTEMPTS = 5
+WEATHER_JOB_BACKOFF = 30  # seconds, doubled on each attempt
+WEATHER_JOB_LEASE = 300  # seconds a claimed job is hidden from other workers
+# jobs postponed while the weather is unavailable (eg: circuit open, out of
+# quota) do not count attempts, but fail after this many deferrals (2 hours
+# with the default backoff)
+WEATHER_JOB_MAX_DEFERRALS = 240
+# backfill_weather command defaults
+WEATHER_BACKFILL_WORKERS = 4
+WEATHER_BACKFILL_RATE = 1.0  # requests per second
+
+# User deletion: activities are deleted USER_DELETION_CHUNK_SIZE at a time. When
+# async, the API answers 202 and the process_user_deletions worker deletes the
+# user, retrying failures after USER_DELETION_BACKOFF seconds (doubled on each
+# attempt). A claimed deletion is hidden from other workers USER_DELETION_LEASE
+# seconds
+USER_DELETION_ASYNC = bool(
+    os.environ.get("USER_DELETION_ASYNC", "False").lower()
+    in ["true", "t", "yes", "y", "1"]
+)
+USER_DELETION_CHUNK_SIZE = 5000
+USER_DELETION_BACKOFF = 60
+USER_DELETION_LEASE = 3600
+
+# Persistent weather cache, keyed by geocell (geohash of WEATHER_CACHE_PRECISION
+# chars: 6 -> ~1.2km x 0.6km) and time bucket (WEATHER_CACHE_BUCKET seconds)
+WEATHER_CACHE_ENABLED = bool(
+    os.environ.get("WEATHER_CACHE_ENABLED", "True").lower()
+    in ["true", "t", "yes", "y", "1"]
+)
+WEATHER_CACHE_PRECISION = int(os.environ.get("WEATHER_CACHE_PRECISION", "6"))
+WEATHER_CACHE_BUCKET = int(os.environ.get("WEATHER_CACHE_BUCKET", "3600"))
+WEATHER_CACHE_TTL = int(os.environ.get("WEATHER_CACHE_TTL", "21600"))
+WEATHER_CACHE_MAX_ENTRIES = int(os.environ.get("WEATHER_CACHE_MAX_ENTRIES", "100000"))
+WEATHER_CACHE_EVICT_EVERY = 100  # inserts
+
+# Prefetch (prefetch_weather command): warms the cache for the spots and times
+# of day where a user ran WEATHER_PREFETCH_MIN_RUNS times in the lookback days,
+# when due within WEATHER_PREFETCH_HORIZON seconds
+WEATHER_PREFETCH_LOOKBACK_DAYS = 28
+WEATHER_PREFETCH_MIN_RUNS = 3
+WEATHER_PREFETCH_HORIZON = int(os.environ.get("WEATHER_PREFETCH_HORIZON", "3600"))
+WEATHER_PREFETCH_MAX_LOOKUPS = int(
+    os.environ.get("WEATHER_PREFETCH_MAX_LOOKUPS", "100")
+)
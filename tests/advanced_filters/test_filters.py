@@ -1,13 +1,20 @@
+import datetime
 import os
 from unittest import expectedFailure
 
+from django.core.exceptions import FieldError, ValidationError
 from django.db.models import Q
 from django.test import TestCase
 from rest_framework import generics, serializers, status
 from rest_framework.test import APIRequestFactory
 
-from advanced_filters.filters import AdvancedFilter, ParseError
-from api.models import User
+from advanced_filters.filters import (
+    AdvancedFilter,
+    ParseError,
+    compile_q,
+    related_paths,
+)
+from api.models import Activity, User
 
 
 class SimpleSerializer(serializers.ModelSerializer):
@@ -94,6 +101,8 @@ class TestFilters(TestCase):
         self.filter._init_query_builder('"both detected" fields')
         self.filter._find_field()
         self.assertEqual(self.filter.q_field_stack.pop(), "both detected")
+        # the ending delimiter is consumed
+        self.assertEqual(self.filter.q_pos, 15)
 
         self.filter._init_query_builder("'raised exception")
         with self.assertRaises(ParseError) as e:
@@ -198,6 +207,15 @@ class TestFiltersBlackBox(TestCase):
         self.assertEqual(response.data["count"], 1)
         self.assertEqual(response.data["results"][0]["id"], 5)
 
+    def test_simple_quoted_value(self):
+        request = self.factory.get("/endpoint", {"q": "(username eq 'user_type1_5')"})
+        view = SimpleTestView.as_view()
+        response = view(request)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["count"], 1)
+        self.assertEqual(response.data["results"][0]["id"], 5)
+
     def test_simple_simple_gt(self):
         request = self.factory.get("/endpoint", {"q": "id gt 5"})
         view = SimpleTestView.as_view()
@@ -273,3 +291,78 @@ class TestFiltersBlackBox(TestCase):
 
         actual = [response.data["results"][0]["id"], response.data["results"][1]["id"]]
         self.assertListEqual(sorted(actual), [4, 6])
+
+
+class TestPredicates(TestCase):
+    def setUp(self):
+        self.filter = AdvancedFilter()
+        admin = User.objects.create_superuser(
+            username="admin", email=None, password="123456"
+        )
+        for index in range(1, 9):
+            User.objects.create_user(
+                username="user%d" % index,
+                password="123456",
+                email="user%d@example.com" % index if index % 3 else "",
+                is_staff=index % 2 == 0,
+                last_login=None if index % 4 else admin.date_joined,
+            )
+
+    def test_same_objects_as_the_query(self):
+        users = list(User.objects.all())
+        for query in [
+            "",
+            "username eq 'user3'",
+            "id gt 2 AND id lte 6",
+            "(id lt 3 OR id gte 7) AND is_staff eq True",
+            "username ne 'user1' AND [email eq '' OR is_superuser eq True]",
+            "last_login lt '2999-01-01T00:00:00Z'",
+            "last_login ne '2999-01-01T00:00:00Z'",
+            "date_joined gt '2000-01-01'",
+        ]:
+            expected = set(User.objects.filter(self.filter.build_query(query)))
+            predicate = compile_q(self.filter.build_query(query), User)
+            self.assertSetEqual(
+                {user for user in users if predicate(user)}, expected, query
+            )
+
+    def test_related_fields(self):
+        user1, user2 = User.objects.get(username="user1"), User.objects.get(
+            username="user2"
+        )
+        activities = [
+            Activity.objects.create(
+                user=user,
+                date=datetime.date(2020, 5, 1),
+                time=datetime.time(10, 0),
+                distance=distance,
+                duration=datetime.timedelta(minutes=30),
+            )
+            for user, distance in [(user1, 5000), (user1, 10000), (user2, 8000)]
+        ]
+
+        for query, expected in [
+            ("user__username eq 'user1' AND distance gt 6000", [activities[1]]),
+            ("user eq %d" % user2.id, [activities[2]]),
+            ("user__is_staff eq True", [activities[2]]),
+            ("user__auth_token__key eq 'abc'", []),
+        ]:
+            predicate = compile_q(self.filter.build_query(query), Activity)
+            self.assertEqual([a for a in activities if predicate(a)], expected, query)
+
+        q = self.filter.build_query(
+            "user__auth_token__key eq 'abc' OR [weather__title eq 'Rain' AND id gt 1]"
+        )
+        self.assertSetEqual(
+            related_paths(q, Activity), {"user", "user__auth_token", "weather"}
+        )
+
+    def test_invalid_fields_or_values(self):
+        for query, error in [
+            ("groups__name eq 'runners'", FieldError),
+            ("height gt 2", FieldError),
+            ("username__startswith eq 'user'", FieldError),
+            ("id gt 'two'", ValidationError),
+        ]:
+            with self.assertRaises(error):
+                compile_q(self.filter.build_query(query), User)
@@ -143,6 +143,7 @@ class TestActivities(TestCase):
             "latitude": 15.0,
             "longitude": 16.0,
             "weather": "SomeClouds",
+            "weather_status": "DONE",
         }
         self.assertDictEqual(
             response.data, expected,
@@ -213,3 +214,56 @@ class TestActivities(TestCase):
         self.assertEqual(response.data["latitude"], 15.0)
         self.assertEqual(response.data["longitude"], 16.0)
         self.assertEqual(response.data["weather"], "SomeClouds")
+
+    @mock.patch("api.external_sources.WeatherProvider.getWeather")
+    def test_update_refetches_weather_only_on_location_or_time_change(
+        self, mock_get_weather
+    ):
+        mock_get_weather.return_value = {
+            "id": 2,
+            "title": "Rain",
+            "description": "light rain",
+        }
+        self.assertTrue(self.client.login(username="user1", password="123456"))
+        id = Activity.objects.filter(user__username="user1").first().id
+
+        response = self.client.patch(
+            f"/api/v1/activities/{id}",
+            {"distance": 20, "latitude": 20.0},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["weather"], "Clouds")
+        mock_get_weather.assert_not_called()
+
+        response = self.client.patch(
+            f"/api/v1/activities/{id}",
+            {"time": "06:30"},
+            content_type="application/json",
+        )
+        self.assertEqual(response.data["weather"], "Rain")
+        self.assertEqual(mock_get_weather.call_count, 1)
+
+    @mock.patch("api.external_sources.WeatherProvider.getWeather")
+    def test_missing_weather_is_refetched(self, mock_get_weather):
+        mock_get_weather.return_value = {
+            "id": 2,
+            "title": "Rain",
+            "description": "light rain",
+        }
+        activity = Activity.objects.get(user__username="user3")
+        activity.distance = 20
+        activity.save()
+        self.assertEqual(activity.weather.title, "Rain")
+
+    @mock.patch("api.external_sources.WeatherProvider.getWeather")
+    def test_activity_without_location(self, mock_get_weather):
+        activity = Activity.objects.create(
+            date=self.date,
+            time=self.time,
+            distance=10,
+            duration=datetime.timedelta(minutes=25),
+            user=User.objects.get(username="user1"),
+        )
+        self.assertIsNone(activity.weather)
+        mock_get_weather.assert_not_called()
@@ -0,0 +1,116 @@
+import datetime
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework import status
+
+from api.models import Activity, User
+
+
+class TestAggregate(TestCase):
+    @mock.patch("api.external_sources.WeatherProvider.getWeather")
+    def setUp(self, mock_get_weather):
+        cache.clear()
+        users = [
+            User.objects.create_user(username="user1", password="123456"),
+            User.objects.create_superuser(
+                username="useradmin", email=None, password="123456"
+            ),
+        ]
+
+        for user in users:
+            for day, weather in [(6, "Clouds"), (7, "Clouds"), (8, "Rain")]:
+                mock_get_weather.return_value = {
+                    "id": 1 if weather == "Clouds" else 2,
+                    "title": weather,
+                    "description": weather,
+                }
+                Activity.objects.create(
+                    date=datetime.date(2020, 1, day),
+                    time=datetime.time(8, 0),
+                    distance=1000 * day,
+                    duration=datetime.timedelta(minutes=day),
+                    user=user,
+                    latitude=0,
+                    longitude=0,
+                )
+
+    def test_aggregate_own_activities_by_weather(self):
+        self.client.login(username="user1", password="123456")
+        response = self.client.get(
+            "/api/v1/activities/aggregate",
+            {"group_by": "weather", "metrics": "count,sum:distance,avg:duration"},
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.data["results"],
+            [
+                {
+                    "weather": "Clouds",
+                    "count": 2,
+                    "sum_distance": 13000,
+                    "avg_duration": "00:06:30",
+                },
+                {
+                    "weather": "Rain",
+                    "count": 1,
+                    "sum_distance": 8000,
+                    "avg_duration": "00:08:00",
+                },
+            ],
+        )
+
+    def test_aggregate_with_filter_and_multiple_dimensions(self):
+        self.client.login(username="useradmin", password="123456")
+        response = self.client.get(
+            "/api/v1/activities/aggregate",
+            {
+                "group_by": "user,weekday",
+                "metrics": "max:distance",
+                "q": "distance gt 6000",
+            },
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["count"], 4)
+        self.assertEqual(
+            response.data["results"][0],
+            {"user": "user1", "weekday": 3, "max_distance": 7000},
+        )
+
+    def test_aggregate_invalid_parameters(self):
+        self.client.login(username="user1", password="123456")
+        for params in [
+            {},
+            {"group_by": "password"},
+            {"group_by": "date", "metrics": "sum:user"},
+            {"group_by": "date", "metrics": "median:distance"},
+        ]:
+            response = self.client.get("/api/v1/activities/aggregate", params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(AGGREGATE_MAX_GROUPS=2)
+    def test_aggregate_too_many_groups(self):
+        self.client.login(username="user1", password="123456")
+        response = self.client.get("/api/v1/activities/aggregate", {"group_by": "date"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @mock.patch("api.external_sources.WeatherProvider.getWeather")
+    def test_aggregate_cache_invalidated_on_writes(self, mock_get_weather):
+        mock_get_weather.return_value = None
+        self.client.login(username="user1", password="123456")
+        params = {"group_by": "year", "metrics": "count"}
+
+        response = self.client.get("/api/v1/activities/aggregate", params)
+        self.assertEqual(response.data["results"][0]["count"], 3)
+
+        with mock.patch("api.views.build_aggregation") as mock_build:
+            response = self.client.get("/api/v1/activities/aggregate", params)
+            mock_build.assert_not_called()
+        self.assertEqual(response.data["results"][0]["count"], 3)
+
+        Activity.objects.filter(user__username="user1").first().delete()
+        response = self.client.get("/api/v1/activities/aggregate", params)
+        self.assertEqual(response.data["results"][0]["count"], 2)
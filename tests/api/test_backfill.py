@@ -0,0 +1,84 @@
+import datetime
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from api.backfill import RateLimiter, backfill_weather
+from api.models import Activity, User, WeatherStatus
+
+from .test_enrichment import StubWeatherProvider
+
+
+@override_settings(WEATHER_CACHE_ENABLED=False)
+class TestBackfillWeather(TestCase):
+    @mock.patch("api.external_sources.WeatherProvider.getWeather")
+    def setUp(self, mock_get_weather):
+        mock_get_weather.return_value = None
+        user = User.objects.create_user(username="user1", password="123456")
+
+        for minute, latitude in [(0, 38.7223), (20, 38.7224), (0, 41.1579)]:
+            Activity.objects.create(
+                date=datetime.date(2020, 5, 1),
+                time=datetime.time(10, minute),
+                distance=1000,
+                duration=datetime.timedelta(minutes=5),
+                user=user,
+                latitude=latitude,
+                longitude=-9.1393,
+            )
+        # without coordinates
+        Activity.objects.create(
+            date=datetime.date(2020, 5, 1),
+            time=datetime.time(10, 0),
+            distance=1000,
+            duration=datetime.timedelta(minutes=5),
+            user=user,
+        )
+
+    def test_backfill_deduplicates_lookups(self):
+        provider = StubWeatherProvider()
+        chunks = list(backfill_weather(chunk_size=2, rate=0, provider=provider))
+
+        self.assertEqual([chunk.activities for chunk in chunks], [2, 1])
+        self.assertEqual([chunk.lookups for chunk in chunks], [1, 1])
+        self.assertEqual(provider.calls, 2)
+        self.assertEqual(
+            Activity.objects.filter(
+                weather__title="Rain", weather_status=WeatherStatus.DONE.value
+            ).count(),
+            3,
+        )
+        # activities without coordinates are left alone
+        self.assertEqual(Activity.objects.filter(weather__isnull=True).count(), 1)
+
+    def test_backfill_resumes_after_id(self):
+        second_id = Activity.objects.order_by("id").values_list("id", flat=True)[1]
+        list(
+            backfill_weather(after_id=second_id, rate=0, provider=StubWeatherProvider())
+        )
+        self.assertEqual(Activity.objects.filter(weather__isnull=False).count(), 1)
+
+    @mock.patch("api.external_sources.WeatherProvider.getWeather")
+    def test_backfill_command(self, mock_get_weather):
+        mock_get_weather.return_value = {"id": 800, "title": "Clear", "description": ""}
+        out = StringIO()
+        call_command("backfill_weather", "--rate", "0", stdout=out)
+
+        self.assertIn("3 activities without weather", out.getvalue())
+        self.assertIn("Filled the weather of 3 activities", out.getvalue())
+        self.assertEqual(mock_get_weather.call_count, 2)
+
+
+class TestRateLimiter(TestCase):
+    @mock.patch("api.backfill.time")
+    def test_calls_are_spaced(self, mock_time):
+        mock_time.monotonic.return_value = 100.0
+        limiter = RateLimiter(rate=2)
+
+        for _ in range(3):
+            limiter.acquire()
+        self.assertEqual(
+            [call[0][0] for call in mock_time.sleep.call_args_list], [0.5, 1.0]
+        )
@@ -0,0 +1,120 @@
+import datetime
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+
+from api import batch
+from api.models import Activity, User
+
+
+@override_settings(WEATHER_CACHE_ENABLED=False)
+class TestBatch(TestCase):
+    @mock.patch("api.external_sources.WeatherProvider.getWeather")
+    def setUp(self, mock_get_weather):
+        mock_get_weather.return_value = None
+        self.user1 = User.objects.create_user(username="user1", password="123456")
+        user2 = User.objects.create_user(username="user2", password="123456")
+        self.others = Activity.objects.create(
+            user=user2,
+            date=datetime.date(2020, 5, 1),
+            time=datetime.time(10, 0),
+            distance=5000,
+            duration=datetime.timedelta(minutes=30),
+        )
+
+    def post(self, requests, **kwargs):
+        return self.client.post(
+            "/api/v1/batch", requests, content_type="application/json", **kwargs
+        )
+
+    @mock.patch("api.external_sources.WeatherProvider.getWeather")
+    def test_batch(self, mock_get_weather):
+        mock_get_weather.return_value = None
+        self.client.login(username="user1", password="123456")
+
+        response = self.post(
+            [
+                {"method": "GET", "path": "/api/v1/users/user1"},
+                {
+                    "method": "POST",
+                    "path": "activities",
+                    "body": {
+                        "date": "2020-05-02",
+                        "time": "10:00",
+                        "distance": 8000,
+                        "duration": "40:00",
+                    },
+                },
+                {"path": "/api/v1/activities?ordering=distance"},
+                {"method": "GET", "path": "/api/v1/activities/%d" % self.others.id},
+                {"method": "GET", "path": "/api/v1/nothing"},
+                {"method": "GET", "path": "/admin/"},
+                {"method": "POST", "path": "/api/v1/batch", "body": []},
+                {"method": "FETCH", "path": "/api/v1/activities"},
+                "/api/v1/activities",
+            ]
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data["results"]
+        self.assertEqual(
+            [r["status"] for r in results],
+            [200, 201, 200, 404, 404, 404, 400, 405, 400],
+        )
+        self.assertEqual(results[0]["body"]["username"], "user1")
+        self.assertEqual(results[1]["body"]["user"], "user1")
+        # the read after the write sees it, and only the caller's activities
+        self.assertEqual(
+            [activity["distance"] for activity in results[2]["body"]["results"]],
+            [8000],
+        )
+        self.assertEqual(Activity.objects.filter(user=self.user1).count(), 1)
+
+    def test_reads_between_writes_run_together(self):
+        self.client.login(username="user1", password="123456")
+        read = {"method": "GET", "path": "/api/v1/users/user1"}
+        write = {"method": "PATCH", "path": "/api/v1/users/user1", "body": {}}
+
+        with mock.patch(
+            "api.batch.parallel_map", wraps=batch.parallel_map
+        ) as parallel_map:
+            response = self.post([read, read, write, read])
+
+        self.assertEqual(
+            [r["status"] for r in response.data["results"]], [200, 200, 200, 200]
+        )
+        self.assertEqual(
+            [len(call.args[1]) for call in parallel_map.call_args_list],
+            [2, 1],
+        )
+
+    def test_token_authentication(self):
+        token = Token.objects.create(user=self.user1)
+
+        response = self.post(
+            [
+                {"method": "GET", "path": "/api/v1/users/user1"},
+                {"method": "GET", "path": "/api/v1/activities/%d" % self.others.id},
+            ],
+            HTTP_AUTHORIZATION="Token %s" % token.key,
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # run as user1
+        self.assertEqual([r["status"] for r in response.data["results"]], [200, 404])
+
+    def test_anonymous(self):
+        response = self.post([{"method": "GET", "path": "/api/v1/users/user1"}])
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @override_settings(BATCH_MAX_REQUESTS=2)
+    def test_invalid_batch(self):
+        self.client.login(username="user1", password="123456")
+        read = {"method": "GET", "path": "/api/v1/users/user1"}
+
+        for requests in [read, [read, read, read]]:
+            response = self.post(requests)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,295 @@
+import datetime
+from unittest import mock
+from urllib.parse import urlencode
+
+from django.test import TestCase, override_settings
+from rest_framework import status
+
+from api.deadlines import QuotaExceeded
+from api.models import Activity, User, WeatherJob, WeatherStatus
+
+MATCHING_URL = "/api/v1/activities/matching"
+CLOUDS = {"id": 803, "title": "Clouds", "description": "broken clouds"}
+
+
+def run(**kwargs):
+    item = {
+        "date": "2020-05-01",
+        "time": "10:00",
+        "distance": 5000,
+        "duration": "30:00",
+        "latitude": 38.7223,
+        "longitude": -9.1393,
+    }
+    item.update(kwargs)
+    # None: without the field
+    return {key: value for key, value in item.items() if value is not None}
+
+
+@override_settings(WEATHER_CACHE_ENABLED=False)
+class TestBulkActivities(TestCase):
+    def setUp(self):
+        User.objects.create_user(username="user1", password="123456")
+        User.objects.create_user(username="user2", password="123456")
+        User.objects.create_superuser(
+            username="useradmin", email=None, password="123456"
+        )
+
+    def post(self, items):
+        return self.client.post(
+            "/api/v1/activities/bulk", items, content_type="application/json"
+        )
+
+    def patch(self, items):
+        return self.client.patch(
+            "/api/v1/activities/bulk", items, content_type="application/json"
+        )
+
+    @mock.patch("api.external_sources.WeatherProvider.getWeather")
+    def test_create_deduplicates_lookups(self, mock_get_weather):
+        mock_get_weather.return_value = CLOUDS
+        self.client.login(username="user1", password="123456")
+
+        response = self.post(
+            [run(), run(time="10:20"), run(latitude=41.1579), run(latitude=None)]
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        results = response.data["results"]
+        self.assertEqual([r["status"] for r in results], [201] * 4)
+        self.assertEqual(
+            [r["activity"]["weather"] for r in results],
+            ["Clouds", "Clouds", "Clouds", None],
+        )
+        self.assertTrue(all(r["activity"]["user"] == "user1" for r in results))
+        # same place and hour: one lookup. No coordinates: no lookup
+        self.assertEqual(mock_get_weather.call_count, 2)
+        self.assertEqual(Activity.objects.filter(user__username="user1").count(), 4)
+
+    @mock.patch("api.external_sources.WeatherProvider.getWeather")
+    def test_create_reports_errors_per_item(self, mock_get_weather):
+        mock_get_weather.return_value = CLOUDS
+        self.client.login(username="user1", password="123456")
+
+        response = self.post(
+            [run(), run(distance="far"), run(user="user2"), run(user="nobody"), "run"]
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        results = response.data["results"]
+        self.assertEqual([r["status"] for r in results], [201, 400, 403, 400, 400])
+        self.assertIn("distance", results[1]["errors"])
+        self.assertIn("user", results[3]["errors"])
+        self.assertEqual(Activity.objects.count(), 1)
+
+    @mock.patch("api.external_sources.WeatherProvider.getWeather")
+    def test_admin_creates_for_others(self, mock_get_weather):
+        mock_get_weather.return_value = CLOUDS
+        self.client.login(username="useradmin", password="123456")
+
+        response = self.post([run(user="user1"), run(user="user2")])
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            sorted(Activity.objects.values_list("user__username", flat=True)),
+            ["user1", "user2"],
+        )
+
+    def test_not_a_list(self):
+        self.client.login(username="user1", password="123456")
+
+        response = self.post(run())
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(ACTIVITY_BULK_MAX_ITEMS=2)
+    def test_too_many_items(self):
+        self.client.login(username="user1", password="123456")
+
+        response = self.post([run(), run(), run()])
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Activity.objects.count(), 0)
+
+    @mock.patch("api.external_sources.WeatherProvider.getWeather")
+    def test_update(self, mock_get_weather):
+        mock_get_weather.return_value = CLOUDS
+        user1 = User.objects.get(username="user1")
+        user2 = User.objects.get(username="user2")
+        common = {
+            "date": datetime.date(2020, 5, 1),
+            "time": datetime.time(10, 0),
+            "distance": 5000,
+            "duration": datetime.timedelta(minutes=30),
+            "latitude": 38.7223,
+            "longitude": -9.1393,
+        }
+        own = Activity.objects.create(user=user1, **common)
+        moved = Activity.objects.create(user=user1, **common)
+        others = Activity.objects.create(user=user2, **common)
+        mock_get_weather.reset_mock()
+        self.client.login(username="user1", password="123456")
+
+        response = self.patch(
+            [
+                {"id": own.id, "distance": 6000},
+                {"id": moved.id, "latitude": 41.1579},
+                {"id": others.id, "distance": 1},
+                {"id": own.id, "distance": 7000},
+            ]
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        results = response.data["results"]
+        self.assertEqual([r["status"] for r in results], [200, 200, 404, 400])
+        self.assertEqual(results[0]["activity"]["distance"], 6000)
+        # only the moved activity is looked up again
+        self.assertEqual(mock_get_weather.call_count, 1)
+        own.refresh_from_db()
+        moved.refresh_from_db()
+        others.refresh_from_db()
+        self.assertEqual(own.distance, 6000)
+        self.assertEqual(own.weather.title, "Clouds")
+        self.assertEqual(float(moved.latitude), 41.1579)
+        self.assertEqual(others.distance, 5000)
+
+    @mock.patch("api.external_sources.WeatherProvider.getWeather")
+    def test_unavailable_weather_is_deferred(self, mock_get_weather):
+        mock_get_weather.side_effect = QuotaExceeded("out of quota")
+        self.client.login(username="user1", password="123456")
+
+        response = self.post([run(), run(latitude=41.1579)])
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            Activity.objects.filter(weather_status=WeatherStatus.PENDING.value).count(),
+            2,
+        )
+        self.assertEqual(WeatherJob.objects.count(), 2)
+
+    @override_settings(WEATHER_ENRICHMENT_ASYNC=True)
+    @mock.patch("api.external_sources.WeatherProvider.getWeather")
+    def test_async_enrichment(self, mock_get_weather):
+        self.client.login(username="user1", password="123456")
+
+        response = self.post([run(), run(latitude=None)])
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            [r["activity"]["weather_status"] for r in response.data["results"]],
+            ["PENDING", "DONE"],
+        )
+        mock_get_weather.assert_not_called()
+        self.assertEqual(WeatherJob.objects.count(), 1)
+
+
+@override_settings(WEATHER_CACHE_ENABLED=False)
+class TestMatchingActivities(TestCase):
+    @mock.patch("api.external_sources.WeatherProvider.getWeather")
+    def setUp(self, mock_get_weather):
+        mock_get_weather.return_value = None
+        user1 = User.objects.create_user(username="user1", password="123456")
+        user2 = User.objects.create_user(username="user2", password="123456")
+        User.objects.create_superuser(
+            username="useradmin", email=None, password="123456"
+        )
+        for user, day, distance in [
+            (user1, 1, 5),
+            (user1, 2, 8),
+            (user1, 20, 10),
+            (user2, 1, 6),
+        ]:
+            Activity.objects.create(
+                user=user,
+                date=datetime.date(2020, 5, day),
+                time=datetime.time(10, 0),
+                distance=distance,
+                duration=datetime.timedelta(minutes=30),
+            )
+        self.client.login(username="useradmin", password="123456")
+
+    def url(self, **params):
+        return "%s?%s" % (MATCHING_URL, urlencode(params))
+
+    def test_delete_matching(self):
+        response = self.client.delete(
+            self.url(q="(user__username eq 'user1') AND (date lt '2020-05-10')")
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {"count": 2, "dry_run": False})
+        self.assertEqual(
+            sorted(Activity.objects.values_list("distance", flat=True)), [6, 10]
+        )
+        # the rollups are refreshed
+        self.assertEqual(
+            list(
+                User.objects.get(username="user1").weekly_distances.values_list(
+                    "week", "distance"
+                )
+            ),
+            [(21, 10)],
+        )
+
+    def test_dry_run(self):
+        response = self.client.delete(self.url(q="(distance gt 5)", dry_run="true"))
+
+        self.assertEqual(response.data, {"count": 3, "dry_run": True})
+        self.assertEqual(Activity.objects.count(), 4)
+
+    def test_patch_matching(self):
+        response = self.client.patch(
+            self.url(q="(user__username eq 'user1')"),
+            {"distance": {"multiply": 1000}, "duration": "40:00"},
+            content_type="application/json",
+        )
+
+        self.assertEqual(response.data, {"count": 3, "dry_run": False})
+        self.assertEqual(
+            sorted(
+                Activity.objects.filter(user__username="user1").values_list(
+                    "distance", flat=True
+                )
+            ),
+            [5000, 8000, 10000],
+        )
+        self.assertEqual(
+            set(Activity.objects.values_list("duration", flat=True)),
+            {datetime.timedelta(minutes=40), datetime.timedelta(minutes=30)},
+        )
+
+    def test_patch_only_fields_without_weather(self):
+        response = self.client.patch(
+            self.url(q="(distance gt 5)"),
+            {"date": "2020-01-01"},
+            content_type="application/json",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(ACTIVITY_FILTER_MAX_ROWS=2)
+    def test_row_limit(self):
+        response = self.client.delete(self.url(q="(distance gt 5)"))
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data["count"], 3)
+        self.assertEqual(Activity.objects.count(), 4)
+
+    def test_invalid_or_missing_filter(self):
+        for url in [
+            MATCHING_URL,
+            self.url(q="(distance gt 5))"),
+            self.url(q="(speed gt 5)"),
+            self.url(q="(date gt 'someday')"),
+        ]:
+            response = self.client.delete(url)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, url)
+        self.assertEqual(Activity.objects.count(), 4)
+
+    def test_admins_only(self):
+        self.client.login(username="user1", password="123456")
+
+        response = self.client.delete(self.url(q="(distance gt 5)"))
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(Activity.objects.count(), 4)
@@ -0,0 +1,132 @@
+import datetime
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+
+from api.deletion import delete_user, process_user_deletions
+from api.models import (
+    Activity,
+    ActivityDays,
+    TrainingLoad,
+    User,
+    UserDeletionJob,
+    WeatherJob,
+    WeeklyDistance,
+    WeeklyDistanceSketch,
+)
+
+
+@override_settings(WEATHER_CACHE_ENABLED=False)
+class TestUserDeletion(TestCase):
+    @mock.patch("api.external_sources.WeatherProvider.getWeather")
+    def setUp(self, mock_get_weather):
+        mock_get_weather.return_value = None
+        self.runner = User.objects.create_user(username="runner", password="123456")
+        self.other = User.objects.create_user(username="other", password="123456")
+        User.objects.create_superuser(
+            username="useradmin", email=None, password="123456"
+        )
+        for user, days in [(self.runner, range(1, 8)), (self.other, [1])]:
+            for day in days:
+                Activity.objects.create(
+                    user=user,
+                    date=datetime.date(2020, 6, day),
+                    time=datetime.time(10, 0),
+                    distance=5000,
+                    duration=datetime.timedelta(minutes=30),
+                    latitude=38.7223,
+                    longitude=-9.1393,
+                )
+        WeatherJob.enqueue(
+            Activity.objects.filter(user=self.runner).values_list("id", flat=True)
+        )
+        Token.objects.create(user=self.runner)
+
+    def assertRunnerDeleted(self):
+        self.assertFalse(User.objects.filter(username="runner").exists())
+        self.assertFalse(Activity.objects.filter(user_id=self.runner.id).exists())
+        self.assertEqual(WeatherJob.objects.count(), 0)
+        self.assertEqual(Token.objects.count(), 0)
+        for model in [WeeklyDistance, TrainingLoad, ActivityDays]:
+            self.assertFalse(model.objects.filter(user_id=self.runner.id).exists())
+        # the other users' data is kept
+        self.assertEqual(Activity.objects.filter(user=self.other).count(), 1)
+        self.assertEqual(WeeklyDistance.objects.filter(user=self.other).count(), 1)
+
+    def test_delete_user_in_chunks(self):
+        result = delete_user(self.runner.id, chunk_size=3)
+
+        self.assertEqual(result.activities, 7)
+        self.assertEqual(result.chunks, 3)
+        self.assertRunnerDeleted()
+        # the runner's weekly totals left the percentile sketches
+        for row in WeeklyDistanceSketch.objects.all():
+            self.assertEqual(row.sketch.count, 1)
+
+    def test_destroy(self):
+        self.client.login(username="useradmin", password="123456")
+
+        response = self.client.delete("/api/v1/users/runner")
+
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertRunnerDeleted()
+
+    @override_settings(USER_DELETION_ASYNC=True)
+    def test_destroy_async(self):
+        self.client.login(username="useradmin", password="123456")
+
+        response = self.client.delete("/api/v1/users/runner")
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        # logged out and queued
+        self.assertFalse(User.objects.get(username="runner").is_active)
+        self.assertFalse(self.client.login(username="runner", password="123456"))
+        self.assertEqual(Token.objects.count(), 0)
+        self.assertEqual(UserDeletionJob.objects.get().user_id, self.runner.id)
+
+        self.assertEqual(process_user_deletions(), 1)
+        self.assertRunnerDeleted()
+        self.assertEqual(UserDeletionJob.objects.count(), 0)
+        self.assertEqual(process_user_deletions(), 0)
+
+    @override_settings(USER_DELETION_ASYNC=True)
+    def test_deletion_worker(self):
+        self.client.login(username="useradmin", password="123456")
+        self.client.delete("/api/v1/users/runner")
+
+        # the weather worker leaves the deletions to their own worker
+        call_command("process_weather_jobs", "--once", stdout=StringIO())
+        self.assertEqual(UserDeletionJob.objects.count(), 1)
+
+        out = StringIO()
+        call_command("process_user_deletions", "--once", stdout=out)
+        self.assertIn("Processed 1 user deletions", out.getvalue())
+        self.assertRunnerDeleted()
+
+    @override_settings(USER_DELETION_ASYNC=True)
+    @override_settings(USER_DELETION_BACKOFF=30)
+    def test_failed_deletion_is_retried(self):
+        self.client.login(username="useradmin", password="123456")
+        self.client.delete("/api/v1/users/runner")
+
+        with mock.patch(
+            "api.deletion.remove_user_rollups", side_effect=RuntimeError("db down")
+        ):
+            self.assertEqual(process_user_deletions(), 1)
+
+        job = UserDeletionJob.objects.get()
+        self.assertEqual(job.attempts, 1)
+        self.assertEqual(job.last_error, "db down")
+        self.assertAlmostEqual(
+            (job.run_after - timezone.now()).total_seconds(), 30, delta=5
+        )
+        self.assertTrue(User.objects.filter(username="runner").exists())
+
+        # resumed on the next attempt
+        delete_user(self.runner.id)
+        self.assertRunnerDeleted()
@@ -0,0 +1,182 @@
+import datetime
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework import status
+
+from api.deadlines import CircuitOpen
+from api.enrichment import process_weather_jobs
+from api.external_sources import AbstractWeatherProvider
+from api.models import Activity, User, WeatherJob, WeatherStatus
+
+
+class StubWeatherProvider(AbstractWeatherProvider):
+    "returns canned weather, after failing `failures` times"
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.calls = 0
+
+    def getWeather(self, lat, lon, when=None, quiet_fail=True):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise ConnectionError("OWM is down")
+        return {"id": 501, "title": "Rain", "description": "moderate rain"}
+
+
+@override_settings(WEATHER_ENRICHMENT_ASYNC=True)
+class TestWeatherEnrichment(TestCase):
+    def setUp(self):
+        User.objects.create_user(username="user1", password="123456")
+        self.client.login(username="user1", password="123456")
+
+    @mock.patch("api.external_sources.WeatherProvider.getWeather")
+    def create_activity(self, mock_get_weather):
+        response = self.client.post(
+            "/api/v1/activities",
+            {
+                "date": "2020-04-29",
+                "time": "23:36:53",
+                "distance": 5,
+                "duration": "25:00",
+                "latitude": 15.0,
+                "longitude": 16.0,
+            },
+            content_type="application/json",
+        )
+        mock_get_weather.assert_not_called()
+        return response
+
+    def test_create_does_not_fetch_weather(self):
+        response = self.create_activity()
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertIsNone(response.data["weather"])
+        self.assertEqual(response.data["weather_status"], "PENDING")
+        self.assertEqual(WeatherJob.objects.count(), 1)
+
+    def test_activity_not_saved_without_its_job(self):
+        with mock.patch.object(WeatherJob, "enqueue", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                Activity.objects.create(
+                    user=User.objects.get(username="user1"),
+                    date=datetime.date(2020, 4, 29),
+                    time=datetime.time(23, 36),
+                    distance=5,
+                    duration=datetime.timedelta(minutes=25),
+                    latitude=15.0,
+                    longitude=16.0,
+                )
+
+        self.assertEqual(Activity.objects.count(), 0)
+
+    def test_worker_fetches_weather(self):
+        id = self.create_activity().data["id"]
+
+        provider = StubWeatherProvider()
+        self.assertEqual(process_weather_jobs(provider=provider), 1)
+        self.assertEqual(process_weather_jobs(provider=provider), 0)
+
+        response = self.client.get(f"/api/v1/activities/{id}")
+        self.assertEqual(response.data["weather"], "Rain")
+        self.assertEqual(response.data["weather_status"], "DONE")
+        self.assertEqual(WeatherJob.objects.count(), 0)
+
+    def test_worker_retries_with_backoff(self):
+        id = self.create_activity().data["id"]
+        provider = StubWeatherProvider(failures=1)
+
+        process_weather_jobs(provider=provider)
+        job = WeatherJob.objects.get()
+        self.assertEqual(job.attempts, 1)
+        self.assertIn("OWM is down", job.last_error)
+        self.assertGreater(job.run_after, timezone.now())
+
+        # not due yet
+        self.assertEqual(process_weather_jobs(provider=provider), 0)
+
+        WeatherJob.objects.update(run_after=timezone.now())
+        self.assertEqual(process_weather_jobs(provider=provider), 1)
+        self.assertEqual(Activity.objects.get(id=id).weather.title, "Rain")
+
+    @override_settings(WEATHER_JOB_MAX_ATTEMPTS=2)
+    def test_worker_gives_up(self):
+        id = self.create_activity().data["id"]
+        provider = StubWeatherProvider(failures=5)
+
+        for _ in range(2):
+            WeatherJob.objects.update(run_after=timezone.now())
+            process_weather_jobs(provider=provider)
+
+        self.assertEqual(WeatherJob.objects.count(), 0)
+        activity = Activity.objects.get(id=id)
+        self.assertIsNone(activity.weather)
+        self.assertEqual(activity.weather_status, WeatherStatus.FAILED.value)
+
+    def test_worker_postpones_when_weather_unavailable(self):
+        id = self.create_activity().data["id"]
+        provider = mock.MagicMock()
+        provider.getWeather.side_effect = CircuitOpen("circuit is open")
+
+        process_weather_jobs(provider=provider)
+        job = WeatherJob.objects.get()
+        self.assertEqual(job.attempts, 0)
+        self.assertEqual(job.deferrals, 1)
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertEqual(
+            Activity.objects.get(id=id).weather_status, WeatherStatus.PENDING.value
+        )
+
+    @override_settings(WEATHER_JOB_MAX_DEFERRALS=2)
+    def test_worker_gives_up_after_deferrals(self):
+        id = self.create_activity().data["id"]
+        provider = mock.MagicMock()
+        provider.getWeather.side_effect = CircuitOpen("circuit is open")
+
+        for _ in range(2):
+            WeatherJob.objects.update(run_after=timezone.now())
+            process_weather_jobs(provider=provider)
+
+        self.assertEqual(WeatherJob.objects.count(), 0)
+        self.assertEqual(
+            Activity.objects.get(id=id).weather_status, WeatherStatus.FAILED.value
+        )
+
+    def test_worker_keeps_jobs_enqueued_again(self):
+        id = self.create_activity().data["id"]
+        for failures in [0, 1]:
+            provider = StubWeatherProvider(failures=failures)
+            fetch = provider.getWeather
+
+            def edited_while_fetching(*args, **kwargs):
+                # eg: the activity was moved while its weather was fetched
+                WeatherJob.enqueue([id])
+                return fetch(*args, **kwargs)
+
+            provider.getWeather = edited_while_fetching
+            process_weather_jobs(provider=provider)
+
+            job = WeatherJob.objects.get()
+            self.assertEqual((job.attempts, job.last_error), (0, ""))
+            self.assertLessEqual(job.run_after, timezone.now())
+            activity = Activity.objects.get(id=id)
+            self.assertIsNone(activity.weather)
+            self.assertEqual(activity.weather_status, WeatherStatus.PENDING.value)
+
+    def test_worker_drops_jobs_of_deleted_activities(self):
+        id = self.create_activity().data["id"]
+        Activity.objects.filter(id=id).delete()
+
+        self.assertEqual(process_weather_jobs(provider=StubWeatherProvider()), 1)
+        self.assertEqual(WeatherJob.objects.count(), 0)
+
+    @mock.patch("api.external_sources.WeatherProvider.getWeather")
+    def test_worker_command(self, mock_get_weather):
+        mock_get_weather.return_value = {"id": 800, "title": "Clear", "description": ""}
+        id = self.create_activity().data["id"]
+
+        call_command("process_weather_jobs", "--once", stdout=mock.MagicMock())
+
+        self.assertEqual(Activity.objects.get(id=id).weather.title, "Clear")
@@ -1,15 +1,26 @@
 import datetime
+import json
 from unittest import mock
 
-from django.test import TestCase
+import pyowm
+from django.test import TestCase, override_settings
 
-from api.external_sources import OpenWeatherMapProvider
+from api.external_sources import (
+    OpenWeatherMapProvider,
+    PooledHttpClient,
+    WeatherProvider,
+    get_weather_provider,
+    reset_weather_provider,
+    use_http_client,
+)
+
+# curl "https://api.openweathermap.org/data/2.5/weather?lat=15&lon=20&lang=en&APPID=xxxxxxxxxxxx"
+OWM_STUB_RESPONSE_JSON = '{"coord":{"lon":20,"lat":15},"weather":[{"id":803,"main":"Clouds","description":"broken clouds","icon":"04n"}],"base":"stations","main":{"temp":307.82,"feels_like":302.39,"temp_min":307.82,"temp_max":307.82,"pressure":1006,"humidity":9,"sea_level":1006,"grnd_level":963},"wind":{"speed":4.37,"deg":26},"clouds":{"all":53},"dt":1588101568,"sys":{"country":"TD","sunrise":1588047487,"sunset":1588092991},"timezone":3600,"id":2434508,"name":"Chad","cod":200}'
 
 
 class TestOpenWeatherMapProvider(TestCase):
     def setUp(self):
-        # curl "https://api.openweathermap.org/data/2.5/weather?lat=15&lon=20&lang=en&APPID=xxxxxxxxxxxx"
-        self.owm_stub_response_json = '{"coord":{"lon":20,"lat":15},"weather":[{"id":803,"main":"Clouds","description":"broken clouds","icon":"04n"}],"base":"stations","main":{"temp":307.82,"feels_like":302.39,"temp_min":307.82,"temp_max":307.82,"pressure":1006,"humidity":9,"sea_level":1006,"grnd_level":963},"wind":{"speed":4.37,"deg":26},"clouds":{"all":53},"dt":1588101568,"sys":{"country":"TD","sunrise":1588047487,"sunset":1588092991},"timezone":3600,"id":2434508,"name":"Chad","cod":200}'
+        self.owm_stub_response_json = OWM_STUB_RESPONSE_JSON
 
     @mock.patch("pyowm.commons.http_client.HttpClient.cacheable_get_json")
     def test_getWeather(self, mock_get_json):
@@ -20,3 +31,63 @@ class TestOpenWeatherMapProvider(TestCase):
         self.assertDictEqual(
             result, {"id": 803, "title": "Clouds", "description": "broken clouds"}
         )
+
+    def test_http_client_is_replaced(self):
+        "fails if a pyowm upgrade drops the private HttpClient this replaces"
+        client = pyowm.OWM("secret", use_ssl=True, subscription_type="free")
+        http_client = PooledHttpClient()
+
+        self.assertTrue(use_http_client(client, http_client))
+        self.assertIs(client._wapi, http_client)
+
+    def test_http_client_falls_back(self):
+        client = mock.Mock(spec=[])
+        with self.assertLogs("api.external_sources", "WARNING"):
+            self.assertFalse(use_http_client(client, PooledHttpClient()))
+
+
+def innermost(provider):
+    "the provider wrapped by the caching, resilience... layers"
+    while hasattr(provider, "provider"):
+        provider = provider.provider
+    return provider
+
+
+@override_settings(WEATHER_CACHE_ENABLED=False, WEATHER_QUOTA_PER_MINUTE=0)
+class TestWeatherProviderRegistry(TestCase):
+    def setUp(self):
+        reset_weather_provider()
+
+    def tearDown(self):
+        reset_weather_provider()
+
+    def test_provider_is_built_once_per_process(self):
+        provider = get_weather_provider()
+        self.assertIsInstance(innermost(provider), OpenWeatherMapProvider)
+        self.assertIsInstance(innermost(provider).client._wapi, PooledHttpClient)
+        self.assertIs(get_weather_provider(), provider)
+
+        with mock.patch("os.getpid", return_value=-1):  # eg: a forked worker
+            self.assertIsNot(get_weather_provider(), provider)
+
+        reset_weather_provider()
+        self.assertIsNot(get_weather_provider(), provider)
+
+    def test_settings_change_resets_provider(self):
+        provider = get_weather_provider()
+        with self.settings(WEATHER_HTTP_POOL_SIZE=1):
+            self.assertIsNot(get_weather_provider(), provider)
+
+    @mock.patch("requests.Session.get")
+    def test_connections_are_reused(self, mock_session_get):
+        mock_session_get.return_value.status_code = 200
+        mock_session_get.return_value.json.return_value = json.loads(
+            OWM_STUB_RESPONSE_JSON
+        )
+
+        session = innermost(get_weather_provider()).client._wapi.session
+        for _ in range(2):
+            result = WeatherProvider().getWeather(15, 20, quiet_fail=False)
+        self.assertEqual(result["title"], "Clouds")
+        self.assertEqual(mock_session_get.call_count, 2)
+        self.assertIs(innermost(get_weather_provider()).client._wapi.session, session)
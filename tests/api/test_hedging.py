@@ -0,0 +1,91 @@
+import time
+
+from django.test import TestCase, override_settings
+
+from api import metrics
+from api.external_sources import AbstractWeatherProvider
+from api.hedging import HedgedWeatherProvider
+from api.metrics import Histogram
+
+
+class StubProvider(AbstractWeatherProvider):
+    def __init__(self, title, delay=0.0, error=None):
+        self.title = title
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+
+    def getWeather(self, lat, lon, when=None, quiet_fail=True):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.error:
+            raise self.error
+        if self.title is None:
+            return None
+        return {"id": 800, "title": self.title, "description": ""}
+
+
+class TestHistogram(TestCase):
+    def test_quantiles(self):
+        histogram = Histogram()
+        self.assertIsNone(histogram.quantile(0.5))
+
+        for value in [0.01] * 90 + [1.0] * 10:
+            histogram.observe(value)
+        self.assertAlmostEqual(histogram.quantile(0.5), 0.01, delta=0.003)
+        self.assertAlmostEqual(histogram.quantile(0.95), 1.0, delta=0.25)
+        self.assertEqual(histogram.count, 100)
+
+
+@override_settings(
+    WEATHER_HEDGE_MIN_DELAY=0.01,
+    WEATHER_HEDGE_MAX_DELAY=0.5,
+    WEATHER_HEDGE_MIN_SAMPLES=5,
+)
+class TestHedgedWeatherProvider(TestCase):
+    def setUp(self):
+        metrics.reset()
+
+    def hedged(self, *providers):
+        return HedgedWeatherProvider(
+            providers, names=[provider.title or "none" for provider in providers]
+        )
+
+    def test_fast_first_provider_is_not_hedged(self):
+        provider = self.hedged(StubProvider("first"), StubProvider("second"))
+        self.assertEqual(provider.getWeather(1, 2)["title"], "first")
+        self.assertEqual(provider.providers[1].calls, 0)
+        self.assertEqual(
+            metrics.snapshot()["histograms"]["weather.provider.first.latency"]["count"],
+            1,
+        )
+
+    def test_slow_provider_is_hedged_after_its_usual_latency(self):
+        provider = self.hedged(StubProvider("first"), StubProvider("second"))
+        for _ in range(5):
+            provider.getWeather(1, 2)
+        self.assertLess(provider.hedge_delay(0), 0.02)
+
+        provider.providers[0].delay = 0.3
+        start = time.monotonic()
+        self.assertEqual(provider.getWeather(1, 2)["title"], "second")
+        self.assertLess(time.monotonic() - start, 0.2)
+        self.assertEqual(metrics.counter("weather.hedge.hedged"), 1)
+        self.assertEqual(metrics.counter("weather.hedge.won.second"), 1)
+
+    def test_failed_provider_hands_over_right_away(self):
+        provider = self.hedged(
+            StubProvider("first", error=ConnectionError("down")),
+            StubProvider(None),
+            StubProvider("third"),
+        )
+        self.assertEqual(provider.getWeather(1, 2)["title"], "third")
+        self.assertEqual(metrics.counter("weather.hedge.hedged"), 0)
+
+    def test_all_providers_fail(self):
+        provider = self.hedged(
+            StubProvider("first", error=ConnectionError("down")), StubProvider(None)
+        )
+        self.assertIsNone(provider.getWeather(1, 2))
+        with self.assertRaises(ConnectionError):
+            provider.getWeather(1, 2, quiet_fail=False)
@@ -0,0 +1,150 @@
+import datetime
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework import status
+
+from api.models import Activity, IdempotencyKey, User
+
+CLOUDS = {"id": 803, "title": "Clouds", "description": "broken clouds"}
+RUN = {
+    "date": "2020-05-01",
+    "time": "10:00",
+    "distance": 5000,
+    "duration": "30:00",
+    "latitude": 38.7223,
+    "longitude": -9.1393,
+}
+
+
+@override_settings(WEATHER_CACHE_ENABLED=False)
+class TestIdempotencyKeys(TestCase):
+    def setUp(self):
+        User.objects.create_user(username="user1", password="123456")
+        User.objects.create_user(username="user2", password="123456")
+        self.client.login(username="user1", password="123456")
+
+    def post(self, data, key, url="/api/v1/activities"):
+        return self.client.post(
+            url, data, content_type="application/json", HTTP_IDEMPOTENCY_KEY=key
+        )
+
+    @mock.patch("api.external_sources.WeatherProvider.getWeather")
+    def test_retries_are_replayed(self, mock_get_weather):
+        mock_get_weather.return_value = CLOUDS
+
+        first = self.post(RUN, "key-1")
+        # the same data, in another order
+        retry = self.post(dict(reversed(list(RUN.items()))), "key-1")
+
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertFalse(first.has_header("Idempotent-Replayed"))
+        self.assertEqual(Activity.objects.count(), 1)
+        mock_get_weather.assert_called_once()
+
+        # without a key, or with another one: executed
+        self.post(RUN, "key-2")
+        self.client.post("/api/v1/activities", RUN, content_type="application/json")
+        self.assertEqual(Activity.objects.count(), 3)
+
+    @mock.patch("api.external_sources.WeatherProvider.getWeather")
+    def test_bulk(self, mock_get_weather):
+        mock_get_weather.return_value = CLOUDS
+        url = "/api/v1/activities/bulk"
+
+        first = self.post([RUN, RUN], "key-1", url=url)
+        retry = self.post([RUN, RUN], "key-1", url=url)
+
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(Activity.objects.count(), 2)
+
+    @mock.patch("api.external_sources.WeatherProvider.getWeather")
+    def test_key_reused_for_another_request(self, mock_get_weather):
+        mock_get_weather.return_value = CLOUDS
+        self.post(RUN, "key-1")
+
+        response = self.post(dict(RUN, distance=6000), "key-1")
+
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(Activity.objects.count(), 1)
+
+    @mock.patch("api.external_sources.WeatherProvider.getWeather")
+    def test_keys_per_user(self, mock_get_weather):
+        mock_get_weather.return_value = CLOUDS
+        self.post(RUN, "key-1")
+        self.client.login(username="user2", password="123456")
+
+        response = self.post(RUN, "key-1")
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.json()["user"], "user2")
+        self.assertEqual(Activity.objects.count(), 2)
+
+    @mock.patch("api.external_sources.WeatherProvider.getWeather")
+    def test_errors_are_not_stored(self, mock_get_weather):
+        mock_get_weather.return_value = CLOUDS
+
+        invalid = self.post(dict(RUN, distance="far"), "key-1")
+        fixed = self.post(RUN, "key-1")
+
+        self.assertEqual(invalid.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(fixed.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Activity.objects.count(), 1)
+
+    @mock.patch("api.external_sources.WeatherProvider.getWeather")
+    def test_write_and_response_are_stored_together(self, mock_get_weather):
+        mock_get_weather.return_value = CLOUDS
+
+        # eg: the process dies while storing the response
+        with mock.patch.object(IdempotencyKey, "save", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.post(RUN, "key-1")
+        self.assertEqual(Activity.objects.count(), 0)
+
+        self.assertEqual(self.post(RUN, "key-1").status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.post(RUN, "key-1")["Idempotent-Replayed"], "true")
+        self.assertEqual(Activity.objects.count(), 1)
+
+    @mock.patch("api.external_sources.WeatherProvider.getWeather")
+    def test_running_or_lost_request(self, mock_get_weather):
+        mock_get_weather.return_value = CLOUDS
+        self.post(RUN, "key-1")
+        # as if still running
+        record = IdempotencyKey.objects.get()
+        IdempotencyKey.objects.filter(id=record.id).update(status_code=None, body="")
+
+        response = self.post(RUN, "key-1")
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+        # lost: executed again
+        IdempotencyKey.objects.filter(id=record.id).update(
+            started_at=timezone.now() - datetime.timedelta(minutes=5)
+        )
+        response = self.post(RUN, "key-1")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertFalse(response.has_header("Idempotent-Replayed"))
+        self.assertEqual(IdempotencyKey.objects.get().status_code, 201)
+
+    @mock.patch("api.external_sources.WeatherProvider.getWeather")
+    def test_expired_keys(self, mock_get_weather):
+        mock_get_weather.return_value = CLOUDS
+        self.post(RUN, "key-1")
+        self.post(RUN, "key-2")
+        IdempotencyKey.objects.filter(key="key-1").update(expires_at=timezone.now())
+
+        response = self.post(RUN, "key-1")
+        self.assertFalse(response.has_header("Idempotent-Replayed"))
+        self.assertEqual(Activity.objects.count(), 3)
+
+        IdempotencyKey.objects.update(expires_at=timezone.now())
+        self.assertEqual(IdempotencyKey.prune(), 2)
+
+    def test_invalid_key(self):
+        response = self.post(RUN, "k" * 256)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Activity.objects.count(), 0)
@@ -0,0 +1,232 @@
+import datetime
+import io
+import os
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+from rest_framework import status
+
+from api.imports import (
+    ActivityImportError,
+    _elements,
+    haversine,
+    import_activities,
+    parse_gpx,
+    parse_tcx,
+)
+from api.models import Activity, User, WeatherJob, WeatherStatus
+
+GPX = b"""<?xml version="1.0" encoding="UTF-8"?>
+<gpx version="1.1" creator="watch" xmlns="http://www.topografix.com/GPX/1/1">
+  <metadata><time>2020-05-01T00:00:00Z</time></metadata>
+  <trk>
+    <name>Morning run</name>
+    <trkseg>
+      <trkpt lat="38.722300" lon="-9.139300"><time>2020-05-01T07:00:00Z</time></trkpt>
+      <trkpt lat="38.731300" lon="-9.139300"><time>2020-05-01T07:05:00Z</time></trkpt>
+    </trkseg>
+    <trkseg>
+      <trkpt lat="38.740300" lon="-9.139300"><time>2020-05-01T07:10:30Z</time></trkpt>
+    </trkseg>
+  </trk>
+  <trk>
+    <name>Planned route</name>
+    <trkseg><trkpt lat="38.7" lon="-9.1"></trkpt></trkseg>
+  </trk>
+</gpx>
+"""
+
+TCX = b"""<?xml version="1.0" encoding="UTF-8"?>
+<TrainingCenterDatabase
+  xmlns="http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2">
+  <Activities>
+    <Activity Sport="Running">
+      <Id>2020-05-02T18:30:00+01:00</Id>
+      <Lap StartTime="2020-05-02T17:30:00Z">
+        <TotalTimeSeconds>600</TotalTimeSeconds>
+        <DistanceMeters>2000.4</DistanceMeters>
+        <Track>
+          <Trackpoint>
+            <Time>2020-05-02T17:30:00Z</Time>
+            <Position>
+              <LatitudeDegrees>41.1579</LatitudeDegrees>
+              <LongitudeDegrees>-8.6291</LongitudeDegrees>
+            </Position>
+            <DistanceMeters>0</DistanceMeters>
+          </Trackpoint>
+        </Track>
+      </Lap>
+      <Lap StartTime="2020-05-02T17:40:00Z">
+        <TotalTimeSeconds>300</TotalTimeSeconds>
+        <DistanceMeters>1000</DistanceMeters>
+      </Lap>
+    </Activity>
+  </Activities>
+</TrainingCenterDatabase>
+"""
+
+CSV = b"""date,time,distance,duration,latitude,longitude
+2020-05-03,09:15:00,5000,25:00,38.7223,-9.1393
+2020-05-04,09:15:00,far,25:00,,
+2020-05-05,19:00,8000,00:45:10,,
+2020-05-06,19:00,8000,00:45:10,123,-9.1
+"""
+
+
+class TestParsers(TestCase):
+    def test_haversine(self):
+        # 0.009 degrees of latitude: ~1km
+        self.assertAlmostEqual(haversine(38.7223, -9.1393, 38.7313, -9.1393), 1001, 0)
+
+    def test_gpx(self):
+        track, invalid = list(parse_gpx(io.BytesIO(GPX)))
+
+        self.assertEqual(track.start, datetime.datetime(2020, 5, 1, 7, 0))
+        self.assertEqual(track.duration, datetime.timedelta(minutes=10, seconds=30))
+        self.assertAlmostEqual(track.distance, 2002, 0)
+        self.assertEqual((track.latitude, track.longitude), (38.7223, -9.1393))
+        self.assertEqual(invalid.position, "track 2")
+
+    def test_tcx(self):
+        (track,) = list(parse_tcx(io.BytesIO(TCX)))
+
+        self.assertEqual(track.start, datetime.datetime(2020, 5, 2, 17, 30))
+        self.assertEqual(track.duration, datetime.timedelta(minutes=15))
+        self.assertAlmostEqual(track.distance, 3000.4)
+        self.assertEqual((track.latitude, track.longitude), (41.1579, -8.6291))
+
+    def test_elements_are_dropped_once_read(self):
+        points = b"".join(
+            b'<trkpt lat="38.7" lon="-9.1"><time>2020-05-01T07:%02d:00Z</time></trkpt>'
+            % (minute % 60)
+            for minute in range(5000)
+        )
+        gpx = b"<gpx><trk><trkseg>%s</trkseg></trk></gpx>" % points
+
+        elements = _elements(io.BytesIO(gpx))
+        _, _, root, _ = next(elements)
+        sizes = [
+            len(list(root.iter()))
+            for event, tag, _, _ in elements
+            if event == "end" and tag == "trkpt"
+        ]
+
+        # bounded by what the parser reads ahead (a buffer), not by the file
+        self.assertEqual(len(sizes), 5000)
+        self.assertLess(max(sizes), 1000)
+
+
+class TestImportActivities(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="user1", password="123456")
+        User.objects.create_user(username="user2", password="123456")
+        User.objects.create_superuser(
+            username="useradmin", email=None, password="123456"
+        )
+
+    @mock.patch("api.external_sources.WeatherProvider.getWeather")
+    def test_import_defers_weather(self, mock_get_weather):
+        result = import_activities(self.user, io.BytesIO(CSV), "csv", batch_size=1)
+
+        self.assertEqual((result.imported, result.skipped), (2, 2))
+        self.assertTrue(result.errors[0].startswith("line 3:"))
+        self.assertTrue(result.errors[1].startswith("line 5: invalid latitude"))
+        mock_get_weather.assert_not_called()
+        located = Activity.objects.get(date=datetime.date(2020, 5, 3))
+        self.assertEqual(located.weather_status, WeatherStatus.PENDING.value)
+        self.assertEqual(located.duration, datetime.timedelta(minutes=25))
+        self.assertEqual(WeatherJob.objects.get().activity_id, located.id)
+        unlocated = Activity.objects.get(date=datetime.date(2020, 5, 5))
+        self.assertEqual(unlocated.weather_status, WeatherStatus.DONE.value)
+
+    def test_malformed_file_keeps_previous_batches(self):
+        truncated = GPX.split(b"<name>Planned")[0]
+
+        with self.assertRaises(ActivityImportError) as cm:
+            import_activities(self.user, io.BytesIO(truncated), "gpx")
+
+        self.assertEqual(cm.exception.result.imported, 1)
+        self.assertEqual(Activity.objects.count(), 1)
+
+    def test_unreadable_csv_keeps_previous_batches(self):
+        latin1 = CSV + "2020-05-07,08:00,5000,25:00,,,Caf\u00e9\n".encode("latin-1")
+        malformed = CSV + b"2020-05-07,08:00,5000,25:00,," + b"9" * 200000 + b"\n"
+
+        for content, error in [
+            (latin1, "line 6: invalid UTF-8 text"),
+            (malformed, "line 6: field larger than field limit (131072)"),
+        ]:
+            with self.assertRaises(ActivityImportError) as cm:
+                import_activities(self.user, io.BytesIO(content), "csv", batch_size=1)
+            self.assertEqual(str(cm.exception), error)
+            self.assertEqual(cm.exception.result.imported, 2)
+
+        self.client.login(username="user1", password="123456")
+        response = self.client.post(
+            "/api/v1/activities/import",
+            {"file": SimpleUploadedFile("export.csv", latin1)},
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data["detail"], "line 6: invalid UTF-8 text")
+        self.assertEqual(response.data["imported"], 2)
+
+    def test_endpoint(self):
+        self.client.login(username="user1", password="123456")
+
+        response = self.client.post(
+            "/api/v1/activities/import",
+            {"file": SimpleUploadedFile("export.tcx", TCX)},
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["imported"], 1)
+        self.assertEqual(
+            Activity.objects.get().distance,
+            3000,
+        )
+
+    def test_endpoint_for_others(self):
+        self.client.login(username="user1", password="123456")
+        response = self.client.post(
+            "/api/v1/activities/import",
+            {"file": SimpleUploadedFile("export.csv", CSV), "user": "user2"},
+        )
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.login(username="useradmin", password="123456")
+        response = self.client.post(
+            "/api/v1/activities/import",
+            {"file": SimpleUploadedFile("export.csv", CSV), "user": "user2"},
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Activity.objects.filter(user__username="user2").count(), 2)
+
+    def test_endpoint_unknown_format(self):
+        self.client.login(username="user1", password="123456")
+
+        response = self.client.post(
+            "/api/v1/activities/import",
+            {"file": SimpleUploadedFile("export.fit", b"\x0e\x10")},
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "export.gpx")
+            with open(path, "wb") as file:
+                file.write(GPX)
+
+            out, err = StringIO(), StringIO()
+            call_command(
+                "import_activities", path, user="user1", stdout=out, stderr=err
+            )
+
+            self.assertIn("Imported 1 activities, skipped 1", out.getvalue())
+            self.assertIn("track 2", err.getvalue())
+            with self.assertRaises(CommandError):
+                call_command("import_activities", path, user="nobody", stdout=out)
@@ -0,0 +1,147 @@
+import datetime
+import json
+from urllib.parse import urlencode
+
+from asgiref.sync import sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from django.test import TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from api import live
+from api.models import Activity, User, Weather
+from jogging_tracker.asgi import application
+
+
+def run(username, distance):
+    return Activity.objects.create(
+        user=User.objects.get(username=username),
+        date=datetime.date(2020, 5, 1),
+        time=datetime.time(10, 0),
+        distance=distance,
+        duration=datetime.timedelta(minutes=30),
+    )
+
+
+@override_settings(LIVE_POLL_INTERVAL=3600)
+class TestLiveFeed(TransactionTestCase):
+    def setUp(self):
+        self.tokens = {}
+        for username in ["user1", "user2"]:
+            user = User.objects.create_user(username=username, password="123456")
+            self.tokens[username] = Token.objects.create(user=user).key
+        admin = User.objects.create_superuser(
+            username="useradmin", email=None, password="123456"
+        )
+        self.tokens["useradmin"] = Token.objects.create(user=admin).key
+
+    async def connect(self, username=None, method="GET", **params):
+        headers = []
+        if username is not None:
+            token = "Token %s" % self.tokens[username]
+            headers.append((b"authorization", token.encode()))
+        communicator = ApplicationCommunicator(
+            application,
+            {
+                "type": "http",
+                "method": method,
+                "path": live.PATH,
+                "query_string": urlencode(params).encode(),
+                "headers": headers,
+            },
+        )
+        await communicator.send_input({"type": "http.request", "body": b""})
+        start = await communicator.receive_output(timeout=5)
+        return communicator, start["status"]
+
+    async def receive_activity(self, communicator):
+        message = await communicator.receive_output(timeout=1)
+        event, data = message["body"].decode().strip().split("\n")
+        self.assertEqual(event, "event: activity")
+        return json.loads(data[len("data: ") :])
+
+    async def test_feed(self):
+        admin, status = await self.connect("useradmin", q="distance gt 6000")
+        self.assertEqual(status, 200)
+        user1, _ = await self.connect("user1")
+
+        await sync_to_async(run)("user1", 5000)
+        await sync_to_async(run)("user2", 8000)
+        self.assertEqual(await live.broadcaster.poll(), 2)
+
+        # every user's activities matching the filter
+        activity = await self.receive_activity(admin)
+        self.assertEqual((activity["user"], activity["distance"]), ("user2", 8000))
+        self.assertTrue(await admin.receive_nothing())
+        # only its own
+        activity = await self.receive_activity(user1)
+        self.assertEqual((activity["user"], activity["distance"]), ("user1", 5000))
+        self.assertTrue(await user1.receive_nothing())
+
+        for communicator in [admin, user1]:
+            await communicator.send_input({"type": "http.disconnect"})
+            await communicator.wait(timeout=1)
+        self.assertEqual(live.broadcaster.subscribers, set())
+        self.assertIsNone(live.broadcaster.task)
+
+    async def test_related_fields(self):
+        rain, _ = await self.connect("user1", q="weather__title eq 'Rain'")
+        everything, _ = await self.connect("user1")
+
+        def rainy_run(distance):
+            activity = run("user1", distance)
+            weather = Weather.get_or_create(500, "Rain", "light rain")
+            Activity.objects.filter(id=activity.id).update(
+                weather=weather, updated_at=timezone.now(), change_seq=None
+            )
+
+        await sync_to_async(run)("user1", 5000)
+        await sync_to_async(rainy_run)(6000)
+        self.assertEqual(await live.broadcaster.poll(), 2)
+
+        # matched without querying the weather from the event loop
+        self.assertEqual((await self.receive_activity(rain))["distance"], 6000)
+        self.assertTrue(await rain.receive_nothing())
+        for distance in [5000, 6000]:
+            activity = await self.receive_activity(everything)
+            self.assertEqual(activity["distance"], distance)
+
+    async def test_failing_predicate(self):
+        communicator, _ = await self.connect("user1")
+        failing = live.Subscriber(None, lambda activity: 1 / 0)
+        live.broadcaster.subscribers.add(failing)
+        try:
+            await sync_to_async(run)("user1", 5000)
+            await live.broadcaster.poll()
+        finally:
+            live.broadcaster.subscribers.discard(failing)
+
+        # delivered to the others
+        self.assertEqual((await self.receive_activity(communicator))["distance"], 5000)
+
+    @override_settings(LIVE_QUEUE_SIZE=1)
+    async def test_slow_subscriber(self):
+        communicator, _ = await self.connect("user1")
+
+        await sync_to_async(run)("user1", 5000)
+        await sync_to_async(run)("user1", 6000)
+        await live.broadcaster.poll()
+
+        self.assertEqual((await self.receive_activity(communicator))["distance"], 5000)
+        message = await communicator.receive_output(timeout=1)
+        self.assertTrue(message["body"].startswith(b"event: overflow"))
+        self.assertFalse(message.get("more_body", False))
+        await communicator.wait(timeout=1)
+        self.assertIsNone(live.broadcaster.task)
+
+    async def test_rejected(self):
+        for username, method, params, expected in [
+            (None, "GET", {}, 401),
+            ("user1", "GET", {"q": "(distance gt 5))"}, 400),
+            ("user1", "GET", {"q": "speed gt 5"}, 400),
+            ("user1", "POST", {}, 405),
+        ]:
+            communicator, status = await self.connect(username, method, **params)
+            self.assertEqual(status, expected, (username, method, params))
+            await communicator.receive_output(timeout=1)
+            await communicator.wait(timeout=1)
@@ -0,0 +1,113 @@
+import datetime
+import random
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from api.models import Activity, User, WeeklyDistance, WeeklyDistanceSketch
+from api.sketches import QuantileSketch
+
+
+class TestQuantileSketch(TestCase):
+    def test_percentile_rank_error_is_bounded(self):
+        values = [random.randint(1, 100000) for _ in range(5000)]
+        sketch = QuantileSketch(accuracy=0.01)
+        for value in values:
+            sketch.add(value)
+
+        for value in values[:50]:
+            exact_below = sum(1 for v in values if v < value)
+            # only values within 1% of `value` can be misplaced
+            uncertain = sum(1 for v in values if 0.98 * value <= v <= 1.02 * value)
+            rank = sketch.percentile_rank(value) * (len(values) - 1) / 100
+            self.assertLessEqual(abs(rank - exact_below), uncertain)
+
+    def test_quantile_relative_error(self):
+        sketch = QuantileSketch(accuracy=0.01)
+        for value in range(1, 1001):
+            sketch.add(value)
+        self.assertAlmostEqual(sketch.quantile(0.5), 500, delta=500 * 0.01 + 1)
+
+    def test_remove_and_serialize(self):
+        sketch = QuantileSketch(accuracy=0.02)
+        sketch.add(100)
+        sketch.add(200)
+        sketch.add(200)
+        sketch.remove(200)
+
+        restored = QuantileSketch.from_bytes(sketch.to_bytes())
+        self.assertEqual(restored.accuracy, 0.02)
+        self.assertEqual(restored.count, 2)
+        self.assertEqual(restored.percentile_rank(200), 100.0)
+        self.assertEqual(restored.percentile_rank(100), 0.0)
+
+    def test_single_value_has_no_rank(self):
+        sketch = QuantileSketch()
+        sketch.add(10)
+        self.assertIsNone(sketch.percentile_rank(10))
+
+
+class TestWeeklyDistanceRollup(TestCase):
+    @mock.patch("api.external_sources.WeatherProvider.getWeather")
+    def setUp(self, mock_get_weather):
+        mock_get_weather.return_value = None
+        self.user1 = User.objects.create_user(username="user1", password="123456")
+        self.user2 = User.objects.create_user(username="user2", password="123456")
+        self.date = datetime.date(2020, 1, 8)  # year 2020, week 2
+
+        for user, distance in [(self.user1, 100), (self.user2, 300)]:
+            Activity.objects.create(
+                date=self.date,
+                time=datetime.time(10, 0),
+                distance=distance,
+                duration=datetime.timedelta(minutes=10),
+                user=user,
+                latitude=0,
+                longitude=0,
+            )
+
+    def sketch(self):
+        return WeeklyDistanceSketch.objects.get(year=2020, week=2).sketch
+
+    def test_created_activities_update_rollups(self):
+        self.assertEqual(
+            WeeklyDistance.objects.get(user=self.user1, year=2020, week=2).distance,
+            100,
+        )
+        self.assertEqual(self.sketch().count, 2)
+        self.assertEqual(self.sketch().percentile_rank(100), 0.0)
+
+    @mock.patch("api.external_sources.WeatherProvider.getWeather")
+    def test_updated_activity_moves_weeks(self, mock_get_weather):
+        mock_get_weather.return_value = None
+        activity = Activity.objects.get(user=self.user1)
+        activity.distance = 500
+        activity.save()
+        self.assertEqual(self.sketch().count, 2)
+        self.assertEqual(self.sketch().percentile_rank(500), 100.0)
+
+        activity.date = datetime.date(2020, 1, 15)
+        activity.save()
+        self.assertFalse(
+            WeeklyDistance.objects.filter(user=self.user1, week=2).exists()
+        )
+        self.assertEqual(self.sketch().count, 1)
+        self.assertEqual(
+            WeeklyDistance.objects.get(user=self.user1, year=2020, week=3).distance,
+            500,
+        )
+
+    def test_deleted_activity_leaves_sketch(self):
+        Activity.objects.get(user=self.user2).delete()
+        self.assertEqual(self.sketch().count, 1)
+
+    def test_rebuild_rollups(self):
+        WeeklyDistance.objects.all().delete()
+        WeeklyDistanceSketch.objects.all().delete()
+
+        call_command("rebuild_rollups", stdout=mock.MagicMock())
+
+        self.assertEqual(WeeklyDistance.objects.count(), 2)
+        self.assertEqual(self.sketch().count, 2)
+        self.assertEqual(self.sketch().percentile_rank(300), 100.0)
@@ -0,0 +1,100 @@
+import datetime
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from api import metrics
+from api.models import Activity, User, WeatherCacheEntry
+from api.prefetch import prefetch_stats, prefetch_weather
+from api.weather_cache import CachedWeatherProvider
+
+NOW = datetime.datetime(2020, 5, 10, 9, 30, tzinfo=datetime.timezone.utc)
+
+
+@override_settings(
+    WEATHER_CACHE_PRECISION=6,
+    WEATHER_CACHE_BUCKET=3600,
+    WEATHER_PREFETCH_MIN_RUNS=3,
+    WEATHER_PREFETCH_HORIZON=3600,
+)
+class TestPrefetch(TestCase):
+    @mock.patch("api.external_sources.WeatherProvider.getWeather")
+    def setUp(self, mock_get_weather):
+        metrics.reset()
+        mock_get_weather.return_value = None
+        user = User.objects.create_user(username="user1", password="123456")
+
+        # 3 runs from Lisbon at ~10h, 2 from Porto at ~10h, 3 from Lisbon at 18h
+        for day, hour, latitude, longitude in [
+            (5, 10, 38.7223, -9.1393),
+            (6, 10, 38.7224, -9.1392),
+            (8, 10, 38.7223, -9.1393),
+            (5, 10, 41.1579, -8.6291),
+            (6, 10, 41.1579, -8.6291),
+            (5, 18, 38.7223, -9.1393),
+            (6, 18, 38.7223, -9.1393),
+            (7, 18, 38.7223, -9.1393),
+        ]:
+            Activity.objects.create(
+                date=datetime.date(2020, 5, day),
+                time=datetime.time(hour, 15),
+                distance=5000,
+                duration=datetime.timedelta(minutes=30),
+                user=user,
+                latitude=latitude,
+                longitude=longitude,
+            )
+
+        self.backend = mock.MagicMock()
+        self.backend.getWeather.return_value = {
+            "id": 800,
+            "title": "Clear",
+            "description": "clear sky",
+        }
+        self.provider = CachedWeatherProvider(self.backend)
+        patcher = mock.patch(
+            "api.prefetch.get_weather_provider", return_value=self.provider
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_prefetch_habitual_slots_due_soon(self):
+        result = prefetch_weather(now=NOW)
+
+        self.assertEqual((result.slots, result.due, result.prefetched), (2, 1, 1))
+        entry = WeatherCacheEntry.objects.get()
+        self.assertTrue(entry.prefetched)
+        self.assertEqual(
+            entry.bucket,
+            int(
+                datetime.datetime(
+                    2020, 5, 10, 10, tzinfo=datetime.timezone.utc
+                ).timestamp()
+            )
+            // 3600,
+        )
+
+        # already cached: not looked up again
+        self.assertEqual(prefetch_weather(now=NOW).prefetched, 0)
+        self.assertEqual(self.backend.getWeather.call_count, 1)
+
+    def test_upload_hits_prefetched_entry(self):
+        prefetch_weather(now=NOW)
+        self.provider.getWeather(
+            38.7223, -9.1393, when=datetime.datetime(2020, 5, 10, 10, 20)
+        )
+
+        self.assertEqual(self.backend.getWeather.call_count, 1)
+        self.assertEqual(metrics.counter("weather.prefetch.hits"), 1)
+        self.assertEqual(
+            prefetch_stats(NOW - datetime.timedelta(days=1)),
+            {"entries": 1, "used": 1, "hits": 1, "hit_ratio": 1.0},
+        )
+
+    def test_prefetch_command(self):
+        out = StringIO()
+        call_command("prefetch_weather", stdout=out)
+        self.assertIn("habitual slots", out.getvalue())
+        self.assertIn("prefetched entries", out.getvalue())
@@ -0,0 +1,95 @@
+import datetime
+import os
+import tempfile
+from unittest import mock
+
+from django.test import TestCase, override_settings
+
+from api import metrics
+from api.deadlines import QuotaExceeded, deadline
+from api.external_sources import build_weather_backend
+from api.models import Activity, User, WeatherJob, WeatherStatus
+from api.quota import QuotaWeatherProvider, TokenBucket
+
+
+class TestTokenBucket(TestCase):
+    def setUp(self):
+        metrics.reset()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "quota.sqlite3")
+
+    def test_bucket_is_shared(self):
+        bucket = TokenBucket(self.path, "weather", capacity=2, rate=0.001)
+        other = TokenBucket(self.path, "weather", capacity=2, rate=0.001)
+
+        self.assertTrue(bucket.acquire())
+        self.assertTrue(other.acquire())
+        self.assertFalse(bucket.acquire())
+        self.assertFalse(other.acquire(timeout=0.1))
+
+    def test_bucket_refills(self):
+        bucket = TokenBucket(self.path, "weather", capacity=1, rate=20)
+        self.assertTrue(bucket.acquire())
+        self.assertFalse(bucket.acquire())
+        self.assertTrue(bucket.acquire(timeout=0.5))
+
+    def test_connections_are_closed(self):
+        connect = TokenBucket._connect
+        connections = []
+
+        def tracked(bucket):
+            connections.append(mock.MagicMock(wraps=connect(bucket)))
+            return connections[-1]
+
+        with mock.patch.object(TokenBucket, "_connect", tracked):
+            TokenBucket(self.path, "weather", capacity=1, rate=1).acquire()
+
+        self.assertEqual(len(connections), 2)
+        for connection in connections:
+            connection.close.assert_called_once_with()
+
+    def test_provider_waits_within_deadline(self):
+        backend = mock.MagicMock()
+        backend.getWeather.return_value = None
+        provider = QuotaWeatherProvider(
+            backend, TokenBucket(self.path, "weather", capacity=1, rate=0.001)
+        )
+
+        provider.getWeather(1, 2)
+        with deadline(0.1):
+            with self.assertRaises(QuotaExceeded):
+                provider.getWeather(1, 2, quiet_fail=False)
+        self.assertEqual(backend.getWeather.call_count, 1)
+        self.assertEqual(metrics.counter("weather.quota.exceeded"), 1)
+
+    def test_quota_is_opt_in(self):
+        path = "api.external_sources.OpenWeatherMapProvider"
+        self.assertNotIsInstance(
+            build_weather_backend(path).provider, QuotaWeatherProvider
+        )
+        with override_settings(
+            WEATHER_QUOTA_PER_MINUTE=60, WEATHER_QUOTA_PATH=self.path
+        ):
+            self.assertIsInstance(
+                build_weather_backend(path).provider, QuotaWeatherProvider
+            )
+
+
+class TestDeferredWeather(TestCase):
+    @mock.patch("api.external_sources.WeatherProvider.getWeather")
+    def test_save_defers_unavailable_weather(self, mock_get_weather):
+        mock_get_weather.side_effect = QuotaExceeded("weather API quota exceeded")
+        activity = Activity.objects.create(
+            date=datetime.date(2020, 5, 1),
+            time=datetime.time(10, 0),
+            distance=1000,
+            duration=datetime.timedelta(minutes=5),
+            user=User.objects.create_user(username="user1", password="123456"),
+            latitude=0,
+            longitude=0,
+        )
+
+        self.assertIsNone(activity.weather)
+        self.assertEqual(activity.weather_status, WeatherStatus.PENDING.value)
+        self.assertEqual(WeatherJob.objects.get().activity_id, activity.id)
@@ -46,7 +46,13 @@ class TestActivities(TestCase):
         self.assertDictEqual(
             response.data["results"][0],
             #                                        avg_speed = 10m / 60s = 0.167 m/s
-            {"year": 2020, "week": 1, "distance": 50, "average_speed": 0.167},
+            {
+                "year": 2020,
+                "week": 1,
+                "distance": 50,
+                "average_speed": 0.167,
+                "percentile": 0.0,
+            },
         )
 
     def test_report_activities_wrong_user(self):
@@ -68,11 +74,18 @@ class TestActivities(TestCase):
                 "week": 1,
                 "distance": 100,
                 "average_speed": 0.167,
+                "percentile": 50.0,
             },  # this week was only 5 days
         )
         self.assertDictEqual(
             response.data["results"][1],
-            {"year": 2020, "week": 2, "distance": 140, "average_speed": 0.167},
+            {
+                "year": 2020,
+                "week": 2,
+                "distance": 140,
+                "average_speed": 0.167,
+                "percentile": 50.0,
+            },
         )
         self.assertDictEqual(
             response.data["results"][4],
@@ -81,6 +94,7 @@ class TestActivities(TestCase):
                 "week": 5,
                 "distance": 60,
                 "average_speed": 0.167,
+                "percentile": 50.0,
             },  # days 27, 28, 29 / jan 2020
         )
 
@@ -97,11 +111,18 @@ class TestActivities(TestCase):
                 "week": 1,
                 "distance": 100,
                 "average_speed": 0.167,
+                "percentile": 50.0,
             },  # this week was only 5 days
         )
         self.assertDictEqual(
             response.data["results"][1],
-            {"year": 2020, "week": 2, "distance": 140, "average_speed": 0.167},
+            {
+                "year": 2020,
+                "week": 2,
+                "distance": 140,
+                "average_speed": 0.167,
+                "percentile": 50.0,
+            },
         )
         self.assertDictEqual(
             response.data["results"][4],
@@ -110,5 +131,6 @@ class TestActivities(TestCase):
                 "week": 5,
                 "distance": 60,
                 "average_speed": 0.167,
+                "percentile": 50.0,
             },  # days 27, 28, 29 / jan 2020
         )
@@ -0,0 +1,114 @@
+import time
+from unittest import mock
+
+from django.test import TestCase
+
+from api import metrics
+from api.deadlines import (
+    CircuitOpen,
+    DeadlineExceeded,
+    call_timeout,
+    deadline,
+    remaining,
+)
+from api.resilience import BreakerState, CircuitBreaker, ResilientWeatherProvider
+
+WEATHER = {"id": 800, "title": "Clear", "description": "clear sky"}
+
+
+class TestDeadline(TestCase):
+    def test_no_deadline(self):
+        self.assertIsNone(remaining())
+        self.assertEqual(call_timeout(2), 2)
+
+    def test_nested_deadlines_keep_the_closest(self):
+        with deadline(10):
+            self.assertEqual(call_timeout(2), 2)
+            with deadline(60):
+                self.assertLessEqual(remaining(), 10)
+            with deadline(0.5):
+                self.assertLessEqual(call_timeout(2), 0.5)
+        self.assertIsNone(remaining())
+
+    def test_deadline_exceeded(self):
+        with deadline(0):
+            self.assertEqual(remaining(), 0)
+            with self.assertRaises(DeadlineExceeded):
+                call_timeout(2)
+
+
+class TestCircuitBreaker(TestCase):
+    def setUp(self):
+        metrics.reset()
+        self.backend = mock.MagicMock()
+        self.backend.getWeather.side_effect = ConnectionError("OWM is down")
+        self.breaker = CircuitBreaker(
+            "test.breaker",
+            failure_threshold=3,
+            slow_call_duration=10,
+            reset_timeout=30,
+        )
+        self.provider = ResilientWeatherProvider(self.backend, self.breaker)
+
+    def fail(self, times):
+        for _ in range(times):
+            self.assertIsNone(self.provider.getWeather(1, 2))
+
+    def test_opens_after_consecutive_failures(self):
+        self.fail(3)
+        self.assertEqual(self.breaker.state, BreakerState.OPEN)
+
+        self.fail(2)
+        self.assertEqual(self.backend.getWeather.call_count, 3)
+        with self.assertRaises(CircuitOpen):
+            self.provider.getWeather(1, 2, quiet_fail=False)
+
+        self.assertEqual(metrics.counter("test.breaker.trips"), 1)
+        self.assertEqual(metrics.counter("test.breaker.rejected"), 3)
+        self.assertEqual(
+            metrics.snapshot()["gauges"]["test.breaker.state"],
+            BreakerState.OPEN.value,
+        )
+
+    def test_success_resets_failures(self):
+        self.fail(2)
+        self.backend.getWeather.side_effect = None
+        self.backend.getWeather.return_value = WEATHER
+        self.assertEqual(self.provider.getWeather(1, 2), WEATHER)
+        self.backend.getWeather.side_effect = ConnectionError("OWM is down")
+        self.fail(2)
+        self.assertEqual(self.breaker.state, BreakerState.CLOSED)
+
+    def test_half_open_probe(self):
+        self.fail(3)
+        self.breaker.opened_at -= 30
+
+        # a failed probe opens the circuit again
+        self.fail(1)
+        self.assertEqual(self.breaker.state, BreakerState.OPEN)
+        self.assertEqual(self.backend.getWeather.call_count, 4)
+
+        self.breaker.opened_at -= 30
+        self.backend.getWeather.side_effect = None
+        self.backend.getWeather.return_value = WEATHER
+        self.assertEqual(self.provider.getWeather(1, 2), WEATHER)
+        self.assertEqual(self.breaker.state, BreakerState.CLOSED)
+
+    def test_slow_calls_count_as_failures(self):
+        self.breaker.slow_call_duration = 0.01
+
+        def slow_weather(*args, **kwargs):
+            time.sleep(0.02)
+            return WEATHER
+
+        self.backend.getWeather.side_effect = slow_weather
+        for _ in range(3):
+            self.assertEqual(self.provider.getWeather(1, 2), WEATHER)
+        self.assertEqual(self.breaker.state, BreakerState.OPEN)
+        self.assertEqual(metrics.counter("test.breaker.slow_calls"), 3)
+
+    def test_deadline_exceeded_skips_provider(self):
+        with deadline(0):
+            self.assertIsNone(self.provider.getWeather(1, 2))
+        self.backend.getWeather.assert_not_called()
+        self.assertEqual(self.breaker.failures, 0)
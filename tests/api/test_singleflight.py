@@ -0,0 +1,129 @@
+import contextlib
+import datetime
+import tempfile
+import threading
+import time
+from unittest import mock
+
+from django.test import TestCase, override_settings
+
+from api import metrics
+from api.deadlines import deadline
+from api.singleflight import SingleFlight, SingleFlightWeatherProvider, file_lock
+from api.weather_cache import CachedWeatherProvider, cache_key
+
+WEATHER = {"id": 800, "title": "Clear", "description": "clear sky"}
+
+
+class SlowProvider:
+    "blocks until released, so that concurrent lookups overlap"
+
+    def __init__(self, error=None):
+        self.release = threading.Event()
+        self.calls = 0
+        self.error = error
+
+    def getWeather(self, lat, lon, when=None, quiet_fail=True):
+        self.calls += 1
+        self.release.wait(timeout=5)
+        if self.error:
+            raise self.error
+        return WEATHER
+
+
+class TestSingleFlight(TestCase):
+    def setUp(self):
+        metrics.reset()
+        self.when = datetime.datetime(2020, 5, 1, 10, 0)
+
+    def lookup_concurrently(self, provider, count=5, **kwargs):
+        results = []
+
+        def lookup(minute):
+            results.append(
+                provider.getWeather(
+                    38.7223,
+                    -9.1393,
+                    when=self.when + datetime.timedelta(minutes=minute),
+                    **kwargs
+                )
+            )
+
+        threads = [threading.Thread(target=lookup, args=(i,)) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        while metrics.counter("weather.singleflight.coalesced") < count - 1:
+            time.sleep(0.001)
+        provider.provider.release.set()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_concurrent_lookups_share_one_call(self):
+        provider = SingleFlightWeatherProvider(SlowProvider())
+        results = self.lookup_concurrently(provider)
+
+        self.assertEqual(results, [WEATHER] * 5)
+        self.assertEqual(provider.provider.calls, 1)
+
+    def test_errors_are_shared(self):
+        provider = SingleFlightWeatherProvider(SlowProvider(ConnectionError("down")))
+        results = self.lookup_concurrently(provider)
+
+        self.assertEqual(results, [None] * 5)
+        self.assertEqual(provider.provider.calls, 1)
+
+    def test_later_calls_are_not_coalesced(self):
+        flights = SingleFlight()
+        self.assertEqual(flights.do("key", lambda: 1), 1)
+        self.assertEqual(flights.do("key", lambda: 2), 2)
+
+
+class TestCrossWorkerSingleFlight(TestCase):
+    def test_cache_is_checked_again_under_the_lock(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(WEATHER_SINGLEFLIGHT_LOCK_DIR=directory):
+                backend = mock.MagicMock()
+                backend.getWeather.return_value = WEATHER
+                provider = CachedWeatherProvider(backend)
+                when = datetime.datetime(2020, 5, 1, 10, 0)
+
+                # another worker caches the weather while this one waits
+                with mock.patch.object(provider, "lookup", side_effect=[None, WEATHER]):
+                    self.assertEqual(
+                        provider.getWeather(38.7223, -9.1393, when=when), WEATHER
+                    )
+                backend.getWeather.assert_not_called()
+
+    def test_lock_wait_is_bounded(self):
+        metrics.reset()
+        when = datetime.datetime(2020, 5, 1, 10, 0)
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(
+                WEATHER_SINGLEFLIGHT_LOCK_DIR=directory,
+                WEATHER_SINGLEFLIGHT_LOCK_WAIT=0.05,
+            ):
+                backend = mock.MagicMock()
+                backend.getWeather.return_value = WEATHER
+                provider = CachedWeatherProvider(backend)
+                key = cache_key(38.7223, -9.1393, when)
+
+                # held by another worker: looked up upstream after the wait
+                with file_lock(directory, key, timeout=1) as locked:
+                    self.assertTrue(locked)
+                    for limit in [contextlib.nullcontext(), deadline(0.01)]:
+                        start = time.monotonic()
+                        with limit:
+                            with mock.patch.object(
+                                provider, "lookup", return_value=None
+                            ):
+                                self.assertEqual(
+                                    provider.getWeather(38.7223, -9.1393, when=when),
+                                    WEATHER,
+                                )
+                        self.assertLess(time.monotonic() - start, 1)
+
+                self.assertEqual(backend.getWeather.call_count, 2)
+                self.assertEqual(
+                    metrics.counter("weather.singleflight.lock_timeouts"), 2
+                )
@@ -0,0 +1,101 @@
+import datetime
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase
+from rest_framework import status
+
+from api.models import Activity, ActivityDays, User
+from api.rollups import activity_day_stats
+
+
+class TestStreaks(TestCase):
+    @mock.patch("api.external_sources.WeatherProvider.getWeather")
+    def setUp(self, mock_get_weather):
+        mock_get_weather.return_value = None
+        self.user = User.objects.create_user(username="user1", password="123456")
+        User.objects.create_user(username="user2", password="123456")
+
+        # 5 days streak over new year, then 2 days, then 3 days (twice a day)
+        days = [
+            datetime.date(2019, 12, 29) + datetime.timedelta(days=i) for i in range(5)
+        ]
+        days += [datetime.date(2020, 1, 10), datetime.date(2020, 1, 11)]
+        days += [
+            datetime.date(2020, 2, 1) + datetime.timedelta(days=i) for i in range(3)
+        ]
+        for day in days + days[-3:]:
+            self.create_activity(day)
+
+    def create_activity(self, date):
+        return Activity.objects.create(
+            date=date,
+            time=datetime.time(8, 0),
+            distance=1000,
+            duration=datetime.timedelta(minutes=5),
+            user=self.user,
+            latitude=0,
+            longitude=0,
+        )
+
+    def test_bitmap_is_compact(self):
+        row = ActivityDays.objects.get(user=self.user, year=2020)
+        self.assertEqual(len(row.days), 46)
+        self.assertEqual(bin(row.bitmap).count("1"), 7)
+
+    def test_stats(self):
+        stats = activity_day_stats(self.user.id, datetime.date(2020, 2, 3))
+        self.assertDictEqual(
+            stats,
+            {
+                "current_streak": 3,
+                "longest_streak": 5,
+                "days_this_year": 7,
+                "days_last_30_days": 5,
+            },
+        )
+
+    def test_streak_alive_until_today_ends(self):
+        stats = activity_day_stats(self.user.id, datetime.date(2020, 2, 4))
+        self.assertEqual(stats["current_streak"], 3)
+
+        stats = activity_day_stats(self.user.id, datetime.date(2020, 2, 5))
+        self.assertEqual(stats["current_streak"], 0)
+
+    def test_streak_over_new_year(self):
+        stats = activity_day_stats(self.user.id, datetime.date(2020, 1, 2))
+        self.assertEqual(stats["current_streak"], 5)
+        self.assertEqual(stats["days_this_year"], 2)
+
+    def test_delete_clears_day_only_without_other_activities(self):
+        Activity.objects.filter(date=datetime.date(2020, 2, 3)).first().delete()
+        stats = activity_day_stats(self.user.id, datetime.date(2020, 2, 3))
+        self.assertEqual(stats["current_streak"], 3)
+
+        Activity.objects.filter(date=datetime.date(2020, 2, 3)).first().delete()
+        stats = activity_day_stats(self.user.id, datetime.date(2020, 2, 3))
+        self.assertEqual(stats["current_streak"], 2)
+
+    def test_rebuild(self):
+        expected = list(ActivityDays.objects.values_list("user", "year", "days"))
+        ActivityDays.objects.all().delete()
+
+        call_command("rebuild_rollups", stdout=mock.MagicMock())
+
+        self.assertEqual(
+            [(u, y, bytes(d)) for u, y, d in expected],
+            [
+                (u, y, bytes(d))
+                for u, y, d in ActivityDays.objects.values_list("user", "year", "days")
+            ],
+        )
+
+    def test_streaks_endpoint(self):
+        self.client.login(username="user1", password="123456")
+        response = self.client.get("/api/v1/users/user1/streaks")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["longest_streak"], 5)
+
+        self.client.login(username="user2", password="123456")
+        response = self.client.get("/api/v1/users/user1/streaks")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
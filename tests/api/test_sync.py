@@ -0,0 +1,190 @@
+import datetime
+from unittest import mock
+from urllib.parse import urlencode
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework import status
+
+from api.models import Activity, ActivityTombstone, ChangeSequence, User
+from api.deletion import delete_user
+from api.sync import Cursor, stamp
+
+SYNC_URL = "/api/v1/activities/sync"
+MATCHING_URL = "/api/v1/activities/matching"
+
+
+@override_settings(WEATHER_CACHE_ENABLED=False)
+class TestSync(TestCase):
+    @mock.patch("api.external_sources.WeatherProvider.getWeather")
+    def setUp(self, mock_get_weather):
+        mock_get_weather.return_value = None
+        self.user1 = User.objects.create_user(username="user1", password="123456")
+        self.user2 = User.objects.create_user(username="user2", password="123456")
+        User.objects.create_superuser(
+            username="useradmin", email=None, password="123456"
+        )
+        for user, day in [(self.user1, 1), (self.user1, 2), (self.user1, 3)]:
+            self.create(user, day)
+        self.create(self.user2, 1)
+
+    def create(self, user, day):
+        return Activity.objects.create(
+            user=user,
+            date=datetime.date(2020, 5, day),
+            time=datetime.time(10, 0),
+            distance=5000,
+            duration=datetime.timedelta(minutes=30),
+        )
+
+    def sync(self, **params):
+        response = self.client.get("%s?%s" % (SYNC_URL, urlencode(params)))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def dates(self, data):
+        return [activity["date"] for activity in data["activities"]]
+
+    @mock.patch("api.external_sources.WeatherProvider.getWeather")
+    def test_sync(self, mock_get_weather):
+        mock_get_weather.return_value = None
+        self.client.login(username="user1", password="123456")
+
+        # from scratch, in pages
+        first = self.sync(limit=2)
+        self.assertEqual(self.dates(first), ["2020-05-01", "2020-05-02"])
+        self.assertTrue(first["more"])
+        second = self.sync(cursor=first["cursor"], limit=2)
+        self.assertEqual(self.dates(second), ["2020-05-03"])
+        self.assertEqual(second["deleted"], [])
+        self.assertFalse(second["more"])
+        self.assertEqual(self.sync(cursor=second["cursor"])["activities"], [])
+
+        first_id, second_id, _ = [
+            a["id"] for a in first["activities"] + second["activities"]
+        ]
+        self.client.patch(
+            "/api/v1/activities/%d" % second_id,
+            {"distance": 6000},
+            content_type="application/json",
+        )
+        self.client.delete("/api/v1/activities/%d" % first_id)
+        self.create(self.user1, 4)
+        self.client.delete(
+            "/api/v1/activities/%d" % Activity.objects.get(user=self.user2).id
+        )
+
+        changes = self.sync(cursor=second["cursor"])
+        self.assertEqual(self.dates(changes), ["2020-05-02", "2020-05-04"])
+        self.assertEqual(changes["activities"][0]["distance"], 6000)
+        # only the caller's deletions
+        self.assertEqual(changes["deleted"], [first_id])
+        self.assertFalse(changes["more"])
+
+    def test_set_based_writes_are_synced(self):
+        self.client.login(username="useradmin", password="123456")
+        cursor = self.sync()["cursor"]
+
+        self.client.patch(
+            "%s?%s" % (MATCHING_URL, urlencode({"q": "(date eq '2020-05-02')"})),
+            {"distance": {"multiply": 2}},
+            content_type="application/json",
+        )
+        self.client.delete(
+            "%s?%s" % (MATCHING_URL, urlencode({"q": "(date eq '2020-05-01')"}))
+        )
+
+        changes = self.sync(cursor=cursor)
+        self.assertEqual(self.dates(changes), ["2020-05-02"])
+        self.assertEqual(changes["activities"][0]["distance"], 10000)
+        self.assertEqual(len(changes["deleted"]), 2)
+        self.assertEqual(ActivityTombstone.objects.count(), 2)
+
+    def test_deleted_users_are_synced(self):
+        self.client.login(username="useradmin", password="123456")
+        cursor = self.sync()["cursor"]
+        ids = list(
+            Activity.objects.filter(user=self.user1).values_list("id", flat=True)
+        )
+
+        delete_user(self.user1.id, chunk_size=2)
+
+        changes = self.sync(cursor=cursor)
+        self.assertEqual(changes["activities"], [])
+        self.assertEqual(sorted(changes["deleted"]), sorted(ids))
+
+    def test_moved_activities_are_synced(self):
+        cursors = {}
+        for username in ["user1", "user2", "useradmin"]:
+            self.client.login(username=username, password="123456")
+            cursors[username] = self.sync()["cursor"]
+        activity = Activity.objects.filter(user=self.user1).first()
+
+        self.client.patch(
+            "/api/v1/activities/%d" % activity.id,
+            {"user": "user2"},
+            content_type="application/json",
+        )
+
+        for username, activities, deleted in [
+            ("user1", [], [activity.id]),
+            ("user2", [activity.id], []),
+            ("useradmin", [activity.id], []),
+        ]:
+            self.client.login(username=username, password="123456")
+            changes = self.sync(cursor=cursors[username])
+            self.assertEqual([a["id"] for a in changes["activities"]], activities)
+            self.assertEqual(changes["deleted"], deleted, username)
+
+    def test_late_commits_are_synced(self):
+        self.client.login(username="user1", password="123456")
+        cursor = self.sync()["cursor"]
+        # written at the start of a long transaction (eg: an import)...
+        late = self.create(self.user1, 4)
+        Activity.objects.filter(id=late.id).update(
+            updated_at=timezone.now() - datetime.timedelta(minutes=10)
+        )
+        # ... committed after a change synced meanwhile
+        Activity.objects.filter(id=late.id).update(change_seq=None)
+
+        changes = self.sync(cursor=cursor)
+        self.assertEqual([a["id"] for a in changes["activities"]], [late.id])
+
+        self.create(self.user1, 5)
+        cursor = changes["cursor"]
+        # committed later, though written first
+        Activity.objects.filter(id=late.id).update(change_seq=None)
+        changes = self.sync(cursor=cursor)
+        self.assertEqual(self.dates(changes), ["2020-05-04", "2020-05-05"])
+
+    def test_invalid_or_expired_cursor(self):
+        self.client.login(username="user1", password="123456")
+        ChangeSequence.objects.update_or_create(
+            id=ChangeSequence.ID, defaults={"value": 20, "pruned": 10}
+        )
+
+        for expired in [Cursor(None, (5, None)), Cursor(None, (10, 3))]:
+            response = self.client.get(SYNC_URL, {"cursor": expired.encode()})
+            self.assertEqual(response.status_code, status.HTTP_410_GONE)
+        response = self.client.get(
+            SYNC_URL, {"cursor": Cursor(None, (10, None)).encode()}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        for cursor in ["nonsense", Cursor(None, (12, None)).encode()[:-4]]:
+            response = self.client.get(SYNC_URL, {"cursor": cursor})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_prune(self):
+        ActivityTombstone.record([(1, self.user1.id), (2, self.user1.id)])
+        ActivityTombstone.objects.filter(activity_id=1).update(
+            deleted_at=timezone.now() - datetime.timedelta(days=31)
+        )
+
+        last = stamp().value
+
+        self.assertEqual(ActivityTombstone.prune(), 1)
+        self.assertEqual(ChangeSequence.objects.get().pruned, last)
+        self.assertEqual(
+            list(ActivityTombstone.objects.values_list("activity_id", flat=True)), [2]
+        )
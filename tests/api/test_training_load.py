@@ -0,0 +1,115 @@
+import datetime
+import math
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase
+from rest_framework import status
+
+from api.models import Activity, TrainingLoad, User
+from api.rollups import activity_load
+
+
+class TestTrainingLoad(TestCase):
+    @mock.patch("api.external_sources.WeatherProvider.getWeather")
+    def setUp(self, mock_get_weather):
+        mock_get_weather.return_value = None
+        self.user1 = User.objects.create_user(username="user1", password="123456")
+        User.objects.create_user(username="user2", password="123456")
+
+        for day in [1, 2, 5]:
+            self.create_activity(datetime.date(2020, 3, day))
+
+    def create_activity(self, date, distance=5040):
+        "30 minutes at the reference speed: load = 30"
+        return Activity.objects.create(
+            date=date,
+            time=datetime.time(8, 0),
+            distance=distance,
+            duration=datetime.timedelta(minutes=30),
+            user=self.user1,
+            latitude=0,
+            longitude=0,
+        )
+
+    def loads(self):
+        return list(
+            TrainingLoad.objects.filter(user=self.user1).values_list(
+                "date", "load", "acute", "chronic"
+            )
+        )
+
+    def test_activity_load(self):
+        self.assertAlmostEqual(
+            activity_load(5040, datetime.timedelta(minutes=30)), 30.0
+        )
+        self.assertAlmostEqual(
+            activity_load(10080, datetime.timedelta(minutes=30)), 120.0
+        )
+        self.assertEqual(activity_load(100, datetime.timedelta(0)), 0.0)
+
+    def test_acute_load(self):
+        acute_gain = 1 - math.exp(-1 / 7)
+        day1 = 30 * acute_gain
+        day2 = day1 * math.exp(-1 / 7) + 30 * acute_gain
+        day5 = day2 * math.exp(-3 / 7) + 30 * acute_gain
+
+        acutes = [row[2] for row in self.loads()]
+        self.assertEqual(len(acutes), 3)
+        for expected, acute in zip([day1, day2, day5], acutes):
+            self.assertAlmostEqual(expected, acute)
+
+    @mock.patch("api.external_sources.WeatherProvider.getWeather")
+    def test_incremental_update_matches_rebuild(self, mock_get_weather):
+        mock_get_weather.return_value = None
+        activity = self.create_activity(datetime.date(2020, 3, 3), distance=8000)
+        activity.date = datetime.date(2020, 3, 4)
+        activity.save()
+        Activity.objects.filter(date=datetime.date(2020, 3, 1)).get().delete()
+        incremental = self.loads()
+
+        call_command("rebuild_rollups", stdout=mock.MagicMock())
+
+        self.assertEqual(len(incremental), 3)
+        for row, rebuilt in zip(incremental, self.loads()):
+            self.assertEqual(row[0], rebuilt[0])
+            for value, rebuilt_value in zip(row[1:], rebuilt[1:]):
+                self.assertAlmostEqual(value, rebuilt_value)
+
+    def test_training_load_endpoint(self):
+        self.client.login(username="user1", password="123456")
+        response = self.client.get(
+            "/api/v1/users/user1/training-load?start=2020-02-29&end=2020-03-06"
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 7)
+        self.assertEqual(
+            response.data[0],
+            {
+                "date": "2020-02-29",
+                "load": 0.0,
+                "acute_load": 0.0,
+                "chronic_load": 0.0,
+                "form": 0.0,
+            },
+        )
+        self.assertEqual(response.data[1]["load"], 30.0)
+        self.assertEqual(response.data[3]["load"], 0.0)
+        self.assertLess(response.data[3]["acute_load"], response.data[2]["acute_load"])
+        self.assertLess(response.data[6]["form"], 0)
+
+    def test_training_load_endpoint_invalid_range(self):
+        self.client.login(username="user1", password="123456")
+        response = self.client.get(
+            "/api/v1/users/user1/training-load?start=2020-03-06&end=2020-03-01"
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.get("/api/v1/users/user1/training-load?end=yesterday")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_training_load_of_others_not_found(self):
+        self.client.login(username="user2", password="123456")
+        response = self.client.get("/api/v1/users/user1/training-load")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
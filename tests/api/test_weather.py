@@ -1,10 +1,10 @@
 from unittest import mock
 
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
 from django.utils import timezone
 from rest_framework import status
 
-from api.models import Weather
+from api.models import User, Weather, weather_catalog
 
 
 class TestWeather(TestCase):
@@ -54,3 +54,59 @@ class TestWeather(TestCase):
         self.assertEqual(activity.id, 5)
         self.assertEqual(activity.title, "Titl")
         self.assertEqual(activity.description, "Desc")
+
+
+class TestWeatherCatalog(TransactionTestCase):
+    def setUp(self):
+        weather_catalog.reset()
+        Weather.objects.create(id=501, title="Rain", description="moderate rain")
+        Weather.objects.create(id=500, title="Rain", description="light rain")
+        User.objects.create_user(username="user1", password="123456")
+
+    def tearDown(self):
+        weather_catalog.reset()
+
+    def test_upsert(self):
+        weather = Weather.get_or_create(id=800, title="Clear", description="sky")
+        self.assertEqual(Weather.objects.get(id=800).title, "Clear")
+
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                Weather.get_or_create(id=800, title="Clear", description="sky"),
+                weather,
+            )
+
+    def test_upsert_into_cold_catalog(self):
+        Weather.get_or_create(id=800, title="Clear", description="sky")
+
+        self.assertEqual([w.id for w in weather_catalog.all()], [500, 501, 800])
+        with self.assertNumQueries(0):
+            self.assertEqual(weather_catalog.get_by_title("Rain").id, 500)
+
+    def test_lookups_from_memory(self):
+        weather_catalog.all()
+        with self.assertNumQueries(0):
+            self.assertEqual(weather_catalog.get(501).description, "moderate rain")
+            self.assertEqual(weather_catalog.get_by_title("Rain").id, 500)
+            self.assertEqual([w.id for w in weather_catalog.all()], [500, 501])
+
+    def test_edits_reset_catalog(self):
+        weather_catalog.all()
+        Weather.objects.filter(id=500).get().delete()
+        self.assertEqual(weather_catalog.get_by_title("Rain").id, 501)
+
+    def test_weather_endpoints(self):
+        self.client.login(username="user1", password="123456")
+        self.client.get("/api/v1/weather")
+
+        with self.assertNumQueries(4):  # session and auth user, per request
+            response = self.client.get("/api/v1/weather")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data["count"], 2)
+
+            response = self.client.get("/api/v1/weather/Rain")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data["id"], 500)
+
+        response = self.client.get("/api/v1/weather/Snow")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
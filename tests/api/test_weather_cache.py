@@ -0,0 +1,98 @@
+import datetime
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework import status
+
+from api import geohash, metrics
+from api.models import User, WeatherCacheEntry
+from api.weather_cache import CachedWeatherProvider, evict
+
+
+class TestGeohash(TestCase):
+    def test_encode(self):
+        self.assertEqual(geohash.encode(57.64911, 10.40744, 11), "u4pruydqqvj")
+
+    def test_decode(self):
+        lat, lon = geohash.decode("u4pruydqqvj")
+        self.assertAlmostEqual(lat, 57.64911, places=4)
+        self.assertAlmostEqual(lon, 10.40744, places=4)
+
+
+@override_settings(WEATHER_CACHE_PRECISION=6, WEATHER_CACHE_BUCKET=3600)
+class TestCachedWeatherProvider(TestCase):
+    def setUp(self):
+        metrics.reset()
+        self.backend = mock.MagicMock()
+        self.backend.getWeather.return_value = {
+            "id": 800,
+            "title": "Clear",
+            "description": "clear sky",
+        }
+        self.provider = CachedWeatherProvider(self.backend)
+        self.when = datetime.datetime(2020, 5, 1, 10, 5)
+
+    def test_same_place_and_hour_is_cached(self):
+        first = self.provider.getWeather(38.7223, -9.1393, when=self.when)
+        second = self.provider.getWeather(
+            38.7224, -9.1392, when=self.when + datetime.timedelta(minutes=30)
+        )
+
+        self.assertEqual(first, second)
+        self.assertEqual(self.backend.getWeather.call_count, 1)
+        self.assertEqual(metrics.counter("weather.cache.hits"), 1)
+        self.assertEqual(metrics.counter("weather.cache.misses"), 1)
+        self.assertEqual(metrics.snapshot()["gauges"]["weather.cache.hit_ratio"], 0.5)
+
+    def test_other_place_or_hour_is_not_cached(self):
+        self.provider.getWeather(38.7223, -9.1393, when=self.when)
+        self.provider.getWeather(41.1579, -8.6291, when=self.when)
+        self.provider.getWeather(
+            38.7223, -9.1393, when=self.when + datetime.timedelta(hours=1)
+        )
+        self.assertEqual(self.backend.getWeather.call_count, 3)
+
+    def test_failures_are_not_cached(self):
+        self.backend.getWeather.return_value = None
+        self.assertIsNone(self.provider.getWeather(38.7223, -9.1393, when=self.when))
+        self.assertEqual(WeatherCacheEntry.objects.count(), 0)
+
+    def test_expired_entries_are_refreshed(self):
+        self.provider.getWeather(38.7223, -9.1393, when=self.when)
+        WeatherCacheEntry.objects.update(expires_at=timezone.now())
+
+        self.provider.getWeather(38.7223, -9.1393, when=self.when)
+        self.assertEqual(self.backend.getWeather.call_count, 2)
+        self.assertEqual(WeatherCacheEntry.objects.count(), 1)
+
+    @override_settings(WEATHER_CACHE_MAX_ENTRIES=2)
+    def test_evict(self):
+        for hour in range(4):
+            self.provider.getWeather(
+                38.7223, -9.1393, when=self.when + datetime.timedelta(hours=hour)
+            )
+        WeatherCacheEntry.objects.filter(
+            bucket=min(WeatherCacheEntry.objects.values_list("bucket", flat=True))
+        ).update(expires_at=timezone.now())
+
+        self.assertEqual(evict(), 2)
+        self.assertEqual(WeatherCacheEntry.objects.count(), 2)
+
+
+class TestMetricsEndpoint(TestCase):
+    def setUp(self):
+        User.objects.create_user(username="user1", password="123456")
+        User.objects.create_superuser(
+            username="useradmin", email=None, password="123456"
+        )
+
+    def test_metrics_for_admins_only(self):
+        self.client.login(username="user1", password="123456")
+        response = self.client.get("/api/v1/metrics")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.login(username="useradmin", password="123456")
+        response = self.client.get("/api/v1/metrics")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn("weather.cache.hit_ratio", response.data["gauges"])
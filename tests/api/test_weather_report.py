@@ -0,0 +1,108 @@
+import datetime
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase
+from rest_framework import status
+
+from api.models import Activity, User, weather_catalog
+
+
+class TestWeatherReport(TestCase):
+    @mock.patch("api.external_sources.WeatherProvider.getWeather")
+    def setUp(self, mock_get_weather):
+        cache.clear()
+        weather_catalog.reset()
+        self.user = User.objects.create_user(username="user1", password="123456")
+        User.objects.create_user(username="user2", password="123456")
+
+        for weather, distance, minutes in [
+            ({"id": 500, "title": "Rain", "description": "light rain"}, 1000, 5),
+            ({"id": 500, "title": "Rain", "description": "light rain"}, 2000, 15),
+            ({"id": 800, "title": "Clear", "description": "clear sky"}, 3000, 10),
+            ({"id": 501, "title": "Rain", "description": "moderate rain"}, 1000, 10),
+            (None, 600, 2),
+        ]:
+            mock_get_weather.return_value = weather
+            self.create_activity(distance, minutes)
+
+    def create_activity(self, distance, minutes):
+        return Activity.objects.create(
+            date=datetime.date(2020, 1, 1),
+            time=datetime.time(8, 0),
+            distance=distance,
+            duration=datetime.timedelta(minutes=minutes),
+            user=self.user,
+            latitude=0,
+            longitude=0,
+        )
+
+    def test_weather_report(self):
+        self.client.login(username="user1", password="123456")
+        response = self.client.get("/api/v1/users/user1/weather-report")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [dict(row) for row in response.data],
+            [
+                {
+                    "weather_id": None,
+                    "weather": None,
+                    "weather_description": None,
+                    "count": 1,
+                    "distance": 600,
+                    "average_distance": 600.0,
+                    "average_speed": 5.0,
+                },
+                {
+                    "weather_id": 500,
+                    "weather": "Rain",
+                    "weather_description": "light rain",
+                    "count": 2,
+                    "distance": 3000,
+                    "average_distance": 1500.0,
+                    "average_speed": 2.5,
+                },
+                {
+                    "weather_id": 501,
+                    "weather": "Rain",
+                    "weather_description": "moderate rain",
+                    "count": 1,
+                    "distance": 1000,
+                    "average_distance": 1000.0,
+                    "average_speed": 1.667,
+                },
+                {
+                    "weather_id": 800,
+                    "weather": "Clear",
+                    "weather_description": "clear sky",
+                    "count": 1,
+                    "distance": 3000,
+                    "average_distance": 3000.0,
+                    "average_speed": 5.0,
+                },
+            ],
+        )
+
+    def test_weather_report_of_others_not_found(self):
+        self.client.login(username="user2", password="123456")
+        response = self.client.get("/api/v1/users/user1/weather-report")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    @mock.patch("api.external_sources.WeatherProvider.getWeather")
+    def test_weather_report_cached_until_writes(self, mock_get_weather):
+        self.client.login(username="user1", password="123456")
+        self.client.get("/api/v1/users/user1/weather-report")
+
+        with self.assertNumQueries(3):  # session, auth user, get_object
+            response = self.client.get("/api/v1/users/user1/weather-report")
+        self.assertEqual(response.data[1]["count"], 2)
+
+        mock_get_weather.return_value = {
+            "id": 500,
+            "title": "Rain",
+            "description": "light rain",
+        }
+        self.create_activity(500, 5)
+        response = self.client.get("/api/v1/users/user1/weather-report")
+        self.assertEqual(response.data[1]["count"], 3)
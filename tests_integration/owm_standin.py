@@ -0,0 +1,147 @@
+"""Local stand-in of the OpenWeatherMap API, with latency and failure injection
+
+Serves the endpoint used by OpenWeatherMapProvider (/data/2.5/weather) from a
+thread, on localhost. Point the app to it with OWM_BASE_URL = standin.url.
+"""
+
+import json
+import random
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+
+# (id, main, description) of the conditions served, by coordinates
+CONDITIONS = [
+    (800, "Clear", "clear sky"),
+    (803, "Clouds", "broken clouds"),
+    (500, "Rain", "light rain"),
+    (701, "Mist", "mist"),
+]
+
+
+def constant(seconds: float) -> Callable[[random.Random], float]:
+    return lambda rng: seconds
+
+
+def lognormal(median: float, sigma: float = 0.5) -> Callable[[random.Random], float]:
+    "latencies with a long tail, typical of remote APIs"
+    return lambda rng: median * rng.lognormvariate(0, sigma)
+
+
+class OWMStandIn:
+    """Stand-in OWM API. Each request waits `latency(rng)` seconds, then fails
+    with a 429 with probability `rate_limit_rate`, with a 500 with probability
+    `error_rate`, or answers with the observed weather at the coordinates"""
+
+    def __init__(
+        self,
+        latency: Callable[[random.Random], float] = constant(0),
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        seed: Optional[int] = 42,
+    ):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return "http://%s:%d" % (host, port)
+
+    def start(self) -> "OWMStandIn":
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                standin.handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "OWMStandIn":
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _draw(self):
+        with self._lock:
+            self.requests += 1
+            return (
+                self.latency(self.rng),
+                self.rng.random() < self.rate_limit_rate,
+                self.rng.random() < self.error_rate,
+            )
+
+    def handle(self, request: BaseHTTPRequestHandler):
+        url = urllib.parse.urlsplit(request.path)
+        if url.path != "/data/2.5/weather":
+            return self._reply(request, 404, {"cod": "404", "message": "not found"})
+
+        latency, rate_limited, error = self._draw()
+        time.sleep(latency)
+        if rate_limited:
+            with self._lock:
+                self.rate_limited += 1
+            return self._reply(
+                request, 429, {"cod": 429, "message": "Your account is blocked"}
+            )
+        if error:
+            with self._lock:
+                self.errors += 1
+            return self._reply(request, 500, {"cod": 500, "message": "Internal error"})
+
+        query = urllib.parse.parse_qs(url.query)
+        lat, lon = float(query["lat"][0]), float(query["lon"][0])
+        return self._reply(request, 200, observation(lat, lon))
+
+    @staticmethod
+    def _reply(request: BaseHTTPRequestHandler, status: int, payload: dict):
+        body = json.dumps(payload).encode()
+        try:
+            request.send_response(status)
+            request.send_header("Content-Type", "application/json")
+            request.send_header("Content-Length", str(len(body)))
+            request.end_headers()
+            request.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client timed out
+
+
+def observation(lat: float, lon: float) -> dict:
+    "an OWM 2.5 /weather response, with a condition picked from the coordinates"
+    id, main, description = CONDITIONS[int(abs(lat * 10) + abs(lon * 10)) % 4]
+    return {
+        "coord": {"lon": lon, "lat": lat},
+        "weather": [
+            {"id": id, "main": main, "description": description, "icon": "01d"}
+        ],
+        "base": "stations",
+        "main": {"temp": 290.0, "pressure": 1012, "humidity": 60},
+        "wind": {"speed": 3.0, "deg": 200},
+        "clouds": {"all": 20},
+        "dt": int(time.time()),
+        "sys": {"country": "PT", "sunrise": 1588047487, "sunset": 1588092991},
+        "timezone": 0,
+        "id": 2267057,
+        "name": "Stand-in",
+        "cod": 200,
+    }
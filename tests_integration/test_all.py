@@ -167,6 +167,7 @@ class TestAll(TestCase):
                 "date": "2020-01-31",
                 "time": "20:58:00",
                 "weather": "Clouds",
+                "weather_status": "DONE",
                 "user": "myuser",
             },
         )
@@ -207,11 +208,23 @@ class TestAll(TestCase):
         self.assertEqual(response.data["count"], 3)
         self.assertDictEqual(
             response.data["results"][0],
-            {"year": 2019, "week": 15, "distance": 30, "average_speed": 0.167},
+            {
+                "year": 2019,
+                "week": 15,
+                "distance": 30,
+                "average_speed": 0.167,
+                "percentile": None,
+            },
         )
         self.assertDictEqual(
             response.data["results"][1],
-            {"year": 2019, "week": 16, "distance": 10, "average_speed": 0.167},
+            {
+                "year": 2019,
+                "week": 16,
+                "distance": 10,
+                "average_speed": 0.167,
+                "percentile": None,
+            },
         )
         self.assertEqual(response.data["results"][2]["distance"], 20)
 
@@ -0,0 +1,106 @@
+"""Load scenarios: activity writes against the OWM stand-in
+
+Each scenario posts LOAD_TEST_REQUESTS activities (at different places) while
+the stand-in API is healthy, slow or flaky, and reports the throughput and the
+latency percentiles of the writes. They assert timings, so they only run on
+purpose, with LOAD_TEST_REQUESTS set (eg: LOAD_TEST_REQUESTS=40 pytest
+tests_integration/test_load.py --log-cli-level=INFO, to see the reports).
+"""
+
+import logging
+import os
+import time
+import unittest
+
+from django.test import TestCase, override_settings
+from rest_framework import status
+
+from api import metrics
+from api.external_sources import reset_weather_provider
+from api.models import Activity, User
+
+from .owm_standin import OWMStandIn, constant, lognormal
+
+logger = logging.getLogger(__name__)
+
+REQUESTS = int(os.environ.get("LOAD_TEST_REQUESTS", "0"))
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+@unittest.skipUnless(REQUESTS, "set LOAD_TEST_REQUESTS to run the load scenarios")
+@override_settings(
+    WEATHER_CACHE_ENABLED=False,
+    WEATHER_QUOTA_PER_MINUTE=0,
+    WEATHER_ENRICHMENT_ASYNC=False,
+    WEATHER_REQUEST_BUDGET=0.5,
+    WEATHER_HTTP_TIMEOUT=0.3,
+    WEATHER_BREAKER_SLOW_CALL=0.2,
+)
+class TestLoad(TestCase):
+    def setUp(self):
+        metrics.reset()
+        User.objects.create_user(username="runner", password="123456")
+        self.client.login(username="runner", password="123456")
+
+    def tearDown(self):
+        reset_weather_provider()
+
+    def run_scenario(self, name, standin):
+        latencies = []
+        with standin, self.settings(OWM_BASE_URL=standin.url):
+            start = time.monotonic()
+            for i in range(REQUESTS):
+                request_start = time.monotonic()
+                response = self.client.post(
+                    "/api/v1/activities",
+                    {
+                        "date": "2020-05-01",
+                        "time": "10:00",
+                        "distance": 5000,
+                        "duration": "30:00",
+                        "latitude": 38.0 + i / 10,
+                        "longitude": -9.0 - i / 10,
+                    },
+                    content_type="application/json",
+                )
+                latencies.append(time.monotonic() - request_start)
+                self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            elapsed = time.monotonic() - start
+
+        report = {
+            "writes": REQUESTS,
+            "throughput": round(REQUESTS / elapsed, 1),
+            "p50": round(percentile(latencies, 0.5), 3),
+            "p95": round(percentile(latencies, 0.95), 3),
+            "p99": round(percentile(latencies, 0.99), 3),
+            "upstream_requests": standin.requests,
+            "upstream_errors": standin.errors,
+            "upstream_429": standin.rate_limited,
+            "with_weather": Activity.objects.filter(weather__isnull=False).count(),
+        }
+        logger.info("%s: %s", name, report)
+        return report
+
+    def test_healthy_provider(self):
+        report = self.run_scenario("healthy", OWMStandIn(latency=constant(0.005)))
+        self.assertEqual(report["with_weather"], REQUESTS)
+
+    def test_slow_provider_is_bounded_by_budget(self):
+        report = self.run_scenario(
+            "slow", OWMStandIn(latency=lognormal(median=0.4, sigma=0.3))
+        )
+        # per-call timeout, request budget and circuit breaker bound the writes
+        self.assertLess(report["p99"], 0.5 + 0.25)
+        self.assertLess(report["upstream_requests"], REQUESTS)
+
+    def test_flaky_provider(self):
+        report = self.run_scenario(
+            "flaky",
+            OWMStandIn(latency=constant(0.005), error_rate=0.2, rate_limit_rate=0.1),
+        )
+        self.assertGreater(report["upstream_errors"] + report["upstream_429"], 0)
+        self.assertGreater(report["with_weather"], 0)